@@ -23,8 +23,21 @@ import logging
 import threading
 import array
 import time
-from multiprocessing import Process, Value
+from multiprocessing import Process, Value, Pipe
+from multiprocessing.connection import wait
 from openANT.Powermeter_Data import Powermeter_Data
+from openANT.Powermeter_Telemetry import Powermeter_Telemetry, clock
+from openANT.Powermeter_Ring import Powermeter_Ring
+from openANT.Powermeter_Rate import Powermeter_Rate
+from openANT.Powermeter_Timeline import Powermeter_Timeline, GAP, Resync
+from openANT.Powermeter_Cycle import Powermeter_Cycle
+from openANT.Powermeter_Predictor import Powermeter_Predictor, predictAngle, PREDICTOR_FIELDS
+from openANT.Powermeter_Scheduler import Powermeter_Scheduler
+from openANT.Powermeter_Decoder import (decodePage, convert, ID_NONE, ID_OCA, ID_FORCE_LEFT, ID_FORCE_RIGHT,
+                                        ID_FORCE_TOTAL, ID_TORQUE_LEFT, ID_TORQUE_RIGHT, ID_TORQUE_TOTAL, ID_POWER,
+                                        ID_CRANK_ANGLE, ID_CADENCE, ID_BALANCE_LEFT, ID_BALANCE_RIGHT,
+                                        ID_TORQUE_EFF_LEFT, ID_TORQUE_EFF_RIGHT, ID_PEDAL_SMOOTH_LEFT,
+                                        ID_PEDAL_SMOOTH_RIGHT)
 
 ## Constants
 NETWORK_KEY = [0xB9, 0xA5, 0x21, 0xFB, 0xBD, 0x72, 0xC3, 0x45]
@@ -35,25 +48,34 @@ PAGE_BATTERY_STATUS    = 0x52
 PAGE_FAST_DATA_50Hz    = 0xF2
 PAGE_FAST_DATA_01_5Hz  = 0xF3
 PAGE_FAST_DATA_02_5Hz  = 0xF4
+PAGES_FAST_DATA        = (PAGE_FAST_DATA_50Hz, PAGE_FAST_DATA_01_5Hz, PAGE_FAST_DATA_02_5Hz)
 
-# ROTOR - Message IDs
-ID_NONE                 = 0x00
-ID_OCA                  = 0x1C      # Optimal Cycling Angle
-ID_FORCE_LEFT           = 0x0A
-ID_FORCE_RIGHT          = 0x0C
-ID_FORCE_TOTAL          = 0x0E
-ID_TORQUE_LEFT          = 0x0B
-ID_TORQUE_RIGHT         = 0x0D
-ID_TORQUE_TOTAL         = 0x0F
-ID_POWER                = 0x14
-ID_CRANK_ANGLE          = 0x03
-ID_CADENCE              = 0x06
-ID_BALANCE_LEFT         = 0x23
-ID_BALANCE_RIGHT        = 0x26
-ID_TORQUE_EFF_LEFT      = 0x21
-ID_TORQUE_EFF_RIGHT     = 0x25
-ID_PEDAL_SMOOTH_LEFT    = 0x22
-ID_PEDAL_SMOOTH_RIGHT   = 0x25
+# Samples written to the ring for a lost frame
+LOST_FRAME = ((ID_NONE, 0),)
+
+# Seconds between two updates of the inter-arrival percentiles in the telemetry (each scans a histogram)
+PERCENTILE_REFRESH = 1.0
+
+# POWERMETER - Retries of an acknowledged command before giving up
+PM_COMMAND_RETRIES = 9
+
+# POWERMETER - Seconds until a failed control request is retried, also how fast the control worker notices an exit
+PM_CONTROL_RETRY = 1.0
+
+# SUPERVISOR - Connection phases reported by the reader process, see getConnectionTimings
+PHASE_STARTED       = "started"         # Reader process started
+PHASE_USB           = "usb"             # ANT+ Stick responded
+PHASE_SEARCHING     = "searching"       # Channel open, searching for the Powermeter
+PHASE_CONNECTED     = "connected"       # First page of the Powermeter received
+PHASE_FASTMODE      = "fastmode"        # First Fast Data page received
+PHASE_CONFIGURED    = "configured"      # FastMode configured
+PHASE_FAILED        = "failed"          # Reader process ended or ANT+ Stick not responding
+
+# SUPERVISOR - Seconds the ANT+ Stick has to respond before the reader process is restarted
+SUPERVISOR_USB_TIMEOUT = 10.0
+
+# SUPERVISOR - Seconds between two connection attempts
+SUPERVISOR_RETRY = 2.0
 
 # POWERMETER - CONTROL MODES
 NORMAL              = 1
@@ -116,12 +138,17 @@ class myOpenAnt_Manager:
         self.__F4_Param02 = Value('i', ID_NONE)
 
         # Processing Variables
-        self.__PM_SampleCount_50Hz          = Value('i', 0)
-        self.__PM_SampleCount_5Hz_Params01  = Value('i', 0)
-        self.__PM_SampleCount_5Hz_Params02  = Value('i', 0)
         self.__HR_SampleCount               = Value('i', 0)
 
-        # Output Variables
+        # Rate, jitter and interleave of the Fast Data pages, estimated in the reading process
+        self.__rate = Powermeter_Rate()
+        self.__percentiles = ()
+        self.__percentileTime = 0.0
+
+        # Frame counter tracking: lost and duplicated frames, frame order and device time of the samples
+        self.__timeline = Powermeter_Timeline(self.PM_Periode_FastMode / 32768.0)
+
+        # Output Variables, copied from the telemetry every sleepy_time
         self.PM_SampleRate_50Hz         = Value('d', 0)
         self.PM_SampleRate_5Hz_Params01 = Value('d', 0)
         self.PM_SampleRate_5Hz_Params02 = Value('d', 0)
@@ -130,37 +157,28 @@ class myOpenAnt_Manager:
         # Data container to share data with other modules
         self.__data = Powermeter_Data()
 
-        # PowerMeter Data
-        self.__BatteryStatus              = Value('i', -1)
-        self.__OCA                        = Value('d', 0.0)
-        self.__Force_left                 = Value('d', 0.0)
-        self.__Force_right                = Value('d', 0.0)
-        self.__Force_total                = Value('d', 0.0)
-        self.__Torque_left                = Value('d', 0.0)
-        self.__Torque_right               = Value('d', 0.0)
-        self.__Torque_total               = Value('d', 0.0)
-        self.__Power                      = Value('d', 0.0)
-        self.__CrankAngle                 = Value('d', 0.0)
-        self.__Cadence                    = Value('d', 0.0)
-        self.__Balance_Left               = Value('d', 0.0)
-        self.__Balance_Right              = Value('d', 0.0)
-        self.__Torque_Efficiency_Left     = Value('d', 0.0)
-        self.__Torque_Efficiency_Right    = Value('d', 0.0)
-        self.__Pedal_Smoothness_Left      = Value('d', 0.0)
-        self.__Pedal_Smoothness_Right     = Value('d', 0.0)
-
-        # Power Processing
-        # self.__Power_TimeStamp_NewCycle = Value('d', 0.0)
-        # self.__Torque_Left_integrated = Value('d', 0.0)
-        # self.__Torque_Right_integrated = Value('d', 0.0)
-        # self.__Torque_Total_integrated = Value('d', 0.0)
-        # self.__Torque_Left_n = Value('d', 0.0)
-        # self.__Torque_Right_n = Value('d', 0.0)
-        # self.__Torque_Total_n = Value('d', 0.0)
-        # self.__Power_Left_AVG = Value('d', 0.0)
-        # self.__Power_Right_AVG = Value('d', 0.0)
-        # self.__Power_Total_AVG = Value('d', 0.0)
-        # self.__Cadence_AVG = Value('d', 0.0)
+        # PowerMeter Data, one record in shared memory written by the reading process (see Powermeter_Telemetry)
+        self.__telemetry = Powermeter_Telemetry()
+
+        # Every received sample, for consumers that must not miss any (see Powermeter_Ring)
+        self.__ring = Powermeter_Ring()
+
+        # Power Processing, one record per revolution into the telemetry (see Powermeter_Cycle)
+        self.__cycle = Powermeter_Cycle()
+
+        # Crank angle prediction compensating the delay of the data, state in the telemetry (see Powermeter_Predictor)
+        self.__predictor = Powermeter_Predictor()
+
+        # Crank angle triggered callbacks, started with the first trigger (see Powermeter_Scheduler)
+        self.__scheduler = None
+
+        # Connection supervisor: status pipe from the reader process and the phases it reported
+        self.__status_Receiver = None
+        self.__status_Sender = None
+        self.__read_Process = None
+        self.__attempts = 0
+        self.__started = 0.0
+        self.__phases = {}
 
 
 
@@ -189,62 +207,121 @@ class myOpenAnt_Manager:
         self.__thread_Connecting_Worker.start()
 
 
-    # Tries to establish a connection to the ANT+ Stick
+    # Supervises the connection: a state machine driven by the connection phases the reader process
+    # reports through a pipe (see __notify) and by the exit of the reader process
     def __connection_worker(self):
 
         sleepy_time = 2.0
+        published = clock()
+
+        self.__startReader()
+
+        while not self.__exit_Event.isSet() and self.__kill.value == 0:
 
-        while not self.__exit_Event.isSet():
+            # Sleep until the reader reports, ends, the ANT+ Stick times out or the rates are due
+            now = clock()
+            if self.USB_STATUS.value == 1:
+                timeout = published + sleepy_time - now
+            else:
+                timeout = min(sleepy_time, self.__started + SUPERVISOR_USB_TIMEOUT - now)
+
+            ready = wait([self.__status_Receiver, self.__read_Process.sentinel], max(0.0, timeout))
+
+            if self.__status_Receiver in ready:
+                try:
+                    while self.__status_Receiver.poll():
+                        (phase, t) = self.__status_Receiver.recv()
+                        self.__phases[phase] = t - self.__started
+                except EOFError:
+                    pass
+
+            # Shutdown requested by clean_exit: the reader process ends by itself, no failure
+            if self.__kill.value == 1:
+                break
 
-            # Start Connecion process
-            if self.USB_STATUS.value == -1:
+            # Reader process ended (no ANT+ Stick, Stick lost) or the Stick does not respond
+            if self.__read_Process.sentinel in ready or \
+               (self.USB_STATUS.value == 0 and clock() - self.__started > SUPERVISOR_USB_TIMEOUT):
 
-                # Trying to connect
                 if self.__activate_Powermeter.value == 1:
-                    self.POWERMETER_State.value = 0
+                    self.POWERMETER_State.value = -2
+
+                print("ANT+ Stick not responding. Retry.")
+                self.__phases[PHASE_FAILED] = clock() - self.__started
+                self.USB_STATUS.value = -1
+                self.__read_Process.terminate()
+                self.__read_Process.join()
+
+                self.__exit_Event.wait(SUPERVISOR_RETRY)
+                if not self.__exit_Event.isSet() and self.__kill.value == 0:
+                    self.__startReader()
+                continue
+
+            if self.USB_STATUS.value == 1 and clock() - published >= sleepy_time:
+
+                # Publish Sample Rates
+                published = clock()
+                (F2, F3, F4) = self.__getRates(self.__telemetry.read(), sleepy_time)
+                self.PM_SampleRate_50Hz.value = F2
+                self.PM_SampleRate_5Hz_Params01.value = F3
+                self.PM_SampleRate_5Hz_Params02.value = F4
+
+
+    # Starts a new reader process with a fresh status pipe
+    def __startReader(self):
+
+        # Trying to connect
+        if self.__activate_Powermeter.value == 1:
+            self.POWERMETER_State.value = 0
+        self.USB_STATUS.value = 0
+
+        if self.__status_Receiver is not None:
+            self.__status_Receiver.close()
+        (self.__status_Receiver, self.__status_Sender) = Pipe(duplex=False)
 
-                self.USB_STATUS.value = 0
-                self.__read_Process = Process(target=self.__connect, args=())
-                self.__read_Process.daemon = True
-                self.__read_Process.start()
+        self.__attempts += 1
+        self.__started = clock()
+        self.__phases = {PHASE_STARTED: 0.0}
 
-                # Wait for a response of the ANT+ Stick to the RESET command
-                while self.USB_STATUS.value == 0:
-                    time.sleep(0.1)
+        self.__read_Process = Process(target=self.__connect, args=())
+        self.__read_Process.daemon = True
+        self.__read_Process.start()
 
+        # Only the reader process writes, so the pipe ends with it
+        self.__status_Sender.close()
+        self.__status_Sender = None
 
-                if self.USB_STATUS.value == -1:
-                    if self.__activate_Powermeter.value == 1:
-                        self.POWERMETER_State.value = -2
 
-                    print("ANT+ Stick not responding. Retry.")
-                    self.__read_Process.terminate()
-                    self.__read_Process.join()
+    # Reports a connection phase to the supervisor (reader process)
+    def __notify(self, phase):
 
-                    # Retry to connect
-                    self.USB_STATUS.value = 0
-                    self.__read_Process = Process(target=self.__connect, args=())
-                    self.__read_Process.daemon = True
-                    self.__read_Process.start()
+        with self.__status_Lock:
+            try:
+                self.__status_Sender.send((phase, clock()))
+            except (OSError, ValueError):
+                pass
 
-            elif self.USB_STATUS.value == 1:
 
-                # Calculate Sample Rates
-                self.PM_SampleRate_50Hz.value = self.__PM_SampleCount_50Hz.value / sleepy_time
-                self.PM_SampleRate_5Hz_Params01.value = self.__PM_SampleCount_5Hz_Params01.value / sleepy_time
-                self.PM_SampleRate_5Hz_Params02.value = self.__PM_SampleCount_5Hz_Params02.value / sleepy_time
+    # Returns the connection phases reached by the current connection attempt (PHASE_...) with the
+    # seconds from the start of the reader process
+    def getConnectionTimings(self):
+        return dict(self.__phases)
 
-                self.__PM_SampleCount_50Hz.value = 0
-                self.__PM_SampleCount_5Hz_Params01.value = 0
-                self.__PM_SampleCount_5Hz_Params02.value = 0
 
-            # Sleep like a little french princess
-            time.sleep(sleepy_time)
+    # Returns the number of connection attempts, i.e. reader processes started
+    def getConnectionAttempts(self):
+        return self.__attempts
 
 
     # Establishes an ANT+ Connection
     def __connect(self):
 
+        # Signals within the reader process
+        self.__status_Lock = threading.Lock()
+        self.__response_Condition = threading.Condition()
+        self.__control_Condition = threading.Condition()
+        self.__control_Requested = False
+
         try:
             self.node = Node()
         except:
@@ -254,6 +331,7 @@ class myOpenAnt_Manager:
         # Received some Data from ANT+ Stick - Scoooore!
         if self.node.ant.USB_OK == True:
             self.USB_STATUS.value = 1
+            self.__notify(PHASE_USB)
 
         # Something went wrong while setting up USB connection -> Suicide XX
         else:
@@ -263,12 +341,18 @@ class myOpenAnt_Manager:
         # Set Network Key
         self.node.set_network_key(0, NETWORK_KEY)
 
+        # Bounded retries of acknowledged commands
+        self.node.send_pipeline.configure(max_retries=PM_COMMAND_RETRIES)
+
         # Powermeter
         self.__PM_Control_Mode          = NORMAL
         self.__PM_FastMode_active       = False
         self.__PM_FastMode_configured   = False
         self.__PM_RECEIVED_DATA         = False
 
+        # Frame indexes start over with the new connection
+        self.__timeline = Powermeter_Timeline(self.PM_Periode_FastMode / 32768.0)
+
         self.__RequestPage = None
         self.__RequestedPage_Received   = False
 
@@ -280,8 +364,10 @@ class myOpenAnt_Manager:
         # Setup Powermeter
         if self.__activate_Powermeter.value == 1:
             self.channel_PW = self.node.new_channel(Channel.Type.BIDIRECTIONAL_RECEIVE)
-            self.channel_PW.on_broadcast_data = self.on_data_PW
-            self.channel_PW.on_burst_data = self.on_data_PW
+            self.channel_PW.subscribe(self.on_battery_page_PW, pages=PAGE_BATTERY_STATUS)
+            self.channel_PW.subscribe(self.on_data_PW)
+            self.channel_PW.subscribe(self.on_fast_page_PW, pages=PAGES_FAST_DATA)
+            self.channel_PW.subscribe(self.on_power_only_page_PW, pages=PAGE_POWER_ONLY)
             str(self.channel_PW.set_period(self.PM_Periode_NormalMode))     # 8182 of 32768 -> ~4Hz; FastMode: 655 -> ~50Hz
             self.channel_PW.set_search_timeout(255)                         # '255' means infinite searching otherwise timeout in [s]
             self.channel_PW.set_rf_freq(57)                                 # 2457 MHz
@@ -292,6 +378,7 @@ class myOpenAnt_Manager:
             if self.__activate_Powermeter.value == 1:
                 self.channel_PW.open()
 
+            self.__notify(PHASE_SEARCHING)
             self.node.start()
             print('Node started')
         except Exception as error:
@@ -318,7 +405,11 @@ class myOpenAnt_Manager:
                 if self.__restoreStandardMode():
                     self.__PM_Control_Mode = NORMAL
 
-            time.sleep(1)
+            # Wait for the next request, a failed one is retried
+            with self.__control_Condition:
+                if not self.__control_Requested:
+                    self.__control_Condition.wait(PM_CONTROL_RETRY)
+                self.__control_Requested = False
 
         # Clean Exit
         print("Try clean exit")
@@ -337,21 +428,10 @@ class myOpenAnt_Manager:
 
         CMD1 = [0xF0, 0x03, 0x00, 0x00, TO, F1, F2, 0xFF]
 
-        error = False
-        for i in range(10):
-            try:
-                print("ROTOR Powermeter: Try to activate FastMode")
-                print("Send COMMAND" + self.toHexString(CMD1))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD1))
-                error = False
-                break
-
-            except Exception as err:
-                error = True
-                print("Error Sending COMMAND: " + str(err))
+        print("ROTOR Powermeter: Try to activate FastMode")
 
         # Unable to send Message
-        if error:
+        if not self.__sendCommands([CMD1]):
             return False
 
         # Request Page
@@ -364,25 +444,26 @@ class myOpenAnt_Manager:
         return result
 
 
-    # Requests a specific page and waits until it is received (or until time_out)
+    # Requests a specific page and waits until it is received (or until time_out), woken by on_data_PW
     def __wait4Response(self, PAGE_TYPE, time_out):
 
-        result = False
-
-        self.__RequestedPage_Received = False
-        self.__RequestPage = PAGE_TYPE
+        with self.__response_Condition:
+            self.__RequestedPage_Received = False
+            self.__RequestPage = PAGE_TYPE
 
-        n = int(round(time_out / 0.1))
+            result = self.__response_Condition.wait_for(lambda: self.__RequestedPage_Received, time_out)
+            self.__RequestPage = None
 
-        for i in range(n):
+        return result
 
-            if self.__RequestedPage_Received:
-                result = True
-                break
 
-            time.sleep(0.1)
+    # Hands a request to the control worker and wakes it up
+    def __setControlMode(self, mode):
 
-        return result
+        with self.__control_Condition:
+            self.__PM_Control_Mode = mode
+            self.__control_Requested = True
+            self.__control_Condition.notify()
 
 
     # Reverts the Powermeter into Standard Mode
@@ -390,35 +471,10 @@ class myOpenAnt_Manager:
 
         CMD1 = [0xF0, 0x06, 0x00, 0x00, 0xFF, 0xFF, 0xFF, 0xFF]
 
-        error = False
-
-        for i in range(10):
-            try:
-                print("ROTOR Powermeter: Try to restore Standard Mode")
-                print("Send COMMAND" + self.toHexString(CMD1))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD1))
-                print("Send COMMAND" + self.toHexString(CMD1))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD1))
-                print("Send COMMAND" + self.toHexString(CMD1))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD1))
-                print("Send COMMAND" + self.toHexString(CMD1))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD1))
-                print("Send COMMAND" + self.toHexString(CMD1))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD1))
-                print("Send COMMAND" + self.toHexString(CMD1))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD1))
-                print("Send COMMAND" + self.toHexString(CMD1))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD1))
-
-                error = False
-                break
-
-            except Exception as err:
-                print("Error Sending COMMAND" + str(err))
-                error = True
+        print("ROTOR Powermeter: Try to restore Standard Mode")
 
         # Unable to send Message
-        if error:
+        if not self.__sendCommands([CMD1] * 7):
             return False
 
         # Request Page
@@ -448,54 +504,44 @@ class myOpenAnt_Manager:
         CMD2 = [0xF0, 0x04, 0x00, 0x00, F2_1, F2_2, F3_1, F3_2]
         CMD3 = [0xF0, 0x05, 0x00, 0x00, F3_1, F3_2, F4_1, F4_2]
 
-        error = False
-
-        for i in range(10):
-            try:
-                print("Send COMMAND (try: "+str(i+1)+"): " + self.toHexString(CMD2))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD2))
-                print("Repeat COMMAND: " + self.toHexString(CMD2))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD2))  # Send twice for safety
-
-                error = False
-                break
-
-            except Exception as err:
-                print("Error Sending COMMAND: " + str(err))
-                error = True
-
-        # Unable to send Message
-        if error:
+        # Send each command twice for safety
+        if not self.__sendCommands([CMD2, CMD2]) or \
+           not self.__sendCommands([CMD3, CMD3]):
             print("ROTOR Powermeter: Configuration of FastMode failed!")
             self.POWERMETER_State.value = -2
             return False
 
+        print("ROTOR-Powermeter: FastMode successfully CONFIGURATED")
+        self.__rate.setSchedule(self.__PM_F1.value, self.__PM_F2.value, F4_1 != ID_NONE or F4_2 != ID_NONE)
+        self.__PM_FastMode_configured = True
+        self.POWERMETER_State.value = 1
+        self.__notify(PHASE_CONFIGURED)
 
-        for i in range(10):
-            try:
-                print("Send COMMAND (try: "+str(i+1)+"): " + self.toHexString(CMD3))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD3))
-                print("Repeat COMMAND: " + self.toHexString(CMD3))
-                self.channel_PW.send_acknowledged_data(array.array('B', CMD3))   # Send twice for safety
+        return True
 
-                error = False
-                break
 
+    # Sends acknowledged commands to the Powermeter and waits until all of them are acknowledged.
+    # Retries are handled by the send pipeline of the node (see PM_COMMAND_RETRIES).
+    def __sendCommands(self, commands):
+
+        futures = []
+        for CMD in commands:
+            print("Send COMMAND" + self.toHexString(CMD))
+            futures.append(self.channel_PW.send_acknowledged_data_async(array.array('B', CMD)))
+
+        error = False
+        for future in futures:
+            try:
+                transfer = future.result()
+                if transfer.get_retries() > 0:
+                    print("COMMAND acknowledged after " + str(transfer.get_retries()) + " retries")
             except Exception as err:
-                print("Error Sending COMMAND: " + str(err))
                 error = True
+                print("Error Sending COMMAND: " + str(err))
 
-        # Unable to send Message
-        if error:
-            print("ROTOR Powermeter: Configuration of FastMode failed!")
-            self.POWERMETER_State.value = -2
-            return False
+        print("ROTOR Powermeter: " + str(self.node.send_pipeline.get_statistics(self.channel_PW.id)))
 
-        print("ROTOR-Powermeter: FastMode successfully CONFIGURATED")
-        self.__PM_FastMode_configured = True
-        self.POWERMETER_State.value = 1
-
-        return True
+        return not error
 
 
     # Converts byte data into hex string
@@ -512,220 +558,307 @@ class myOpenAnt_Manager:
 
 
 
-    # Receives and handles incoming Powermeter data from the OPENANT Library
+    # Receives every incoming Powermeter page from the OPENANT Library.
+    # Page specific handling is done by the subscriptions registered in __connect.
     def on_data_PW(self, data):
 
-        # Determining Page type
-        page_type = data[0]
-
-        # Interpret Battery Status
-        if(page_type == PAGE_BATTERY_STATUS):
-            value = data[7]
-            mask = 0b00001110
-
-            batstatus = value & mask
-            batstatus = batstatus >> 1
-
-            self.__BatteryStatus.value = batstatus
-            print("Battery Status:" + str(batstatus))
-
         # Respond on requested Pages
-        if  page_type == self.__RequestPage and \
-            self.__RequestedPage_Received == False:
-            self.__RequestedPage_Received = True
-
+        if data[0] == self.__RequestPage:
+            with self.__response_Condition:
+                if  data[0] == self.__RequestPage and \
+                    self.__RequestedPage_Received == False:
+                    self.__RequestedPage_Received = True
+                    self.__response_Condition.notify_all()
 
         # Successfully connected
         if not self.__PM_RECEIVED_DATA:
             self.__PM_RECEIVED_DATA = True
+            self.__notify(PHASE_CONNECTED)
             print("ROTOR-Powermeter: Successfully Connected!")
 
-        # Updating number of received Samples
-        if page_type == PAGE_FAST_DATA_50Hz:
-            self.__PM_SampleCount_50Hz.value = self.__PM_SampleCount_50Hz.value + 1
-        elif page_type == PAGE_FAST_DATA_01_5Hz:
-            self.__PM_SampleCount_5Hz_Params01.value = self.__PM_SampleCount_5Hz_Params01.value + 1
-
-        elif page_type == PAGE_FAST_DATA_02_5Hz:
-            self.__PM_SampleCount_5Hz_Params02.value = self.__PM_SampleCount_5Hz_Params02.value + 1
 
+    # Interprets the Battery Status page
+    def on_battery_page_PW(self, data):
 
+        value = data[7]
+        mask = 0b00001110
 
-        # Fast Data
-        if(page_type == PAGE_FAST_DATA_50Hz or
-           page_type == PAGE_FAST_DATA_01_5Hz or
-           page_type == PAGE_FAST_DATA_02_5Hz):
+        batstatus = value & mask
+        batstatus = batstatus >> 1
 
-            # Fast Mode is already active - need to be reverted first to start clean
-            if  not self.__PM_FastMode_active:
-                print("ROTOR-Powermeter: FastMode active!")
-                self.channel_PW.set_period(self.PM_Periode_FastMode)
-                self.__PM_FastMode_active = True
-                self.__PM_Control_Mode = RESTORE_STANDARD
-
-            else:
-                # Configure FastMode if necessary
-                if  self.__PM_FastMode_configured == False and \
-                    self.__PM_Control_Mode == NORMAL:
-                    self.__PM_Control_Mode = CONFIGURE_FASTMODE
+        self.__telemetry.write((("battery_status", batstatus),))
+        print("Battery Status:" + str(batstatus))
 
 
-            # Parse Data
-            (id1, value1, id2, value2) = self.parseFastPageData(data)
+    # Handles the Fast Data pages (0xF2, 0xF3, 0xF4)
+    def on_fast_page_PW(self, data):
 
-            # Update each value
-            self.updateData(id1, value1)
-            self.updateData(id2, value2)
+        # Arrival time of the page
+        t = clock()
+        self.__rate.update(data[0], t)
 
+        # Fast Mode is already active - need to be reverted first to start clean
+        if  not self.__PM_FastMode_active:
+            print("ROTOR-Powermeter: FastMode active!")
+            self.channel_PW.set_period(self.PM_Periode_FastMode)
+            self.__PM_FastMode_active = True
+            self.__notify(PHASE_FASTMODE)
+            self.__setControlMode(RESTORE_STANDARD)
 
-        # Activate FastMode if not done yet
-        elif  page_type == PAGE_POWER_ONLY and \
-            not self.__PM_FastMode_active and \
+        else:
+            # Configure FastMode if necessary
+            if  self.__PM_FastMode_configured == False and \
+                self.__PM_Control_Mode == NORMAL:
+                self.__setControlMode(CONFIGURE_FASTMODE)
+
+
+        # Parse Data
+        (page, frame, id1, raw1, id2, raw2) = decodePage(data)
+        values = convert(id1, raw1) + convert(id2, raw2)
+
+        # Keep the raw samples in frame order, a few frames later, lost frames as gaps, and process
+        # the revolutions in device time
+        timeline = self.__timeline
+        for index, arrival, samples in timeline.push(frame, t, ((id1, raw1), (id2, raw2))):
+            if samples is GAP:
+                self.__ring.write(arrival, index & 0xFF, LOST_FRAME, index)
+                continue
+            if isinstance(samples, Resync):
+                self.__ring.write(arrival, index & 0xFF, ((ID_NONE, min(samples.count, 0x7FFF)),), index)
+                continue
+
+            self.__ring.write(arrival, index & 0xFF, samples, index)
+
+            (qid1, value1), (qid2, value2) = samples
+            record = self.__cycle.update(timeline.getDeviceTime(index), convert(qid1, value1) + convert(qid2, value2))
+            if record is not None:
+                self.__telemetry.write(record)
+        self.__ring.setTimeBase(*timeline.getTimeBase())
+
+        # The predictor takes the page right away, not in frame order, to keep the extrapolation short
+        index = timeline.getLastIndex()
+        if index is not None and self.__predictor.update(timeline.getDeviceTime(index), values):
+            values = values + self.__predictor.getState()
+
+        # Update both values, the stream statistics and the predictor state at once
+        self.__telemetry.write(values + self.__getStreamData())
+
+
+    # Returns the estimates of the rate estimator and the frame counts as telemetry (field, value) pairs
+    def __getStreamData(self):
+
+        rate = self.__rate
+        timeline = self.__timeline
+        gaps, missed = rate.getGaps()
+
+        # Percentiles only every PERCENTILE_REFRESH, NaN before a page type arrived twice
+        now = clock()
+        if now - self.__percentileTime >= PERCENTILE_REFRESH:
+            self.__percentileTime = now
+            percentiles = ()
+            for page, suffix in zip(PAGES_FAST_DATA, ("f2", "f3", "f4")):
+                for q in (50, 95):
+                    value = rate.getPercentile(page, q / 100.0)
+                    percentiles += (("interval_p%d_%s" % (q, suffix), float("nan") if value is None else value),)
+            self.__percentiles = percentiles
+
+        return (("rate_f2", rate.getRate(PAGE_FAST_DATA_50Hz)),
+                ("rate_f3", rate.getRate(PAGE_FAST_DATA_01_5Hz)),
+                ("rate_f4", rate.getRate(PAGE_FAST_DATA_02_5Hz)),
+                ("jitter_f2", rate.getJitter(PAGE_FAST_DATA_50Hz)),
+                ("jitter_f3", rate.getJitter(PAGE_FAST_DATA_01_5Hz)),
+                ("jitter_f4", rate.getJitter(PAGE_FAST_DATA_02_5Hz)),
+                ("gaps", gaps),
+                ("gaps_f2", rate.getGaps(PAGE_FAST_DATA_50Hz)[0]),
+                ("gaps_f3", rate.getGaps(PAGE_FAST_DATA_01_5Hz)[0]),
+                ("gaps_f4", rate.getGaps(PAGE_FAST_DATA_02_5Hz)[0]),
+                ("interleave_errors", rate.getInterleaveErrors()),
+                ("lost_frames", timeline.getLost()),
+                ("duplicate_frames", timeline.getDuplicates())) + self.__percentiles
+
+
+    # Returns the rates of 0xF2, 0xF3 and 0xF4 pages of a telemetry record, 0 if no page arrived within <max_age> [s]
+    def __getRates(self, record, max_age):
+
+        if clock() - record["timestamp"] > max_age:
+            return 0.0, 0.0, 0.0
+
+        return float(record["rate_f2"]), float(record["rate_f3"]), float(record["rate_f4"])
+
+
+    # Activates FastMode on the Power Only page if not done yet
+    def on_power_only_page_PW(self, data):
+
+        if  not self.__PM_FastMode_active and \
             self.__PM_Control_Mode == NORMAL and\
-            not self.__BatteryStatus.value == -1:
+            not self.__telemetry.get("battery_status") == -1:
 
-            self.__PM_Control_Mode = ACTIVATE_FASTMODE
+            self.__setControlMode(ACTIVATE_FASTMODE)
 
 
-    # Parses Fast Page Data
-    # 0  # : 0xF2 : Fast Mode Page (0xF2, 0xF3, 0xF4)
-    # 1  # : 0xXX : Time Tag. Frames counter
-    # 2  # : 0xXX : Data 1 ID. (P.E:  Code 3 = Angle (Rad/1000), code 10 =Force(N/10))
-    # 3  # : 0xXX : Data 1. Low Byte
-    # 4  # : 0xXX : Data 1. High Byte. Data  = (HighByte * 256)+ LowByte
-    # 5  # : 0xXX : Data 2 ID
-    # 6  # : 0xXX : Data 2. Low Byte
-    # 7  # : 0xXX : Data 2. High Byte. Data  = (HighByte * 256)+ LowByte
+    # Parses Fast Page Data, see Powermeter_Decoder for the page layout
     def parseFastPageData(self, data):
 
-        # First Data
-        ID1 = data[2]
-        LB1 = data[3]
-        HB1 = data[4]
+        (page, frame, ID1, Value1, ID2, Value2) = decodePage(data)
 
-        if HB1 > 127:
-            HB1 = HB1 - 256
+        return ID1, float(Value1), ID2, float(Value2)
 
-        Value1 = float(256 * HB1 + LB1)
 
-        # Second Data
-        ID2 = data[5]
-        LB2 = data[6]
-        HB2 = data[7]
+    # Updates the data fields of the given IDs in a single write, so readers never see only one of them
+    def updateData(self, id, value, id2=ID_NONE, value2=0.0):
 
-        if HB2 > 127:
-            HB2 = HB2 - 256
+        self.__telemetry.write(convert(id, value) + convert(id2, value2))
 
-        Value2 = float(256 * HB2 + LB2)
 
-        return ID1, Value1, ID2, Value2
+    # Converts a raw value into the telemetry (field, value) pairs it updates, empty for unknown IDs
+    def convertData(self, id, value):
+        return convert(id, value)
 
 
-    # Updates a certain data field based on the given ID
-    def updateData(self, id, value):
+    # Returns the currently available Data as Powermeter_Data Object, all values from one consistent snapshot
+    def getData(self):
 
-        if id == ID_OCA:
-            # OCA [deg] = value / 100
-            self.__OCA.value = value / 100.0
+        record = self.__telemetry.read()
 
-        elif id == ID_FORCE_LEFT:
-            # Force [N] = value / 10
-            self.__Force_left.value = value / 10.0
+        self.__data.TimeStamp = float(record["timestamp"])
 
-        elif id == ID_FORCE_RIGHT:
-            # Force [N] = value / 10
-            self.__Force_right.value = value / 10.0
+        self.__data.BatteryStatus = int(record["battery_status"])
 
-        elif id == ID_FORCE_TOTAL:
-            # Force [N] = value / 10
-            self.__Force_total.value = value / 10.0
+        (self.__data.DataRate_F1, self.__data.DataRate_F2, self.__data.DataRate_F3) = self.__getRates(record, 2.0)
+        self.__data.Jitter_F1 = float(record["jitter_f2"])
+        self.__data.Jitter_F2 = float(record["jitter_f3"])
+        self.__data.Jitter_F3 = float(record["jitter_f4"])
+        (self.__data.Interval_P50_F1, self.__data.Interval_P95_F1) = (float(record["interval_p50_f2"]), float(record["interval_p95_f2"]))
+        (self.__data.Interval_P50_F2, self.__data.Interval_P95_F2) = (float(record["interval_p50_f3"]), float(record["interval_p95_f3"]))
+        (self.__data.Interval_P50_F3, self.__data.Interval_P95_F3) = (float(record["interval_p50_f4"]), float(record["interval_p95_f4"]))
+        self.__data.Gaps = int(record["gaps"])
+        (self.__data.Gaps_F1, self.__data.Gaps_F2, self.__data.Gaps_F3) = (int(record["gaps_f2"]), int(record["gaps_f3"]), int(record["gaps_f4"]))
+        self.__data.InterleaveErrors = int(record["interleave_errors"])
+        self.__data.LostFrames = int(record["lost_frames"])
+        self.__data.DuplicateFrames = int(record["duplicate_frames"])
 
-        elif id == ID_TORQUE_LEFT:
-            # Torque [Nm] = value / 100
-            self.__Torque_left.value = value / 100.0
+        self.__data.OCA = float(record["oca"])
 
-        elif id == ID_TORQUE_RIGHT:
-            # Torque [Nm] = value / 100
-            self.__Torque_right.value = value / 100.0
+        self.__data.Force_Left = float(record["force_left"])
+        self.__data.Force_Right = float(record["force_right"])
+        self.__data.Force_Total = float(record["force_total"])
 
-        elif id == ID_TORQUE_TOTAL:
-            # Torque [Nm] = value / 100
-            self.__Torque_total.value = value / 100.0
+        self.__data.Torque_Left = float(record["torque_left"])
+        self.__data.Torque_Right = float(record["torque_right"])
+        self.__data.Torque_Total = float(record["torque_total"])
 
-        elif id == ID_POWER:
-            # Power [W] = value / 10
-            self.__Power.value = value / 10.0
+        self.__data.Power = float(record["power"])
 
-        elif id == ID_CADENCE:
-            # Cadence [RPM] = value / 100
-            self.__Cadence.value = value / 100.0
+        self.__data.CrankAngle = float(record["crank_angle"])
+        (self.__data.CrankAngle_Predicted, self.__data.CrankAngle_Uncertainty) = self.__predictCrankAngle(record, clock())
+        self.__data.Cadence = float(record["cadence"])
 
-        elif id == ID_CRANK_ANGLE:
-            # CrankAngle [rad] = value / 1000
-            # CrankAngle [deg] = CrankAngle [rad] * (180/PI)
-            t_CrankAngle = value * 0.0572957795130823
-            diff_CrankAngle = t_CrankAngle - self.__CrankAngle.value
-            self.__CrankAngle.value = t_CrankAngle
+        self.__data.Balance_Left = float(record["balance_left"])
+        self.__data.Balance_Right = float(record["balance_right"])
 
-        elif id == ID_BALANCE_LEFT:
-            # Balance [%] = value / 100
-            self.__Balance_Left.value = value / 100.0
+        self.__data.Torque_Efficiency_Left = float(record["torque_efficiency_left"])
+        self.__data.Torque_Efficiency_Right = float(record["torque_efficiency_right"])
 
-        elif id == ID_BALANCE_RIGHT:
-            # Balance [%] = value / 100
-            self.__Balance_Right.value = value / 100.0
+        self.__data.Pedal_Smoothness_Left = float(record["pedal_smoothness_left"])
+        self.__data.Pedal_Smoothness_Right = float(record["pedal_smoothness_right"])
 
-        elif id == ID_TORQUE_EFF_LEFT:
-            # Torque Efficiency [%] = value / 2
-            self.__Torque_Efficiency_Left.value = value / 2.0
+        self.__data.Cycles = int(record["cycles"])
+        self.__data.Cycle_TimeStamp = float(record["cycle_time"])
+        self.__data.Cycle_Duration = float(record["cycle_duration"])
+        self.__data.Cycle_Cadence = float(record["cycle_cadence"])
+        self.__data.Cycle_Work = float(record["cycle_work"])
 
-        elif id == ID_TORQUE_EFF_RIGHT:
-            # Torque Efficiency [%] = value / 2
-            self.__Torque_Efficiency_Right.value = value / 2.0
+        self.__data.Cycle_Power = float(record["cycle_power"])
+        self.__data.Cycle_Power_Left = float(record["cycle_power_left"])
+        self.__data.Cycle_Power_Right = float(record["cycle_power_right"])
 
-        elif id == ID_PEDAL_SMOOTH_LEFT:
-            # Pedal Smoothness [%] = value / 2
-            self.__Pedal_Smoothness_Left.value = value / 2.0
+        self.__data.Cycle_Torque_Efficiency = float(record["cycle_torque_eff"])
+        self.__data.Cycle_Torque_Efficiency_Left = float(record["cycle_torque_eff_left"])
+        self.__data.Cycle_Torque_Efficiency_Right = float(record["cycle_torque_eff_right"])
 
-        elif id == ID_PEDAL_SMOOTH_RIGHT:
-            # Pedal Smoothness [%] = value / 2
-            self.__Pedal_Smoothness_Right.value = value / 2.0
+        self.__data.Cycle_Pedal_Smoothness = float(record["cycle_smoothness"])
+        self.__data.Cycle_Pedal_Smoothness_Left = float(record["cycle_smoothness_left"])
+        self.__data.Cycle_Pedal_Smoothness_Right = float(record["cycle_smoothness_right"])
 
+        self.__data.Cycle_OCA = float(record["cycle_oca"])
+        self.__data.Cycle_OCA_Left = float(record["cycle_oca_left"])
+        self.__data.Cycle_OCA_Right = float(record["cycle_oca_right"])
 
-    # Returns the currently available Data as Powermeter_Data Object
-    def getData(self):
+        return self.__data
 
-        self.__data.BatteryStatus = self.__BatteryStatus.value
 
-        self.__data.DataRate_F1 = self.PM_SampleRate_50Hz.value
-        self.__data.DataRate_F2 = self.PM_SampleRate_5Hz_Params01.value
-        self.__data.DataRate_F3 = self.PM_SampleRate_5Hz_Params02.value
+    # Returns (crank angle [deg], standard deviation [deg]) predicted for clock() time <t>, default now,
+    # (NaN, NaN) before the first crank angle
+    def predictCrankAngle(self, t=None):
 
-        self.__data.OCA = self.__OCA
+        record = self.__telemetry.read()
+        return self.__predictCrankAngle(record, clock() if t is None else t)
 
-        self.__data.Force_Left = self.__Force_left.value
-        self.__data.Force_Right = self.__Force_right.value
-        self.__data.Force_Total = self.__Force_total.value
 
-        self.__data.Torque_Left = self.__Torque_left.value
-        self.__data.Torque_Right = self.__Torque_right.value
-        self.__data.Torque_Total = self.__Torque_total.value
+    # Extrapolates the predictor state of a telemetry record to <t>
+    def __predictCrankAngle(self, record, t):
 
-        self.__data.Power = self.__Power.value
+        return predictAngle(*(self.__getPredictorState(record) + (t,)))
 
-        self.__data.CrankAngle = self.__CrankAngle.value
-        self.__data.Cadence = self.__Cadence.value
 
-        self.__data.Balance_Left = self.__Balance_Left
-        self.__data.Balance_Right = self.__Balance_Right
+    # Returns the crank angle predictor state, the arguments of Powermeter_Predictor.predictAngle without the time
+    def getPredictorState(self):
+        return self.__getPredictorState(self.__telemetry.read())
 
-        self.__data.Torque_Efficiency_Left = self.__Torque_Efficiency_Left
-        self.__data.Torque_Efficiency_Right = self.__Torque_Efficiency_Right
 
-        self.__data.Pedal_Smoothness_Left = self.__Pedal_Smoothness_Left
-        self.__data.Pedal_Smoothness_Right = self.__Pedal_Smoothness_Right
+    def __getPredictorState(self, record):
+        return tuple(float(record[field]) for field in PREDICTOR_FIELDS)
+
+
+    # Registers <callback> to fire at the predicted time the crank passes <angle> [deg], once per
+    # revolution, see Powermeter_Scheduler.addTrigger. Returns the ID of the trigger.
+    def addAngleTrigger(self, angle, callback):
+
+        if self.__scheduler is None:
+            self.__scheduler = Powermeter_Scheduler(self.getPredictorState)
+            self.__scheduler.start()
+        return self.__scheduler.addTrigger(angle, callback)
+
+
+    # Removes the angle trigger <trigger>
+    def removeAngleTrigger(self, trigger):
+
+        if self.__scheduler is not None:
+            self.__scheduler.removeTrigger(trigger)
 
-        return self.__data
+
+    # Returns (count, mean, standard deviation, maximum) of how late the angle trigger <trigger>, or
+    # all, fired after the predicted crossing [s]
+    def getTriggerLateness(self, trigger=None):
+
+        if self.__scheduler is None:
+            return 0, 0.0, 0.0, 0.0
+        return self.__scheduler.getLateness(trigger)
+
+
+    # Returns the name of the shared memory telemetry record, other processes can map it directly
+    def getTelemetryName(self):
+        return self.__telemetry.getName()
+
+
+    # Returns a new cursor into the ring of received samples, see read_since
+    def getCursor(self, oldest=False):
+        return self.__ring.getCursor(oldest)
+
+
+    # Returns (samples, cursor, lost), the samples received since <cursor> as NumPy view (see Powermeter_Ring)
+    def read_since(self, cursor):
+        return self.__ring.read_since(cursor)
+
+
+    # Returns the device times of ring <samples> in clock() seconds, evenly spaced by the frame index
+    def getDeviceTime(self, samples):
+        return self.__ring.getDeviceTime(samples)
+
+
+    # Returns the name of the shared memory sample ring, other processes can map it directly
+    def getRingName(self):
+        return self.__ring.getName()
 
 
 
@@ -738,6 +871,9 @@ class myOpenAnt_Manager:
     def clean_exit(self):
         self.__kill.value = 1
 
+        if self.__scheduler is not None:
+            self.__scheduler.stop()
+
 
     # Returns the current state of the Power Meter
     def getState_PowerMeter(self):
@@ -758,7 +894,8 @@ class myOpenAnt_Manager:
 
 
 # Simple Testroutine to display the current CrankAngle every second.
-# It additionally shows the sample-rate at which the CrankAngle is received.
+# It additionally shows the sample-rate at which the CrankAngle is received and how many
+# CrankAngle samples arrived since the last output.
 if __name__ == '__main__':
 
     # ID of your 2INPOWER
@@ -771,6 +908,7 @@ if __name__ == '__main__':
     # Configure ANT-Manager
     myANT = myOpenAnt_Manager()
     myANT.start(exit, activate_Powermeter, rotor_ID)
+    cursor = myANT.getCursor()
 
 
     try:
@@ -780,10 +918,17 @@ if __name__ == '__main__':
 
                 if myANT.POWERMETER_State.value == 1:
                     data = myANT.getData()
-                    print("CrankAngle = " + str(data.CrankAngle) + " DEG( Samplerate: " + str(myANT.PM_SampleRate_50Hz)+" Hz) ")
+
+                    n = 0
+                    samples, cursor, lost = myANT.read_since(cursor)
+                    while len(samples) > 0:
+                        n = n + int((samples["qid"] == ID_CRANK_ANGLE).sum())
+                        samples, cursor, lost = myANT.read_since(cursor)
+
+                    print("CrankAngle = " + str(data.CrankAngle) + " DEG( Samplerate: " + str(myANT.PM_SampleRate_50Hz.value) + " Hz, " + str(n) + " samples) ")
 
                 elif myANT.POWERMETER_State.value == 0:
-                    print("Waiting for device: connecting...")
+                    print("Waiting for device: connecting... " + str(myANT.getConnectionTimings()))
                 elif myANT.POWERMETER_State.value == -1:
                     print("Powermeter not activated...")
                 elif myANT.POWERMETER_State.value == -2:
@@ -0,0 +1,295 @@
+# Copyright (c) 2020, Martin Schmoll <martin.schmoll@meduniwien.ac.at>
+#
+# Offline decoding of raw captures, i.e. files holding the bytes read from the ANT+ stick one after
+# the other. The capture is memory-mapped and processed in chunks with NumPy instead of message by
+# message: every sync byte is a candidate frame, candidates are validated in bulk by their length
+# and XOR checksum, and the frames a sequential reader would have found are selected. Broadcast
+# payloads and ROTOR fast pages are then extracted into columnar arrays.
+#
+# ANT frame: 0xA4 (sync), length, message ID, <length> data bytes, checksum (XOR of all bytes before)
+#
+# The software comes as it is, free of charge and is intended exclusively for non commercial use.
+# The author of this software does not take responsibilty for potential malfunctions. Feel free
+# to use, modify and extend the software to your personal needs.
+
+# Imports
+from __future__ import absolute_import, print_function
+import mmap
+import numpy
+from openANT.ant.base.message import Message
+from openANT.Powermeter_Decoder import DECODED_DTYPE, decodePages
+
+# ANT frame constants
+SYNC = 0xA4
+MAX_DATA_LENGTH = 64            # Longer length bytes are taken as garbage
+
+# Bytes processed at once, frames may extend into the next chunk
+CAPTURE_CHUNK = 1 << 24
+
+# Fixpoint iterations of the overlap filter before falling back to a sequential pass
+_SELECT_ITERATIONS = 8
+
+# Frames found in a capture
+FRAME_DTYPE = numpy.dtype([("offset", "<i8"),
+                           ("length", "u1"),
+                           ("id",     "u1")])
+
+# Broadcast data messages: the channel and the 8 byte payload
+BROADCAST_DTYPE = numpy.dtype([("offset",  "<i8"),
+                               ("channel", "u1"),
+                               ("payload", "u1", (8,))])
+
+# Decoded fast pages with the position of their frame in the capture
+CAPTURE_PAGE_DTYPE = numpy.dtype([("offset", "<i8"), ("channel", "u1")] + DECODED_DTYPE.descr)
+
+# ROTOR Fast Data pages
+_FAST_PAGES = numpy.array([0xF2, 0xF3, 0xF4], dtype=numpy.uint8)
+
+
+# Keeps the candidates a sequential reader would accept: those starting at or after the end of the
+# previously accepted frame. Greedy selection is inherently sequential, but false candidates (a sync
+# byte inside a frame with a matching checksum) are rare, so a few rounds of "start >= largest end
+# of the kept candidates before" converge to it.
+def _select(starts, ends, resume):
+
+    keep = starts >= resume
+
+    for i in range(_SELECT_ITERATIONS):
+        reach = numpy.maximum.accumulate(numpy.where(keep, ends, resume))
+        before = numpy.empty_like(reach)
+        before[0] = resume
+        before[1:] = reach[:-1]
+
+        selected = starts >= before
+        if numpy.array_equal(selected, keep):
+            return keep
+        keep = selected
+
+    # Sequential pass
+    keep = numpy.zeros(len(starts), dtype=bool)
+    end = resume
+    for i in range(len(starts)):
+        if starts[i] >= end:
+            keep[i] = True
+            end = ends[i]
+    return keep
+
+
+class Powermeter_Capture(object):
+
+    # Maps the capture file <path>
+    def __init__(self, path):
+
+        self.__path = path
+        self.__file = open(path, "rb")
+
+        try:
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.__data = numpy.frombuffer(self.__map, dtype=numpy.uint8)
+        except ValueError:
+            # Empty file, nothing to map
+            self.__map = None
+            self.__data = numpy.zeros(0, dtype=numpy.uint8)
+
+        self.__frames = None
+
+
+    # Returns the path of the capture
+    def getPath(self):
+        return self.__path
+
+
+    # Returns all valid frames, in order, as array of FRAME_DTYPE
+    def getFrames(self):
+
+        if self.__frames is None:
+            self.__frames = self.__findFrames()
+        return self.__frames
+
+
+    def __findFrames(self):
+
+        data = self.__data
+        size = len(data)
+        results = []
+        resume = 0
+
+        for chunk in range(0, size, CAPTURE_CHUNK):
+
+            # The chunk plus room for a frame starting at its end
+            stop = min(size, chunk + CAPTURE_CHUNK + MAX_DATA_LENGTH + 4)
+            window = data[chunk:stop]
+
+            # Candidates: a sync byte starting in this chunk, a plausible length, the frame in the window
+            starts = numpy.flatnonzero(window[:CAPTURE_CHUNK] == SYNC)
+            starts = starts[starts + 1 < len(window)]
+            lengths = window[starts + 1].astype(numpy.int64)
+            ends = starts + lengths + 4
+            valid = (lengths <= MAX_DATA_LENGTH) & (ends <= len(window))
+            starts, lengths, ends = starts[valid], lengths[valid], ends[valid]
+
+            # The XOR over a whole frame including its checksum is 0
+            prefix = numpy.bitwise_xor.accumulate(window)
+            before = numpy.where(starts > 0, prefix[starts - 1], 0)
+            valid = (prefix[ends - 1] ^ before) == 0
+            starts, lengths, ends = starts[valid], lengths[valid], ends[valid]
+
+            if len(starts) == 0:
+                continue
+
+            keep = _select(starts + chunk, ends + chunk, resume)
+            starts, lengths, ends = starts[keep], lengths[keep], ends[keep]
+
+            frames = numpy.empty(len(starts), dtype=FRAME_DTYPE)
+            frames["offset"] = starts + chunk
+            frames["length"] = lengths
+            frames["id"] = window[starts + 2]
+            results.append(frames)
+
+            if len(ends) > 0:
+                resume = int(ends[-1]) + chunk
+
+        if not results:
+            return numpy.zeros(0, dtype=FRAME_DTYPE)
+        return numpy.concatenate(results)
+
+
+    # Returns the broadcast data messages, of one <channel> or of all, as array of BROADCAST_DTYPE
+    def getBroadcasts(self, channel=None):
+
+        frames = self.getFrames()
+        frames = frames[(frames["id"] == Message.ID.BROADCAST_DATA) & (frames["length"] >= 9)]
+
+        offsets = frames["offset"]
+        channels = self.__data[offsets + 3]
+        if channel is not None:
+            offsets = offsets[channels == channel]
+            channels = channels[channels == channel]
+
+        broadcasts = numpy.empty(len(offsets), dtype=BROADCAST_DTYPE)
+        broadcasts["offset"] = offsets
+        broadcasts["channel"] = channels
+        broadcasts["payload"] = self.__data[offsets[:, None] + numpy.arange(4, 12)]
+        return broadcasts
+
+
+    # Returns the ROTOR fast pages, of one <channel> or of all, decoded into an array of CAPTURE_PAGE_DTYPE
+    def getFastPages(self, channel=None):
+
+        broadcasts = self.getBroadcasts(channel)
+        broadcasts = broadcasts[numpy.isin(broadcasts["payload"][:, 0], _FAST_PAGES)]
+
+        decoded = decodePages(broadcasts["payload"])
+
+        pages = numpy.empty(len(broadcasts), dtype=CAPTURE_PAGE_DTYPE)
+        pages["offset"] = broadcasts["offset"]
+        pages["channel"] = broadcasts["channel"]
+        for name in DECODED_DTYPE.names:
+            pages[name] = decoded[name]
+        return pages
+
+
+    # Returns the number of bytes not covered by any valid frame (garbage, lost synchronisation)
+    def getSkippedBytes(self):
+
+        frames = self.getFrames()
+        return len(self.__data) - int(frames["length"].sum(dtype=numpy.int64)) - 4 * len(frames)
+
+
+    # Unmaps the capture
+    def close(self):
+
+        self.__data = None
+        self.__frames = None
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        self.__file.close()
+
+
+
+# Frames as found by the sequential reader of the library (Ant.read_message), but resynchronising
+# on invalid frames instead of failing
+def _sequentialFrames(data):
+
+    frames = []
+    i = 0
+    while i + 4 <= len(data):
+        length = data[i + 1]
+        end = i + length + 4
+        if data[i] != SYNC or length > MAX_DATA_LENGTH or end > len(data):
+            i = i + 1
+            continue
+        try:
+            message = Message.parse(data[i:end])
+        except AssertionError:
+            i = i + 1
+            continue
+        frames.append((i, length, message._id))
+        i = end
+    return frames
+
+
+# Synthetic capture: fast pages of two powermeters on channels 0 and 1, channel events in between
+# and now and then a few garbage bytes as after a lost USB transfer
+def _makeCapture(frames, seed=0):
+
+    import array
+    import random
+
+    rng = random.Random(seed)
+    data = array.array('B')
+    for i in range(frames):
+        if rng.random() < 0.02:
+            data.extend(array.array('B', [rng.choice([SYNC, rng.randint(0, 255)]) for j in range(rng.randint(1, 6))]))
+        if rng.random() < 0.05:
+            message = Message(Message.ID.RESPONSE_CHANNEL, [i & 1, 1, 3])
+        else:
+            page = [rng.choice([0xF2, 0xF2, 0xF2, 0xF3, 0xF4, 0x10]), i & 0xFF, 3, rng.randint(0, 255), rng.randint(0, 255),
+                    15, rng.choice([SYNC, rng.randint(0, 255)]), rng.randint(0, 255)]
+            message = Message(Message.ID.BROADCAST_DATA, [i & 1] + page)
+        data.extend(message.get())
+    return data
+
+
+# Simple Testroutine comparing with the sequential reader and measuring frames per minute.
+if __name__ == '__main__':
+
+    import os
+    import tempfile
+    import time
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "capture.bin")
+
+    # Same frames as the sequential reader, across chunk boundaries too
+    data = _makeCapture(20000)
+    with open(path, "wb") as f:
+        f.write(data.tobytes())
+
+    CAPTURE_CHUNK = 4096
+    capture = Powermeter_Capture(path)
+    frames = capture.getFrames()
+    assert [tuple(int(x) for x in frame) for frame in frames] == _sequentialFrames(data)
+    print("%d frames, %d fast pages on channel 1, %d bytes skipped" %
+          (len(frames), len(capture.getFastPages(1)), capture.getSkippedBytes()))
+    capture.close()
+    CAPTURE_CHUNK = 1 << 24
+
+    # Throughput on a large capture
+    data = _makeCapture(200000)
+    with open(path, "wb") as f:
+        for i in range(50):
+            f.write(data.tobytes())
+
+    start = time.time()
+    capture = Powermeter_Capture(path)
+    frames = len(capture.getFrames())
+    pages = capture.getFastPages()
+    seconds = time.time() - start
+    print("%d frames (%.0f MB) in %.2f s: %.1f M frames/min, %d fast pages" %
+          (frames, os.path.getsize(path) / 1e6, seconds, frames / seconds * 60 / 1e6, len(pages)))
+    capture.close()
+
+    os.remove(path)
+    os.rmdir(directory)
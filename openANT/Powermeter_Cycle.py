@@ -0,0 +1,300 @@
+# Copyright (c) 2020, Martin Schmoll <martin.schmoll@meduniwien.ac.at>
+#
+# Per revolution processing of the ROTOR Fast Data. Fed with the decoded values of every page, this
+# class detects the revolutions from the crank angle (a revolution ends where the angle wraps from
+# 360 to 0 deg) and integrates the torques over the crank angle in between. For each torque (total,
+# left, right) that was received along with every crank angle sample of the revolution it yields:
+#
+#   power               work / duration [W]
+#   torque efficiency   (positive + negative work) / positive work [%], as defined by ANT+
+#   pedal smoothness    average / peak power [%], as defined by ANT+
+#   OCA                 direction of the torque resultant over the crank angle [deg]
+#
+# The torque is taken as linear between the samples, so the step crossing 0 deg is split between both
+# revolutions in proportion to the angle and a step where the torque changes sign is split at the zero
+# crossing for the positive and negative work. Every page costs O(1), a finished revolution is
+# returned as one record of (field, value) pairs.
+#
+# The software comes as it is, free of charge and is intended exclusively for non commercial use.
+# The author of this software does not take responsibilty for potential malfunctions. Feel free
+# to use, modify and extend the software to your personal needs.
+
+# Imports
+from __future__ import absolute_import, print_function
+import math
+
+# Samples further apart [s] discard the revolution in progress (lost pages)
+CYCLE_MAX_STEP = 0.5
+
+# Longer revolutions are discarded [s], i.e. cadences below 10 RPM
+CYCLE_MAX_DURATION = 6.0
+
+# Torque fields (see Powermeter_Decoder) and the suffix of their fields in the record
+TORQUES = (("torque_total", ""), ("torque_left", "_left"), ("torque_right", "_right"))
+
+# Fields of a revolution record, in order; metrics of torques not received are NaN
+CYCLE_FIELDS = ("cycle_time",               # Device time of the end of the revolution [s]
+                "cycle_duration",           # [s]
+                "cycle_cadence",            # [RPM]
+                "cycle_work",               # Work of the total torque [J]
+                "cycle_power",              # [W]
+                "cycle_power_left",
+                "cycle_power_right",
+                "cycle_torque_eff",         # [%]
+                "cycle_torque_eff_left",
+                "cycle_torque_eff_right",
+                "cycle_smoothness",         # [%]
+                "cycle_smoothness_left",
+                "cycle_smoothness_right",
+                "cycle_oca",                # [deg]
+                "cycle_oca_left",
+                "cycle_oca_right",
+                "cycles")                   # Revolutions published so far
+
+_NAN = float("nan")
+_RAD = math.pi / 180.0
+
+
+# Integrals of one torque over the revolution in progress
+class _Torque(object):
+
+    __slots__ = ("torque", "fresh", "previous", "start", "end", "valid", "work", "positive", "negative", "peak", "cos", "sin")
+
+    def __init__(self):
+
+        self.torque = None          # Latest value [Nm]
+        self.fresh = False          # Received since the previous crank angle sample
+        self.previous = None        # Value at the previous crank angle sample
+        self.start = None           # Values at both ends of the current step, start None if not received
+        self.end = None
+        self.reset()
+
+
+    def reset(self):
+
+        self.valid = True
+        self.work = 0.0
+        self.positive = 0.0
+        self.negative = 0.0
+        self.peak = 0.0
+        self.cos = 0.0
+        self.sin = 0.0
+
+
+class Powermeter_Cycle(object):
+
+    def __init__(self):
+
+        self.__torques = dict((field, _Torque()) for field, suffix in TORQUES)
+        self.__order = [(self.__torques[field], suffix) for field, suffix in TORQUES]
+
+        self.__angle = None         # Previous crank angle [deg]
+        self.__time = None          # Its device time [s]
+        self.__start = None         # Start of the revolution in progress, None until the next 0 deg
+        self.__cycles = 0
+
+
+    # Accounts the (field, value) pairs of one page (see Powermeter_Decoder.convert) at device time <t> [s].
+    # Returns the record of the revolution finished by it, else None.
+    def update(self, t, fields):
+
+        angle = None
+        for field, value in fields:
+            if field == "crank_angle":
+                angle = value
+            else:
+                torque = self.__torques.get(field)
+                if torque is not None:
+                    torque.torque = value
+                    torque.fresh = True
+
+        if angle is None:
+            return None
+
+        # Torques over the step from the previous angle sample, if received with both samples
+        for torque in self.__order:
+            torque = torque[0]
+            if torque.fresh:
+                torque.start = torque.previous
+                torque.end = torque.torque
+                torque.previous = torque.torque
+                torque.fresh = False
+            else:
+                torque.start = None
+                torque.previous = None
+
+        last = self.__angle
+        lastTime = self.__time
+        self.__angle = angle
+        self.__time = t
+
+        if last is None:
+            return None
+
+        dt = t - lastTime
+        if dt <= 0 or dt > CYCLE_MAX_STEP:
+            self.__start = None
+            return None
+
+        delta = angle - last
+        if delta < -180:
+            delta = delta + 360
+        elif delta > 180:
+            delta = delta - 360
+
+        # Standing or backpedalling
+        if delta <= 0:
+            return None
+
+        if last + delta < 360:
+            if self.__start is not None:
+                self.__integrate(delta, dt, last + 0.5 * delta, 0.0, 1.0)
+            return None
+
+        # The step crosses 0 deg: finish the revolution with its first part, start the next with the rest
+        record = None
+        fraction = (360 - last) / delta
+        boundary = lastTime + fraction * dt
+
+        if self.__start is not None:
+            self.__integrate(fraction * delta, fraction * dt, last + 0.5 * fraction * delta, 0.0, fraction)
+            record = self.__finish(boundary)
+
+        self.__start = boundary
+        for torque in self.__order:
+            torque[0].reset()
+        self.__integrate((1 - fraction) * delta, (1 - fraction) * dt, 0.5 * (1 - fraction) * delta, fraction, 1.0)
+
+        return record
+
+
+    # Integrates the torques over <angle> [deg] turned in <dt> [s], centered at <center> [deg]. This is the
+    # part <f0>..<f1> of the current step, the torque is linear in between its samples.
+    def __integrate(self, angle, dt, center, f0, f1):
+
+        angle = angle * _RAD
+        c = math.cos(center * _RAD) * angle
+        s = math.sin(center * _RAD) * angle
+        omega = angle / dt if dt > 0 else 0.0
+
+        for torque, suffix in self.__order:
+            if torque.start is None:
+                torque.valid = False
+                continue
+
+            slope = torque.end - torque.start
+            t0 = torque.start + f0 * slope
+            t1 = torque.start + f1 * slope
+            high = max(t0, t1)
+            low = min(t0, t1)
+            mean = 0.5 * (t0 + t1)
+
+            work = mean * angle
+            torque.work += work
+            if low >= 0:
+                torque.positive += work
+            elif high <= 0:
+                torque.negative += work
+            else:
+                # Split at the zero crossing
+                share = high / (high - low)
+                torque.positive += 0.5 * high * share * angle
+                torque.negative += 0.5 * low * (1 - share) * angle
+
+            power = high * omega
+            if power > torque.peak:
+                torque.peak = power
+
+            torque.cos += mean * c
+            torque.sin += mean * s
+
+
+    # Returns the record of the revolution ending at <t>, None if it was too long
+    def __finish(self, t):
+
+        duration = t - self.__start
+        if duration <= 0 or duration > CYCLE_MAX_DURATION:
+            return None
+
+        self.__cycles += 1
+        total = self.__torques["torque_total"]
+
+        values = {"cycle_time": t,
+                  "cycle_duration": duration,
+                  "cycle_cadence": 60.0 / duration,
+                  "cycle_work": total.work if total.valid else _NAN,
+                  "cycles": self.__cycles}
+
+        for torque, suffix in self.__order:
+            if not torque.valid:
+                power = efficiency = smoothness = oca = _NAN
+            else:
+                power = torque.work / duration
+                efficiency = 100.0 * (torque.positive + torque.negative) / torque.positive if torque.positive > 0 else _NAN
+                smoothness = 100.0 * power / torque.peak if torque.peak > 0 else _NAN
+                oca = math.degrees(math.atan2(torque.sin, torque.cos)) % 360.0
+
+            values["cycle_power" + suffix] = power
+            values["cycle_torque_eff" + suffix] = efficiency
+            values["cycle_smoothness" + suffix] = smoothness
+            values["cycle_oca" + suffix] = oca
+
+        return tuple((field, values[field]) for field in CYCLE_FIELDS)
+
+
+    # Returns the number of revolutions published
+    def getCycles(self):
+        return self.__cycles
+
+
+
+# Simple Testroutine: 90 RPM with a torque of 10 + 30 sin(angle) Nm sampled at 50 Hz, interleaved
+# pages without the crank angle and lost pages, checked against the analytic values within 0.5 % (the
+# error of sampling every 11 deg) and timed per page.
+if __name__ == '__main__':
+
+    import random
+    import timeit
+
+    rpm = 90.0
+    period = 655 / 32768.0
+    omega = rpm / 60.0 * 360.0      # [deg/s]
+
+    def torque(angle):
+        return 10.0 + 30.0 * math.sin(angle * _RAD)
+
+    rng = random.Random(3)
+    pages = []
+    for i in range(3000):
+        t = i * period
+        angle = (omega * t + 37.0) % 360.0
+        # Every 10th page is an interleaved 0xF3 page
+        if i % 10 == 9:
+            fields = (("power", 94.0), ("cadence", rpm))
+        else:
+            fields = (("crank_angle", angle), ("torque_total", torque(angle)))
+        if rng.random() >= 0.01:
+            pages.append((t, fields))
+
+    cycle = Powermeter_Cycle()
+    records = [dict(record) for record in (cycle.update(t, fields) for t, fields in pages) if record is not None]
+
+    # Analytic: work 20 pi J, average power 10 Nm * omega, peak 40 Nm * omega, negative torque where
+    # sin < -1/3, resultant at 90 deg
+    w = omega * _RAD
+    a = math.asin(1 / 3.0)
+    negative = 10 * (math.pi - 2 * a) - 60 * math.cos(a)
+    positive = 20 * math.pi - negative
+    expected = {"cycle_cadence": rpm, "cycle_work": 20 * math.pi, "cycle_power": 10 * w,
+                "cycle_smoothness": 25.0, "cycle_torque_eff": 100 * 20 * math.pi / positive, "cycle_oca": 90.0}
+
+    print("%d revolutions" % len(records))
+    for field, value in sorted(expected.items()):
+        measured = sum(record[field] for record in records) / len(records)
+        print("%-18s %8.2f (expected %8.2f)" % (field, measured, value))
+        assert abs(measured - value) < 0.005 * abs(value)
+    assert all(math.isnan(record["cycle_power_left"]) for record in records)
+    assert len(records) >= 3000 * period * rpm / 60 - 3
+
+    seconds = timeit.timeit(lambda: [cycle.update(t, fields) for t, fields in pages], number=3) / 3
+    print("update: %.2f us/page" % (seconds / len(pages) * 1e6))
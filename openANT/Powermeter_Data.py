@@ -6,17 +6,36 @@
 # The author of this software does not take responsibilty for potential malfunctions. Feel free
 # to use, modify and extend the software to your personal needs.
 #
-# Attention: Please keep in mind that there is a 200ms delay in the data!
+# Attention: Please keep in mind that there is a 200ms delay in the data! CrankAngle_Predicted compensates it
+# for the crank angle (see Powermeter_Predictor).
 
 class Powermeter_Data(object):
 
     def __init__(self):
 
+        self.TimeStamp = 0.0    # Powermeter_Telemetry.clock() of the last update in [s]
+
         self.BatteryStatus = -1
 
         self.DataRate_F1 = 0
         self.DataRate_F2 = 0
         self.DataRate_F3 = 0
+        self.Jitter_F1 = 0.0        # Standard deviation of the 0xF2 inter-arrival time in [s]
+        self.Jitter_F2 = 0.0        # 0xF3
+        self.Jitter_F3 = 0.0        # 0xF4
+        self.Interval_P50_F1 = 0.0  # Median of the 0xF2 inter-arrival time in [s], NaN without pages
+        self.Interval_P95_F1 = 0.0  # 95th percentile of the 0xF2 inter-arrival time in [s]
+        self.Interval_P50_F2 = 0.0  # 0xF3
+        self.Interval_P95_F2 = 0.0
+        self.Interval_P50_F3 = 0.0  # 0xF4
+        self.Interval_P95_F3 = 0.0
+        self.Gaps = 0               # Gaps in the stream of Fast Data pages
+        self.Gaps_F1 = 0            # Gaps in the 0xF2 pages
+        self.Gaps_F2 = 0            # 0xF3
+        self.Gaps_F3 = 0            # 0xF4
+        self.InterleaveErrors = 0   # Interleaved pages off the FastMode schedule
+        self.LostFrames = 0         # Frames missing by the frame counter
+        self.DuplicateFrames = 0    # Frames received more than once
 
         self.OCA = 0.0
 
@@ -31,6 +50,8 @@ class Powermeter_Data(object):
         self.Power = 0.0
 
         self.CrankAngle = 0.0
+        self.CrankAngle_Predicted = 0.0      # Crank angle extrapolated to the time of getData() [deg]
+        self.CrankAngle_Uncertainty = 0.0    # Its standard deviation [deg]
 
         self.Cadence = 0.0
 
@@ -41,4 +62,26 @@ class Powermeter_Data(object):
         self.Torque_Efficiency_Right =  0.0
 
         self.Pedal_Smoothness_Left = 0.0
-        self.Pedal_Smoothness_Right = 0.0
\ No newline at end of file
+        self.Pedal_Smoothness_Right = 0.0
+        # Last complete revolution, computed on the host from crank angle and torque (see Powermeter_Cycle)
+        self.Cycles = 0                 # Revolutions so far
+        self.Cycle_TimeStamp = 0.0      # Device time the revolution ended in [s]
+        self.Cycle_Duration = 0.0       # [s]
+        self.Cycle_Cadence = 0.0        # [RPM]
+        self.Cycle_Work = 0.0           # [J]
+
+        self.Cycle_Power = 0.0
+        self.Cycle_Power_Left = 0.0
+        self.Cycle_Power_Right = 0.0
+
+        self.Cycle_Torque_Efficiency = 0.0
+        self.Cycle_Torque_Efficiency_Left = 0.0
+        self.Cycle_Torque_Efficiency_Right = 0.0
+
+        self.Cycle_Pedal_Smoothness = 0.0
+        self.Cycle_Pedal_Smoothness_Left = 0.0
+        self.Cycle_Pedal_Smoothness_Right = 0.0
+
+        self.Cycle_OCA = 0.0
+        self.Cycle_OCA_Left = 0.0
+        self.Cycle_OCA_Right = 0.0
@@ -0,0 +1,253 @@
+# Copyright (c) 2020, Martin Schmoll <martin.schmoll@meduniwien.ac.at>
+#
+# Crank angle prediction compensating the delay of the Powermeter data. A Kalman filter with the
+# unwrapped crank angle [deg] and the angular velocity [deg/s] as state (constant velocity model,
+# white angular acceleration as process noise) is updated with every crank angle sample and every
+# cadence value. The measurement time of a sample is its device time (see Powermeter_Timeline) minus
+# the latency of the Powermeter itself.
+#
+# The filter state (time, angle, velocity, covariance, process noise) is published in the telemetry
+# record, so any process can extrapolate it to "now" or a future time with predictAngle(), which
+# also yields the standard deviation of the prediction. An update costs a few us, a prediction from
+# a telemetry snapshot about as much as the snapshot.
+#
+# The software comes as it is, free of charge and is intended exclusively for non commercial use.
+# The author of this software does not take responsibilty for potential malfunctions. Feel free
+# to use, modify and extend the software to your personal needs.
+
+# Imports
+from __future__ import absolute_import, print_function
+import math
+
+# Delay between the measurement in the Powermeter and the device time of the page [s]
+PREDICTOR_LATENCY = 0.2
+
+# Spectral density of the angular acceleration [deg^2/s^3], covers the speed variation within a revolution
+PREDICTOR_NOISE = 2000.0
+
+# Variance of a crank angle sample [deg^2] and of a cadence value converted to [deg^2/s^2] (5 RPM)
+ANGLE_VARIANCE = 1.0
+CADENCE_VARIANCE = 30.0 ** 2
+
+# Samples further apart [s] restart the filter
+PREDICTOR_RESET = 1.0
+
+# Initial variance of the angle [deg^2] and the velocity [deg^2/s^2]
+_INITIAL_ANGLE_VARIANCE = 180.0 ** 2
+_INITIAL_VELOCITY_VARIANCE = 1000.0 ** 2
+
+# Telemetry fields of the filter state, in the order of getState()
+PREDICTOR_FIELDS = ("predictor_time", "predictor_angle", "predictor_velocity",
+                    "predictor_p00", "predictor_p01", "predictor_p11", "predictor_noise")
+
+
+# Returns (angle [deg, 0..360), standard deviation [deg]) at clock() time <t> from a filter state,
+# (NaN, NaN) without one. The state may come from a telemetry record (see PREDICTOR_FIELDS).
+def predictAngle(time, angle, velocity, p00, p01, p11, noise, t):
+
+    if time <= 0:
+        return float("nan"), float("nan")
+
+    dt = t - time
+    variance = p00 + dt * (2 * p01 + dt * p11)
+    if dt > 0:
+        variance += noise * dt * dt * dt / 3.0
+
+    return (angle + velocity * dt) % 360.0, math.sqrt(max(variance, 0.0))
+
+
+class Powermeter_Predictor(object):
+
+    def __init__(self, latency=PREDICTOR_LATENCY, noise=PREDICTOR_NOISE):
+
+        self.__latency = latency
+        self.__noise = noise
+        self.__time = None
+        self.__angle = 0.0          # Unwrapped [deg]
+        self.__velocity = 0.0       # [deg/s]
+        self.__p00 = 0.0
+        self.__p01 = 0.0
+        self.__p11 = 0.0
+
+
+    # Sets the latency of the Powermeter [s]
+    def setLatency(self, latency):
+        self.__latency = latency
+
+
+    # Returns the latency of the Powermeter [s]
+    def getLatency(self):
+        return self.__latency
+
+
+    # Propagates the state to the measurement time <t>, returns False if the filter (re)started
+    def __predict(self, t):
+
+        if self.__time is None or abs(t - self.__time) > PREDICTOR_RESET:
+            self.__time = t
+            self.__velocity = 0.0
+            self.__p00 = _INITIAL_ANGLE_VARIANCE
+            self.__p01 = 0.0
+            self.__p11 = _INITIAL_VELOCITY_VARIANCE
+            return False
+
+        dt = t - self.__time
+        if dt <= 0:
+            return True
+
+        p11 = self.__p11
+        q = self.__noise
+        self.__angle += self.__velocity * dt
+        self.__p00 += dt * (2 * self.__p01 + dt * p11) + q * dt * dt * dt / 3.0
+        self.__p01 += dt * p11 + q * dt * dt / 2.0
+        self.__p11 = p11 + q * dt
+        self.__time = t
+        return True
+
+
+    # Accounts a crank angle <angle> [deg] of a page with device time <t> [s]
+    def updateAngle(self, t, angle):
+
+        if not self.__predict(t - self.__latency):
+            self.__angle = angle
+            self.__p00 = ANGLE_VARIANCE
+            return
+
+        # Innovation on the circle
+        innovation = (angle - self.__angle + 180.0) % 360.0 - 180.0
+
+        p00 = self.__p00
+        p01 = self.__p01
+        s = p00 + ANGLE_VARIANCE
+        k0 = p00 / s
+        k1 = p01 / s
+
+        self.__angle += k0 * innovation
+        self.__velocity += k1 * innovation
+        self.__p00 = p00 - k0 * p00
+        self.__p01 = p01 - k0 * p01
+        self.__p11 -= k1 * p01
+
+
+    # Accounts a cadence <cadence> [RPM] of a page with device time <t> [s]
+    def updateCadence(self, t, cadence):
+
+        if not self.__predict(t - self.__latency):
+            self.__velocity = cadence * 6.0
+            self.__p11 = CADENCE_VARIANCE
+            return
+
+        innovation = cadence * 6.0 - self.__velocity
+
+        p01 = self.__p01
+        p11 = self.__p11
+        s = p11 + CADENCE_VARIANCE
+        k0 = p01 / s
+        k1 = p11 / s
+
+        self.__angle += k0 * innovation
+        self.__velocity += k1 * innovation
+        self.__p00 -= k0 * p01
+        self.__p01 = p01 - k0 * p11
+        self.__p11 = p11 - k1 * p11
+
+
+    # Accounts the (field, value) pairs of one page (see Powermeter_Decoder.convert) with device time <t> [s].
+    # Returns True if the state changed.
+    def update(self, t, fields):
+
+        changed = False
+        for field, value in fields:
+            if field == "crank_angle":
+                self.updateAngle(t, value)
+                changed = True
+            elif field == "cadence":
+                self.updateCadence(t, value)
+                changed = True
+        return changed
+
+
+    # Returns the filter state as (field, value) pairs for the telemetry
+    def getState(self):
+
+        # Keep the unwrapped angle small, the prediction wraps anyway
+        self.__angle %= 360.0
+        return (("predictor_time", self.__time if self.__time is not None else 0.0),
+                ("predictor_angle", self.__angle),
+                ("predictor_velocity", self.__velocity),
+                ("predictor_p00", self.__p00),
+                ("predictor_p01", self.__p01),
+                ("predictor_p11", self.__p11),
+                ("predictor_noise", self.__noise))
+
+
+    # Returns (angle [deg], standard deviation [deg]) at clock() time <t>
+    def predict(self, t):
+
+        if self.__time is None:
+            return float("nan"), float("nan")
+        return predictAngle(self.__time, self.__angle, self.__velocity, self.__p00, self.__p01, self.__p11, self.__noise, t)
+
+
+
+# Simple Testroutine: a rider at 60..100 RPM with a speed variation of +-5 % twice per revolution,
+# angle pages at 50 Hz and cadence pages at 5 Hz, delayed by the latency plus the transport. The angle
+# at the arrival of each page is predicted and compared with holding the last received angle.
+if __name__ == '__main__':
+
+    import random
+    import timeit
+
+    period = 655 / 32768.0
+    rng = random.Random(4)
+
+    # True angle on a fine grid
+    step = 0.001
+    angles = [0.0]
+    for i in range(60000):
+        t = i * step
+        rpm = 80.0 + 20.0 * math.sin(2 * math.pi * t / 30.0)
+        omega = rpm * 6.0 * (1 + 0.05 * math.sin(2 * angles[-1] * math.pi / 180.0))
+        angles.append(angles[-1] + omega * step)
+
+    def truth(t):
+        return angles[int(round(t / step))]
+
+    predictor = Powermeter_Predictor()
+    errors = []
+    held = []
+    covered = 0
+    t = 1.0
+    while t < 59.0:
+        measured = t - PREDICTOR_LATENCY
+        angle = (truth(measured) + rng.gauss(0, 0.5)) % 360.0
+        fields = (("crank_angle", angle),)
+        if int(round(t / period)) % 10 == 0:
+            fields += (("cadence", (truth(measured) - truth(measured - 60.0 / 80)) / 360.0 * 80 + rng.gauss(0, 2)),)
+        if rng.random() >= 0.01:
+            predictor.update(t, fields)
+
+        # Query at a random time until the next page, as a control loop would
+        now = t + 0.004 + rng.random() * period
+        predicted, sigma = predictor.predict(now)
+        if t > 3.0:
+            error = (predicted - truth(now) + 180.0) % 360.0 - 180.0
+            errors.append(error)
+            held.append((angle - truth(now) + 180.0) % 360.0 - 180.0)
+            covered += abs(error) <= 2 * sigma
+        t += period
+
+    def rms(values):
+        return math.sqrt(sum(v * v for v in values) / len(values))
+
+    print("prediction error: rms %.2f deg, max %.2f deg, within 2 sigma: %.1f %%" %
+          (rms(errors), max(abs(e) for e in errors), 100.0 * covered / len(errors)))
+    print("last angle held:  rms %.2f deg" % rms(held))
+    assert rms(errors) < rms(held) / 10
+    assert covered > 0.9 * len(errors)
+
+    n = 100000
+    seconds = timeit.timeit(lambda: predictor.update(t, (("crank_angle", 10.0), ("torque_total", 20.0))), number=n)
+    print("update:  %.2f us" % (seconds / n * 1e6))
+    seconds = timeit.timeit(lambda: predictor.predict(t), number=n)
+    print("predict: %.2f us" % (seconds / n * 1e6))
@@ -0,0 +1,318 @@
+# Copyright (c) 2020, Martin Schmoll <martin.schmoll@meduniwien.ac.at>
+#
+# Rate and jitter estimation of the ROTOR Fast Data pages, fed with the arrival time of every page in
+# the reading process. Per page type it keeps an exponentially weighted moving average of the
+# inter-arrival time (-> rate), a histogram of the inter-arrival times (-> percentiles) and the gaps
+# against the interval the schedule expects for the type. It also counts the gaps in the whole page
+# stream and checks the achieved interleave of 0xF2/0xF3/0xF4 pages against the configured FastMode
+# schedule. Every page costs O(1).
+#
+# FastMode schedule: <F1> pages per second in total, <F2> of them interleaved pages (0xF3, alternating
+# with 0xF4 if Parameters are requested for 0xF4), i.e. <F1>/<F2> - 1 0xF2 pages between two
+# interleaved pages.
+#
+# The software comes as it is, free of charge and is intended exclusively for non commercial use.
+# The author of this software does not take responsibilty for potential malfunctions. Feel free
+# to use, modify and extend the software to your personal needs.
+
+# Imports
+from __future__ import absolute_import, print_function
+import math
+
+# Page types
+PAGE_F2 = 0xF2
+PAGE_F3 = 0xF3
+PAGE_F4 = 0xF4
+PAGES = (PAGE_F2, PAGE_F3, PAGE_F4)
+
+# Weight of the newest inter-arrival time in the moving averages
+RATE_ALPHA = 0.05
+
+# Weight of the newest page in the fractions of page types (~10 s at 50 pages/s)
+SHARE_ALPHA = 0.002
+
+# Pages further apart than GAP_FACTOR expected intervals (channel periods for the whole stream) leave a gap
+GAP_FACTOR = 1.5
+
+# Histogram of inter-arrival times: logarithmic bins from 1 ms to 10 s
+HISTOGRAM_MIN = 0.001
+HISTOGRAM_MAX = 10.0
+HISTOGRAM_BINS = 400
+_BINS_PER_LOG = HISTOGRAM_BINS / math.log(HISTOGRAM_MAX / HISTOGRAM_MIN)
+
+
+# Estimates of a single page type
+class _PageStatistics(object):
+
+    def __init__(self):
+
+        self.count = 0
+        self.last = None
+        self.interval = None        # EWMA of the inter-arrival time [s]
+        self.variance = 0.0         # EWMA of its squared deviation [s^2]
+        self.share = 0.0            # EWMA of the fraction of all pages that are of this type
+        self.histogram = [0] * (HISTOGRAM_BINS + 2)     # Below, bins, above
+        self.gaps = 0
+        self.missed = 0             # Pages of this type estimated to be lost in the gaps
+
+
+class Powermeter_Rate(object):
+
+    def __init__(self):
+
+        self.__pages = dict((page, _PageStatistics()) for page in PAGES)
+        self.__expected = dict((page, None) for page in PAGES)
+
+        # Gaps in the stream of pages of all types
+        self.__period = None            # Configured channel period [s]
+        self.__interval = None          # EWMA of the inter-arrival time of all pages [s]
+        self.__last = None
+        self.__gaps = 0
+        self.__missed = 0               # Pages estimated to be lost in the gaps
+
+        # Interleave check
+        self.__run = 0                  # 0xF2 pages since the last interleaved page
+        self.__between = 0              # Interleaved pages since the last 0xF2 page
+        self.__expectedRun = None
+        self.__alternate = False
+        self.__lastInterleaved = None
+        self.__interleaveErrors = 0
+
+
+    # Sets the configured FastMode schedule: <f1> pages/s in total, <f2> interleaved pages/s, and
+    # whether the interleaved pages alternate between 0xF3 and 0xF4
+    def setSchedule(self, f1, f2, f4_active):
+
+        interleaved = float(f2)
+        self.__expected[PAGE_F2] = float(f1) - interleaved
+        self.__expected[PAGE_F3] = interleaved / 2 if f4_active else interleaved
+        self.__expected[PAGE_F4] = interleaved / 2 if f4_active else 0.0
+
+        self.__period = 1.0 / f1
+        self.__expectedRun = int(round(float(f1) / f2)) - 1 if f2 > 0 else None
+        self.__alternate = f4_active
+
+
+    # Returns the expected rate of <page> in [Hz], None without a schedule
+    def getExpectedRate(self, page):
+        return self.__expected[page]
+
+
+    # Accounts a page of type <page> received at <t> [s]
+    def update(self, page, t):
+
+        statistics = self.__pages.get(page)
+        if statistics is None:
+            return
+
+        # Shares of the page types
+        for other in self.__pages.values():
+            other.share += SHARE_ALPHA * ((other is statistics) - other.share)
+
+        # Gaps, against the configured channel period if known
+        if self.__last is not None:
+            dt = t - self.__last
+            period = self.__period if self.__period is not None else self.__interval
+            if period is not None and dt > GAP_FACTOR * period:
+                self.__gaps += 1
+                self.__missed += int(round(dt / period)) - 1
+            if self.__interval is None:
+                self.__interval = dt
+            else:
+                self.__interval += RATE_ALPHA * (dt - self.__interval)
+        self.__last = t
+
+        statistics.count += 1
+        last = statistics.last
+        statistics.last = t
+
+        if last is not None:
+            dt = t - last
+
+            # Gaps, against the interval the schedule expects for this type if known
+            missed = self.__getMissed(page, dt, statistics)
+            if missed > 0:
+                statistics.gaps += 1
+                statistics.missed += missed
+
+            if statistics.interval is None:
+                statistics.interval = dt
+            else:
+                deviation = dt - statistics.interval
+                statistics.interval += RATE_ALPHA * deviation
+                statistics.variance += RATE_ALPHA * (deviation * deviation - statistics.variance)
+
+            if dt < HISTOGRAM_MIN:
+                statistics.histogram[0] += 1
+            elif dt >= HISTOGRAM_MAX:
+                statistics.histogram[-1] += 1
+            else:
+                statistics.histogram[1 + int(math.log(dt / HISTOGRAM_MIN) * _BINS_PER_LOG)] += 1
+
+        # Interleave
+        if page == PAGE_F2:
+            self.__run += 1
+            self.__between = 0
+        else:
+            self.__between += 1
+            if self.__expectedRun is not None and self.__lastInterleaved is not None:
+                if abs(self.__run - self.__expectedRun) > 1 or \
+                   (self.__alternate and page == self.__lastInterleaved):
+                    self.__interleaveErrors += 1
+            self.__lastInterleaved = page
+            self.__run = 0
+
+
+    # Returns the number of pages of type <page> missed in the <dt> [s] since the previous one
+    def __getMissed(self, page, dt, statistics):
+
+        expected = self.__expected[page]
+        if not expected:
+            interval = statistics.interval
+            if interval is None or dt <= GAP_FACTOR * interval:
+                return 0
+            return int(round(dt / interval)) - 1
+
+        if page != PAGE_F2:
+            interval = 1.0 / expected
+            return int(round(dt / interval)) - 1 if dt > GAP_FACTOR * interval else 0
+
+        # 0xF2 pages fill the channel periods not taken by interleaved pages: the slots in between are
+        # taken by the interleaved pages received, or the ones due by the schedule if these were lost
+        slots = int(round(dt / self.__period)) - 1
+        if slots <= 0:
+            return 0
+        interleaved = max(self.__between, int(round(slots * (1.0 - expected * self.__period))))
+        if self.__between == 0 and self.__expectedRun is not None and self.__run >= self.__expectedRun:
+            interleaved = max(interleaved, 1)
+        return max(slots - interleaved, 0)
+
+
+    # Returns the EWMA rate of <page> in [Hz], 0 before two pages were received. With <now> the rate
+    # decays while no pages arrive.
+    def getRate(self, page, now=None):
+
+        statistics = self.__pages[page]
+        if statistics.interval is None or statistics.interval <= 0:
+            return 0.0
+
+        interval = statistics.interval
+        if now is not None:
+            interval = max(interval, now - statistics.last)
+        return 1.0 / interval
+
+
+    # Returns the standard deviation of the inter-arrival time of <page> (EWMA) in [s]
+    def getJitter(self, page):
+        return math.sqrt(self.__pages[page].variance)
+
+
+    # Returns the <q> quantile (0..1) of the inter-arrival times of <page> in [s], None without data
+    def getPercentile(self, page, q):
+
+        histogram = self.__pages[page].histogram
+        total = sum(histogram)
+        if total == 0:
+            return None
+
+        rank = q * total
+        cumulative = 0
+        for i, n in enumerate(histogram):
+            cumulative += n
+            if cumulative >= rank and n > 0:
+                if i == 0:
+                    return HISTOGRAM_MIN
+                if i == len(histogram) - 1:
+                    return HISTOGRAM_MAX
+                # Geometric center of the bin
+                return HISTOGRAM_MIN * math.exp((i - 0.5) / _BINS_PER_LOG)
+        return HISTOGRAM_MAX
+
+
+    # Returns the number of pages received of type <page>
+    def getCount(self, page):
+        return self.__pages[page].count
+
+
+    # Returns (gaps, missed pages) of type <page>, or in the stream of pages of all types
+    def getGaps(self, page=None):
+
+        if page is None:
+            return self.__gaps, self.__missed
+        statistics = self.__pages[page]
+        return statistics.gaps, statistics.missed
+
+
+    # Returns the recent fraction of pages of type <page> (EWMA) and the fraction the schedule expects
+    def getShare(self, page):
+
+        total = sum(rate for rate in self.__expected.values() if rate is not None)
+        expected = self.__expected[page] / total if total else None
+        return self.__pages[page].share, expected
+
+
+    # Returns the number of interleaved pages that did not follow the configured schedule
+    def getInterleaveErrors(self):
+        return self.__interleaveErrors
+
+
+    # Returns a short printable summary
+    def getSummary(self):
+
+        lines = []
+        for page in PAGES:
+            p50 = self.getPercentile(page, 0.5)
+            p95 = self.getPercentile(page, 0.95)
+            share, expected = self.getShare(page)
+            gaps, missed = self.getGaps(page)
+            lines.append("0x%02X: %6.2f Hz (expected %s), interval p50 %s p95 %s ms, jitter %.1f ms, share %.3f (expected %s), gaps %d (%d missed)" %
+                         (page, self.getRate(page), self.__expected[page],
+                          "-" if p50 is None else "%.1f" % (p50 * 1000), "-" if p95 is None else "%.1f" % (p95 * 1000),
+                          self.getJitter(page) * 1000, share, "-" if expected is None else "%.3f" % expected, gaps, missed))
+        lines.append("gaps: %d (%d pages missed), interleave errors: %d" % (self.__gaps, self.__missed, self.__interleaveErrors))
+        return "\n".join(lines)
+
+
+
+# Simple Testroutine feeding a simulated FastMode schedule with timing noise and lost pages, checking
+# the missed pages per type and measuring the cost per page.
+if __name__ == '__main__':
+
+    import random
+    import timeit
+
+    f1, f2 = 50, 5
+    rate = Powermeter_Rate()
+    rate.setSchedule(f1, f2, True)
+
+    rng = random.Random(1)
+    interleaved = 0
+    t = 0.0
+    pages = []
+    lost = dict((page, 0) for page in PAGES)
+    for i in range(50000):
+        t = t + 1.0 / f1 + rng.gauss(0, 0.002)
+        if i % (f1 // f2) == f1 // f2 - 1:
+            page = PAGE_F3 if interleaved % 2 == 0 else PAGE_F4
+            interleaved = interleaved + 1
+        else:
+            page = PAGE_F2
+        # 1% of the pages get lost
+        if rng.random() >= 0.01:
+            pages.append((page, t))
+        else:
+            lost[page] += 1
+
+    for page, t in pages:
+        rate.update(page, t)
+    print(rate.getSummary())
+
+    # Missed pages per type as lost
+    for page in PAGES:
+        print("0x%02X: %d lost, %d missed" % (page, lost[page], rate.getGaps(page)[1]))
+        assert abs(rate.getGaps(page)[1] - lost[page]) <= 0.05 * lost[page] + 2
+
+    estimator = Powermeter_Rate()
+    estimator.setSchedule(f1, f2, True)
+    seconds = timeit.timeit(lambda: [estimator.update(page, t) for page, t in pages], number=3) / 3
+    print("update: %.2f us/page" % (seconds / len(pages) * 1e6))
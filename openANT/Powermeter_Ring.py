@@ -0,0 +1,292 @@
+# Copyright (c) 2020, Martin Schmoll <martin.schmoll@meduniwien.ac.at>
+#
+# This class keeps every received Powermeter sample in a ring buffer in shared memory. The reading
+# process appends without taking any lock, any number of consumers (control loop, logger, GUI, ...)
+# follow it with their own cursor and get NumPy views of the new samples without copying. Samples are
+# appended in frame order, one page per frame index, with a sample of qid ID_NONE for every lost frame
+# (see Powermeter_Timeline), so the series is evenly spaced in device time. A dropout released as one
+# Resync is a single ID_NONE sample at the index of its first frame with raw the number of frames lost
+# (at most 0x7FFF), the next sample continues at the index following the dropout.
+#
+# Segment layout (little endian):
+#
+#   Offset  Type     Field
+#        0  uint32   head            number of samples written so far (modulo 2^32)
+#        4  uint32   capacity        number of sample slots, a power of two
+#        8  uint32   sample_size     16
+#       16  float64  time_offset     device time of frame index 0 in clock() seconds
+#       24  float64  period          device time between two frame indexes in [s]
+#       64           samples[capacity]
+#
+# Sample layout (16 bytes):
+#
+#   Offset  Type     Field
+#        0  float64  t               clock() when the page was received in [s], NaN for lost frames
+#        8  uint8    frame           frame counter (time tag) of the fast page
+#        9  uint8    qid             quantity ID (ID_CRANK_ANGLE, ID_TORQUE_TOTAL, ...), ID_NONE for lost frames
+#       10  int16    raw             raw value as sent by the Powermeter, frames lost by a Resync for ID_NONE
+#       12  uint32   index           unwrapped frame index, device time = time_offset + index * period
+#
+# Sample <n> is stored in slot n % capacity and published by storing head = n + 1 afterwards, so a
+# consumer only reads slots below head. A consumer that falls more than <capacity> samples behind
+# has lost the oldest ones, read_since reports how many.
+#
+# The software comes as it is, free of charge and is intended exclusively for non commercial use.
+# The author of this software does not take responsibilty for potential malfunctions. Feel free
+# to use, modify and extend the software to your personal needs.
+
+# Imports
+from __future__ import absolute_import, print_function
+import atexit
+import struct
+import sys
+import numpy
+from multiprocessing import shared_memory
+from openANT.Powermeter_Telemetry import clock
+
+# The header is accessed in native byte order
+if sys.byteorder != "little":
+    raise ImportError("Powermeter_Ring requires a little endian platform")
+
+# Layout of a sample, see above
+SAMPLE_DTYPE = numpy.dtype({"names":   ["t", "frame", "qid", "raw", "index"],
+                            "formats": ["<f8", "u1", "u1", "<i2", "<u4"],
+                            "offsets": [0, 8, 9, 10, 12],
+                            "itemsize": 16})
+
+# Size of the header in front of the samples
+RING_HEADER_SIZE = 64
+
+# Default number of samples kept, ~20 min at 55 samples/s
+RING_CAPACITY = 65536
+
+_MASK = 0xFFFFFFFF
+_SAMPLE = struct.Struct("<dBBhI")
+
+
+class Powermeter_Ring(object):
+
+    # Creates a new ring of <capacity> samples, or maps the existing ring <name>
+    def __init__(self, name=None, capacity=RING_CAPACITY):
+
+        self.__owner = name is None
+
+        if self.__owner:
+            if capacity <= 0 or capacity & (capacity - 1):
+                raise ValueError("Capacity must be a power of two")
+
+            self.__shm = shared_memory.SharedMemory(create=True, size=RING_HEADER_SIZE + capacity * SAMPLE_DTYPE.itemsize)
+            self.__shm.buf[:RING_HEADER_SIZE] = bytes(RING_HEADER_SIZE)
+            struct.pack_into("<III", self.__shm.buf, 0, 0, capacity, SAMPLE_DTYPE.itemsize)
+        else:
+            self.__shm = self.__attach(name)
+
+        self.__map()
+
+
+    # Maps an existing segment, see Powermeter_Telemetry
+    @staticmethod
+    def __attach(name):
+
+        if sys.version_info >= (3, 13):
+            return shared_memory.SharedMemory(name=name, track=False)
+        return shared_memory.SharedMemory(name=name)
+
+
+    def __map(self):
+
+        self.__words = self.__shm.buf[:RING_HEADER_SIZE].cast("I")
+        self.__doubles = self.__shm.buf[:RING_HEADER_SIZE].cast("d")
+        self.__capacity = self.__words[1]
+        self.__samples = numpy.ndarray((self.__capacity,), dtype=SAMPLE_DTYPE,
+                                       buffer=self.__shm.buf, offset=RING_HEADER_SIZE)
+
+        # The views have to be released before the segment can be closed
+        atexit.register(self.close)
+
+
+    # Processes started with 'spawn' map the ring by its name
+    def __getstate__(self):
+        return {"name": self.__shm.name}
+
+    def __setstate__(self, state):
+        self.__owner = False
+        self.__shm = self.__attach(state["name"])
+        self.__map()
+
+
+    # Returns the name of the shared memory segment
+    def getName(self):
+        return self.__shm.name
+
+
+    # Returns the number of sample slots
+    def getCapacity(self):
+        return self.__capacity
+
+
+    # Appends the (qid, raw) samples of one page received at <t> with frame index <index>. Lock-free,
+    # but there must be a single writer.
+    def write(self, t, frame, values, index=0):
+
+        words = self.__words
+        buf = self.__shm.buf
+        mask = self.__capacity - 1
+
+        head = words[0]
+        for qid, raw in values:
+            _SAMPLE.pack_into(buf, RING_HEADER_SIZE + (head & mask) * 16, t, frame, qid, raw, index & _MASK)
+            head = (head + 1) & _MASK
+
+        words[0] = head
+
+
+    # Publishes the device time base: frame index i was sent at <offset> + i * <period> in clock() seconds
+    def setTimeBase(self, offset, period):
+
+        self.__doubles[2] = offset
+        self.__doubles[3] = period
+
+
+    # Returns (offset, period) of the device time base, see setTimeBase
+    def getTimeBase(self):
+        return self.__doubles[2], self.__doubles[3]
+
+
+    # Returns the device times of <samples> (from read_since) in clock() seconds
+    def getDeviceTime(self, samples):
+
+        offset, period = self.getTimeBase()
+        return offset + samples["index"] * period
+
+
+    # Returns a new cursor, at the next sample to be written, or at the oldest sample still kept
+    def getCursor(self, oldest=False):
+
+        head = self.__words[0]
+
+        if oldest:
+            return (head - min(head, self.__capacity)) & _MASK
+        return head
+
+
+    # Returns (samples, cursor, lost): a view of the samples written since <cursor>, the cursor to pass
+    # next time and the number of samples lost because the consumer fell behind. The view ends at the
+    # end of the buffer, call again until it is empty to get everything. The slots of a view are only
+    # reused after <capacity> further samples, compare getLost(cursor) before and after using it if
+    # that cannot be ruled out.
+    def read_since(self, cursor):
+
+        head = self.__words[0]
+        capacity = self.__capacity
+
+        available = (head - cursor) & _MASK
+        lost = 0
+        if available > capacity:
+            lost = available - capacity
+            cursor = (head - capacity) & _MASK
+            available = capacity
+
+        start = cursor & (capacity - 1)
+        count = min(available, capacity - start)
+
+        return self.__samples[start:start + count], (cursor + count) & _MASK, lost
+
+
+    # Returns the number of samples from <cursor> on that were already overwritten
+    def getLost(self, cursor):
+
+        available = (self.__words[0] - cursor) & _MASK
+        return max(0, available - self.__capacity)
+
+
+    # Unmaps the ring, the creator also removes the segment. Views returned by read_since must be gone.
+    def close(self):
+
+        if self.__shm is None:
+            return
+
+        atexit.unregister(self.close)
+        self.__words.release()
+        self.__doubles.release()
+        self.__samples = None
+
+        self.__shm.close()
+        if self.__owner:
+            self.__shm.unlink()
+        self.__shm = None
+
+
+
+# Writer process appending pages of two samples with a running frame counter
+def _writer(name, pages):
+
+    ring = Powermeter_Ring(name)
+    for i in range(pages):
+        ring.write(clock(), i & 0xFF, ((3, i & 0x7FFF), (15, -(i & 0x7FFF))), i)
+    ring.close()
+
+
+# Consumer process checking that it sees every sample exactly once and in order
+def _consumer(name, pages, result):
+
+    ring = Powermeter_Ring(name)
+    cursor = ring.getCursor(oldest=True)
+
+    received = 0
+    lost = 0
+    errors = 0
+    while received + lost < 2 * pages:
+        samples, cursor, n = ring.read_since(cursor)
+        lost = lost + n
+        if len(samples) == 0:
+            continue
+
+        # Each page adds a crank angle and a negated torque sample
+        angles = samples["raw"][samples["qid"] == 3]
+        torques = samples["raw"][samples["qid"] == 15]
+        if len(angles) == len(torques) and (angles != -torques).any():
+            errors = errors + 1
+        received = received + len(samples)
+
+    samples = None
+    angles = None
+    torques = None
+    result.put((received, lost, errors))
+    ring.close()
+
+
+# Simple Testroutine measuring the append time and letting two consumer processes follow a fast writer.
+if __name__ == '__main__':
+
+    import timeit
+    from multiprocessing import Process, Queue
+
+    ring = Powermeter_Ring()
+
+    n = 100000
+    seconds = timeit.timeit(lambda: ring.write(clock(), 1, ((3, 100), (15, 200)), 1), number=n)
+    print("write (page of 2 samples): %6.2f us" % (seconds / n * 1e6))
+
+    cursor = ring.getCursor(oldest=True)
+    seconds = timeit.timeit(lambda: ring.read_since(cursor), number=n)
+    print("read_since (view):         %6.2f us" % (seconds / n * 1e6))
+
+    pages = 30000
+    ring.close()
+    ring = Powermeter_Ring()
+    result = Queue()
+    consumers = [Process(target=_consumer, args=(ring.getName(), pages, result)) for i in range(2)]
+    for consumer in consumers:
+        consumer.start()
+
+    writer = Process(target=_writer, args=(ring.getName(), pages))
+    writer.start()
+    writer.join()
+
+    for consumer in consumers:
+        received, lost, errors = result.get()
+        print("consumer: received %d, lost %d, inconsistent %d of %d samples" % (received, lost, errors, 2 * pages))
+        consumer.join()
+
+    ring.close()
@@ -0,0 +1,250 @@
+# Copyright (c) 2020, Martin Schmoll <martin.schmoll@meduniwien.ac.at>
+#
+# Crank angle triggered callbacks. Clients register a crank angle and a callback, which then fires
+# once per revolution at the predicted time the crank passes that angle. A timer thread takes the
+# crank angle predictor state (see Powermeter_Predictor), computes the next crossing of every trigger
+# from the predicted angle and velocity, sleeps until shortly before the earliest one, plans again
+# with the fresh state and spins for the last fraction of a millisecond. How late each callback
+# fired compared with the predicted crossing is recorded per trigger.
+#
+# Callbacks run in the timer thread and delay the following triggers, they have to return quickly.
+# Exceptions raised by a callback are logged and do not stop the thread.
+#
+# The software comes as it is, free of charge and is intended exclusively for non commercial use.
+# The author of this software does not take responsibilty for potential malfunctions. Feel free
+# to use, modify and extend the software to your personal needs.
+
+# Imports
+from __future__ import absolute_import, print_function
+import logging
+import math
+import threading
+from openANT.Powermeter_Telemetry import clock
+from openANT.Powermeter_Predictor import predictAngle
+
+# Longest sleep before planning again with a fresh predictor state [s]
+SCHEDULER_REPLAN = 0.02
+
+# Time before a crossing from which on the thread spins instead of sleeping [s]
+SCHEDULER_SPIN = 0.001
+
+# A crossing predicted up to this long ago that did not fire yet fires late instead of being skipped [s]
+SCHEDULER_MAX_LATE = 0.02
+
+# Below this angular velocity no triggers fire [deg/s], i.e. 10 RPM
+SCHEDULER_MIN_VELOCITY = 60.0
+
+_logger = logging.getLogger("openANT.Powermeter_Scheduler")
+
+
+# A registered crank angle with its lateness statistics
+class _Trigger(object):
+
+    def __init__(self, angle, callback):
+
+        self.angle = angle % 360.0
+        self.callback = callback
+        self.last = None            # Predicted time of the last firing
+
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.maximum = 0.0
+
+
+    def account(self, lateness):
+
+        self.count += 1
+        self.total += lateness
+        self.squares += lateness * lateness
+        self.maximum = max(self.maximum, lateness)
+
+
+class Powermeter_Scheduler(object):
+
+    # <state> returns the predictor state as arguments of predictAngle (without the time), e.g.
+    # Powermeter_Predictor.getState values or myOpenAnt_Manager.getPredictorState
+    def __init__(self, state, clock=clock):
+
+        self.__state = state
+        self.__clock = clock
+        self.__condition = threading.Condition()
+        self.__triggers = {}
+        self.__next = 1
+        self.__changed = False
+        self.__stopped = True
+        self.__thread = None
+
+
+    # Starts the timer thread
+    def start(self):
+
+        with self.__condition:
+            if self.__thread is not None:
+                return
+            self.__stopped = False
+            self.__thread = threading.Thread(name='ANT+_Manager_Scheduler_Thread', target=self.__run, args=())
+            self.__thread.daemon = True
+            self.__thread.start()
+
+
+    # Stops the timer thread
+    def stop(self):
+
+        with self.__condition:
+            thread = self.__thread
+            self.__stopped = True
+            self.__thread = None
+            self.__condition.notify()
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+
+    # Registers <callback> to fire at crank angle <angle> [deg] in every revolution. It is called with
+    # the angle, the predicted time of the crossing and the standard deviation of the predicted angle
+    # [deg]. Returns the ID of the trigger.
+    def addTrigger(self, angle, callback):
+
+        with self.__condition:
+            trigger = self.__next
+            self.__next += 1
+            self.__triggers[trigger] = _Trigger(angle, callback)
+            self.__changed = True
+            self.__condition.notify()
+        return trigger
+
+
+    # Removes the trigger <trigger>
+    def removeTrigger(self, trigger):
+
+        with self.__condition:
+            self.__triggers.pop(trigger, None)
+            self.__changed = True
+            self.__condition.notify()
+
+
+    # Returns (count, mean, standard deviation, maximum) of how late the trigger <trigger>, or all
+    # triggers, fired after the predicted crossing [s]
+    def getLateness(self, trigger=None):
+
+        with self.__condition:
+            if trigger is None:
+                triggers = list(self.__triggers.values())
+            else:
+                triggers = [self.__triggers[trigger]]
+
+        count = sum(t.count for t in triggers)
+        if count == 0:
+            return 0, 0.0, 0.0, 0.0
+
+        mean = sum(t.total for t in triggers) / count
+        variance = sum(t.squares for t in triggers) / count - mean * mean
+        return count, mean, math.sqrt(max(variance, 0.0)), max(t.maximum for t in triggers)
+
+
+    # Returns (time, trigger, uncertainty) of the next crossing of any trigger, None if none is due
+    def __plan(self, triggers, now):
+
+        state = self.__state()
+        angle, sigma = predictAngle(*(tuple(state) + (now,)))
+        velocity = state[2]
+        if math.isnan(angle) or velocity < SCHEDULER_MIN_VELOCITY:
+            return None
+
+        revolution = 360.0 / velocity
+        plan = None
+        for trigger in triggers:
+
+            # Time to the crossing, a crossing just passed is taken as late rather than a revolution ahead
+            ahead = (trigger.angle - angle) % 360.0
+            if ahead > 360.0 - velocity * SCHEDULER_MAX_LATE:
+                ahead -= 360.0
+            t = now + ahead / velocity
+
+            # Once per revolution
+            if trigger.last is not None and t - trigger.last < 0.5 * revolution:
+                t += revolution
+
+            if plan is None or t < plan[0]:
+                plan = (t, trigger, sigma)
+
+        return plan
+
+
+    def __run(self):
+
+        while True:
+            with self.__condition:
+                if self.__stopped:
+                    return
+                triggers = list(self.__triggers.values())
+
+            now = self.__clock()
+            plan = self.__plan(triggers, now) if triggers else None
+
+            if plan is not None and plan[0] - now <= SCHEDULER_SPIN:
+                t, trigger, sigma = plan
+                while self.__clock() < t:
+                    pass
+                fired = self.__clock()
+                trigger.last = t
+                trigger.account(fired - t)
+                # A failing callback must not stop the other triggers
+                try:
+                    trigger.callback(trigger.angle, t, sigma)
+                except Exception:
+                    _logger.exception("Callback of the trigger at %.1f deg failed", trigger.angle)
+                continue
+
+            wait = SCHEDULER_REPLAN
+            if plan is not None:
+                wait = min(wait, plan[0] - now - SCHEDULER_SPIN)
+
+            with self.__condition:
+                if not self.__stopped and not self.__changed:
+                    self.__condition.wait(wait)
+                self.__changed = False
+
+
+
+# Simple Testroutine: a crank turning at 90 RPM with the predictor state taken from the true motion,
+# triggers at 45 and 200 deg and a failing one at 120 deg. The true angle at every firing and the
+# lateness are reported.
+if __name__ == '__main__':
+
+    import time
+
+    start = clock()
+    velocity = 90 * 6.0
+
+    def truth(t):
+        return ((t - start) * velocity + 10.0) % 360.0
+
+    # Refreshed at 50 Hz, as by the reading process
+    def state():
+        t = start + math.floor((clock() - start) * 50) / 50.0
+        return t, truth(t), velocity, 1.0, 0.0, 0.0, 2000.0
+
+    fired = []
+    scheduler = Powermeter_Scheduler(state)
+    scheduler.start()
+    triggers = [scheduler.addTrigger(angle, lambda angle, t, sigma: fired.append((angle, truth(clock()))))
+                for angle in (45.0, 200.0)]
+
+    def fail(angle, t, sigma):
+        raise RuntimeError("failing callback")
+    _logger.setLevel(logging.CRITICAL)
+    failing = scheduler.addTrigger(120.0, fail)
+
+    time.sleep(4.0)
+    scheduler.stop()
+
+    for trigger, angle in zip(triggers, (45.0, 200.0)):
+        errors = [(actual - angle + 180.0) % 360.0 - 180.0 for a, actual in fired if a == angle]
+        count, mean, std, maximum = scheduler.getLateness(trigger)
+        print("%5.1f deg: %d firings, angle error max %.2f deg, lateness mean %.0f us, std %.0f us, max %.0f us" %
+              (angle, count, max(abs(e) for e in errors), mean * 1e6, std * 1e6, maximum * 1e6))
+        assert count in (5, 6, 7)
+        assert max(abs(e) for e in errors) < 1.0
+    assert scheduler.getLateness(failing)[0] in (5, 6, 7)
@@ -0,0 +1,341 @@
+# Copyright (c) 2020, Martin Schmoll <martin.schmoll@meduniwien.ac.at>
+#
+# This class keeps the latest Powermeter measurements in one fixed-layout record in shared memory.
+# The reader process writes it without taking any lock, other processes (Python or not) map it and
+# take consistent snapshots guarded by a sequence lock (seqlock).
+#
+# Record layout (little endian, 464 bytes, every field aligned to its size):
+#
+#   Offset  Type     Field
+#        0  uint32   sequence                  odd while the record is being written
+#        4  int32    battery_status            -1 until the first Battery Status page
+#        8  float64  timestamp                 clock() of the last update in [s]
+#       16  float64  oca                       [deg]
+#       24  float64  force_left                [N]
+#       32  float64  force_right               [N]
+#       40  float64  force_total               [N]
+#       48  float64  torque_left               [Nm]
+#       56  float64  torque_right              [Nm]
+#       64  float64  torque_total              [Nm]
+#       72  float64  power                     [W]
+#       80  float64  crank_angle               [deg]
+#       88  float64  cadence                   [RPM]
+#       96  float64  balance_left              [%]
+#      104  float64  balance_right             [%]
+#      112  float64  torque_efficiency_left    [%]
+#      120  float64  torque_efficiency_right   [%]
+#      128  float64  pedal_smoothness_left     [%]
+#      136  float64  pedal_smoothness_right    [%]
+#      144  float64  rate_f2                   rate of 0xF2 pages [Hz]
+#      152  float64  rate_f3                   rate of 0xF3 pages [Hz]
+#      160  float64  rate_f4                   rate of 0xF4 pages [Hz]
+#      168  float64  jitter_f2                 standard deviation of the 0xF2 inter-arrival time [s]
+#      176  int32    gaps                      gaps in the stream of fast pages
+#      180  int32    interleave_errors         interleaved pages off the FastMode schedule
+#      184  int32    lost_frames               frames missing by the frame counter
+#      188  int32    duplicate_frames          frames received more than once
+#      192  float64  cycle_time                device time the last revolution ended [s], see Powermeter_Cycle
+#      200  float64  cycle_duration            duration of the last revolution [s]
+#      208  float64  cycle_cadence             [RPM]
+#      216  float64  cycle_work                work of the total torque [J]
+#      224  float64  cycle_power               [W]
+#      232  float64  cycle_power_left          [W]
+#      240  float64  cycle_power_right         [W]
+#      248  float64  cycle_torque_eff          [%]
+#      256  float64  cycle_torque_eff_left     [%]
+#      264  float64  cycle_torque_eff_right    [%]
+#      272  float64  cycle_smoothness          [%]
+#      280  float64  cycle_smoothness_left     [%]
+#      288  float64  cycle_smoothness_right    [%]
+#      296  float64  cycle_oca                 [deg]
+#      304  float64  cycle_oca_left            [deg]
+#      312  float64  cycle_oca_right           [deg]
+#      320  int32    cycles                    revolutions published so far
+#      324           padding
+#      328  float64  predictor_time            clock() of the crank angle predictor state [s], see Powermeter_Predictor
+#      336  float64  predictor_angle           crank angle at predictor_time [deg]
+#      344  float64  predictor_velocity        [deg/s]
+#      352  float64  predictor_p00             covariance of angle and velocity
+#      360  float64  predictor_p01
+#      368  float64  predictor_p11
+#      376  float64  predictor_noise           process noise [deg^2/s^3]
+#      384  float64  interval_p50_f2           median of the 0xF2 inter-arrival time [s], see Powermeter_Rate
+#      392  float64  interval_p95_f2           95th percentile of the 0xF2 inter-arrival time [s]
+#      400  float64  interval_p50_f3           [s]
+#      408  float64  interval_p95_f3           [s]
+#      416  float64  interval_p50_f4           [s]
+#      424  float64  interval_p95_f4           [s]
+#      432  float64  jitter_f3                 standard deviation of the 0xF3 inter-arrival time [s]
+#      440  float64  jitter_f4                 standard deviation of the 0xF4 inter-arrival time [s]
+#      448  int32    gaps_f2                   gaps in the 0xF2 pages
+#      452  int32    gaps_f3                   gaps in the 0xF3 pages
+#      456  int32    gaps_f4                   gaps in the 0xF4 pages
+#      460           padding
+#
+# Writing (a single writer only): increment sequence (now odd), store the fields, increment sequence
+# again (now even). Reading: load sequence, retry while it is odd, copy the record, load sequence again
+# and retry if it changed. Non-Python processes map the segment by its name (see getName) and have to
+# put a release fence before the second increment and acquire fences around the copy.
+#
+# The software comes as it is, free of charge and is intended exclusively for non commercial use.
+# The author of this software does not take responsibilty for potential malfunctions. Feel free
+# to use, modify and extend the software to your personal needs.
+
+# Imports
+from __future__ import absolute_import, print_function
+import atexit
+import sys
+import time
+import numpy
+from multiprocessing import shared_memory
+
+# The record is accessed in native byte order
+if sys.byteorder != "little":
+    raise ImportError("Powermeter_Telemetry requires a little endian platform")
+
+# Monotonic time base of all timestamps in [s], comparable between processes
+clock = time.monotonic
+
+# Layout of the shared record, see above
+TELEMETRY_DTYPE = numpy.dtype([("sequence",                "<u4"),
+                               ("battery_status",          "<i4"),
+                               ("timestamp",               "<f8"),
+                               ("oca",                     "<f8"),
+                               ("force_left",              "<f8"),
+                               ("force_right",             "<f8"),
+                               ("force_total",             "<f8"),
+                               ("torque_left",             "<f8"),
+                               ("torque_right",            "<f8"),
+                               ("torque_total",            "<f8"),
+                               ("power",                   "<f8"),
+                               ("crank_angle",             "<f8"),
+                               ("cadence",                 "<f8"),
+                               ("balance_left",            "<f8"),
+                               ("balance_right",           "<f8"),
+                               ("torque_efficiency_left",  "<f8"),
+                               ("torque_efficiency_right", "<f8"),
+                               ("pedal_smoothness_left",   "<f8"),
+                               ("pedal_smoothness_right",  "<f8"),
+                               ("rate_f2",                 "<f8"),
+                               ("rate_f3",                 "<f8"),
+                               ("rate_f4",                 "<f8"),
+                               ("jitter_f2",               "<f8"),
+                               ("gaps",                    "<i4"),
+                               ("interleave_errors",       "<i4"),
+                               ("lost_frames",             "<i4"),
+                               ("duplicate_frames",        "<i4"),
+                               ("cycle_time",              "<f8"),
+                               ("cycle_duration",          "<f8"),
+                               ("cycle_cadence",           "<f8"),
+                               ("cycle_work",              "<f8"),
+                               ("cycle_power",             "<f8"),
+                               ("cycle_power_left",        "<f8"),
+                               ("cycle_power_right",       "<f8"),
+                               ("cycle_torque_eff",        "<f8"),
+                               ("cycle_torque_eff_left",   "<f8"),
+                               ("cycle_torque_eff_right",  "<f8"),
+                               ("cycle_smoothness",        "<f8"),
+                               ("cycle_smoothness_left",   "<f8"),
+                               ("cycle_smoothness_right",  "<f8"),
+                               ("cycle_oca",               "<f8"),
+                               ("cycle_oca_left",          "<f8"),
+                               ("cycle_oca_right",         "<f8"),
+                               ("cycles",                  "<i4"),
+                               ("padding",                 "<i4"),
+                               ("predictor_time",          "<f8"),
+                               ("predictor_angle",         "<f8"),
+                               ("predictor_velocity",      "<f8"),
+                               ("predictor_p00",           "<f8"),
+                               ("predictor_p01",           "<f8"),
+                               ("predictor_p11",           "<f8"),
+                               ("predictor_noise",         "<f8"),
+                               ("interval_p50_f2",         "<f8"),
+                               ("interval_p95_f2",         "<f8"),
+                               ("interval_p50_f3",         "<f8"),
+                               ("interval_p95_f3",         "<f8"),
+                               ("interval_p50_f4",         "<f8"),
+                               ("interval_p95_f4",         "<f8"),
+                               ("jitter_f3",               "<f8"),
+                               ("jitter_f4",               "<f8"),
+                               ("gaps_f2",                 "<i4"),
+                               ("gaps_f3",                 "<i4"),
+                               ("gaps_f4",                 "<i4"),
+                               ("padding_2",               "<i4")])
+
+# Snapshot attempts before a reader gives up (a writer died while writing)
+READ_RETRIES = 100000
+
+
+class Powermeter_Telemetry(object):
+
+    # Creates a new record, or maps the existing record <name> created by another process
+    def __init__(self, name=None):
+
+        self.__owner = name is None
+
+        if self.__owner:
+            self.__shm = shared_memory.SharedMemory(create=True, size=TELEMETRY_DTYPE.itemsize)
+        else:
+            self.__shm = self.__attach(name)
+
+        self.__map()
+
+        if self.__owner:
+            self.__shm.buf[:TELEMETRY_DTYPE.itemsize] = bytes(TELEMETRY_DTYPE.itemsize)
+            self.write((("battery_status", -1),))
+            self.__words[0] = 0
+
+
+    # Maps an existing segment. Processes started by multiprocessing share the resource tracker of
+    # the creator, which removes the segment once; others must not track it (Python >= 3.13).
+    @staticmethod
+    def __attach(name):
+
+        if sys.version_info >= (3, 13):
+            return shared_memory.SharedMemory(name=name, track=False)
+        return shared_memory.SharedMemory(name=name)
+
+
+    # Typed views of the shared buffer. Plain memoryview item access is much faster than going
+    # through NumPy for single values; NumPy is only used to interpret snapshots.
+    def __map(self):
+
+        buf = self.__shm.buf
+        self.__words = buf.cast("I")
+        self.__ints = buf.cast("i")
+        self.__doubles = buf.cast("d")
+
+        self.__slots = {}
+        for name in TELEMETRY_DTYPE.names:
+            if name.startswith("padding"):
+                continue
+            dtype, offset = TELEMETRY_DTYPE.fields[name][:2]
+            view = self.__doubles if dtype.kind == "f" else self.__ints
+            self.__slots[name] = (view, offset // dtype.itemsize)
+
+        # The views have to be released before the segment can be closed
+        atexit.register(self.close)
+
+
+    # Processes started with 'spawn' map the record by its name
+    def __getstate__(self):
+        return {"name": self.__shm.name}
+
+    def __setstate__(self, state):
+        self.__owner = False
+        self.__shm = self.__attach(state["name"])
+        self.__map()
+
+
+    # Returns the name of the shared memory segment
+    def getName(self):
+        return self.__shm.name
+
+
+    # Writes the (field, value) pairs in one update. Lock-free, but there must be a single writer.
+    def write(self, values):
+
+        words = self.__words
+        slots = self.__slots
+
+        current = words[0]
+        words[0] = current + 1
+
+        for name, value in values:
+            view, index = slots[name]
+            view[index] = value
+        self.__doubles[1] = clock()
+
+        words[0] = (current + 2) & 0xFFFFFFFF
+
+
+    # Returns a single field without a snapshot, e.g. for the writer itself
+    def get(self, name):
+        view, index = self.__slots[name]
+        return view[index]
+
+
+    # Returns a consistent copy of the record (numpy.void, fields accessed by name)
+    def read(self):
+
+        words = self.__words
+        buf = self.__shm.buf
+
+        for i in range(READ_RETRIES):
+            before = words[0]
+
+            if before & 1:
+                time.sleep(0)
+                continue
+
+            data = bytes(buf[:TELEMETRY_DTYPE.itemsize])
+
+            if words[0] == before:
+                return numpy.frombuffer(data, dtype=TELEMETRY_DTYPE)[0]
+
+        raise RuntimeError("Telemetry record " + self.__shm.name + " is never consistent")
+
+
+    # Returns the number of updates written so far
+    def getUpdates(self):
+        return self.__words[0] >> 1
+
+
+    # Unmaps the record, the creator also removes the segment
+    def close(self):
+
+        if self.__shm is None:
+            return
+
+        atexit.unregister(self.close)
+        for view in (self.__words, self.__ints, self.__doubles):
+            view.release()
+        self.__slots = None
+
+        self.__shm.close()
+        if self.__owner:
+            self.__shm.unlink()
+        self.__shm = None
+
+
+
+# Writer process updating pairs of equal values at full speed
+def _writer(name, count):
+
+    telemetry = Powermeter_Telemetry(name)
+    for i in range(count):
+        telemetry.write((("torque_left", i), ("torque_right", i)))
+    telemetry.close()
+
+
+# Simple Testroutine measuring write and snapshot times and checking that no snapshot is torn
+# while another process writes.
+if __name__ == '__main__':
+
+    import timeit
+    from multiprocessing import Process
+
+    telemetry = Powermeter_Telemetry()
+
+    n = 100000
+    seconds = timeit.timeit(lambda: telemetry.write((("power", 250.0), ("cadence", 90.0))), number=n)
+    print("write (2 fields): %6.2f us" % (seconds / n * 1e6))
+
+    seconds = timeit.timeit(telemetry.read, number=n)
+    print("read snapshot:    %6.2f us" % (seconds / n * 1e6))
+
+    writer = Process(target=_writer, args=(telemetry.getName(), 200000))
+    writer.start()
+
+    snapshots = 0
+    torn = 0
+    while writer.is_alive():
+        record = telemetry.read()
+        snapshots = snapshots + 1
+        if record["torque_left"] != record["torque_right"]:
+            torn = torn + 1
+    writer.join()
+
+    print("snapshots during writes: %d, torn: %d, updates: %d" % (snapshots, torn, telemetry.getUpdates()))
+
+    telemetry.close()
@@ -0,0 +1,294 @@
+# Copyright (c) 2020, Martin Schmoll <martin.schmoll@meduniwien.ac.at>
+#
+# Timeline reconstruction of the ROTOR Fast Data pages from their frame counter (byte 1, "Time Tag").
+# The 8 bit counter advances by one with every page the powermeter sends. It is unwrapped into a
+# frame index, using the arrival time to tell a wrap after a long dropout from a duplicate, and the
+# frame index is the device time in units of the FastMode channel period. A small reordering buffer
+# holds frames for <depth> periods and then releases them in index order, one entry per period:
+# received frames with their samples, lost frames as explicit gaps. Consumers get an evenly spaced
+# series instead of an unknown mix of loss and delay. A dropout of more than <max_gap> frames (e.g.
+# the powermeter out of range) is released as one Resync entry carrying the number of frames lost,
+# so a push after a dropout of any length costs about as much as any other push.
+#
+# Device time in clock() seconds: offset + index * period, the offset following the lower envelope
+# of (arrival time - index * period), i.e. the least delayed frames.
+#
+# The software comes as it is, free of charge and is intended exclusively for non commercial use.
+# The author of this software does not take responsibilty for potential malfunctions. Feel free
+# to use, modify and extend the software to your personal needs.
+
+# Imports
+from __future__ import absolute_import, print_function
+import numpy
+
+# FastMode channel period: 655 of 32768 s, ~50 Hz
+FRAME_PERIOD = 655 / 32768.0
+
+# Periods a frame is held back for late frames to be sorted in (~60 ms)
+TIMELINE_DEPTH = 3
+
+# Weight with which the time offset follows increasing delays (clock drift)
+DRIFT_ALPHA = 0.001
+
+# Lost frames in a row (~1 s) above which they are released as one Resync entry instead of gaps
+TIMELINE_MAX_GAP = 50
+
+# Entry released for a lost frame
+GAP = None
+
+
+# Entry released for a dropout of <count> frames, in place of their gaps
+class Resync(object):
+
+    __slots__ = ("count",)
+
+    def __init__(self, count):
+        self.count = count
+
+
+class Powermeter_Timeline(object):
+
+    def __init__(self, period=FRAME_PERIOD, depth=TIMELINE_DEPTH, max_gap=TIMELINE_MAX_GAP):
+
+        self.__period = period
+        self.__depth = depth
+        self.__maxGap = max_gap
+
+        self.__last = None          # Highest frame index received
+        self.__lastTime = None      # Its arrival time
+        self.__next = None          # Next frame index to release
+        self.__index = None         # Frame index of the page pushed last, None if it was dropped
+        self.__pending = {}         # Frame index -> (arrival time, samples)
+        self.__seen = [None] * 256  # Frame index last received per counter value
+        self.__offset = None
+
+        self.__received = 0
+        self.__lost = 0
+        self.__duplicates = 0
+        self.__late = 0
+        self.__reordered = 0
+        self.__resyncs = 0
+
+
+    # Accounts the page with frame counter <frame>, arrival time <t> [s] and <samples> (any object,
+    # e.g. the (qid, raw) pairs). Returns the entries released by it as list of
+    # (frame index, arrival time, samples), samples GAP and arrival time NaN for lost frames and
+    # Resync for a dropout starting at frame index.
+    def push(self, frame, t, samples):
+
+        released = []
+
+        if self.__last is None:
+            index = frame
+            self.__next = index
+        else:
+            # Frames since the last one by the counter, corrected by whole wraps as seen by the clock
+            delta = (frame - self.__last) & 0xFF
+            elapsed = (t - self.__lastTime) / self.__period
+            index = self.__last + delta + 256 * int(round((elapsed - delta) / 256.0))
+
+        self.__index = None
+
+        if self.__seen[index & 0xFF] == index:
+            self.__duplicates += 1
+            return released
+
+        if self.__next is not None and index < self.__next:
+            self.__late += 1
+            return released
+
+        self.__index = index
+        self.__seen[index & 0xFF] = index
+        self.__pending[index] = (t, samples)
+        self.__received += 1
+
+        if self.__last is not None and index < self.__last:
+            self.__reordered += 1
+        else:
+            self.__last = index
+            self.__lastTime = t
+
+            # Lower envelope of the delay
+            offset = t - index * self.__period
+            if self.__offset is None or offset < self.__offset:
+                self.__offset = offset
+            else:
+                self.__offset += DRIFT_ALPHA * (offset - self.__offset)
+
+        # Release what is older than the buffer depth
+        while self.__last - self.__next >= self.__depth:
+            released.append(self.__release())
+
+        return released
+
+
+    # Releases the next frame index
+    def __release(self):
+
+        index = self.__next
+        self.__next = index + 1
+
+        entry = self.__pending.pop(index, None)
+        if entry is not None:
+            return index, entry[0], entry[1]
+
+        # Lost frames up to the next one received, skipped at once if too many
+        following = min(self.__pending) if self.__pending else self.__last + 1
+        count = following - index
+        if count > self.__maxGap:
+            self.__next = following
+            self.__lost += count
+            self.__resyncs += 1
+            return index, float("nan"), Resync(count)
+
+        self.__lost += 1
+        return index, float("nan"), GAP
+
+
+    # Releases all buffered entries, e.g. when the connection ends
+    def flush(self):
+
+        released = []
+        if self.__last is not None:
+            while self.__next <= self.__last:
+                released.append(self.__release())
+        return released
+
+
+    # Returns the frame index of the page pushed last, None if it was a duplicate or late
+    def getLastIndex(self):
+        return self.__index
+
+
+    # Returns (offset, period): the device time of frame index i is offset + i * period in clock() seconds
+    def getTimeBase(self):
+        return self.__offset, self.__period
+
+
+    # Returns the device time of frame index <index> in clock() seconds
+    def getDeviceTime(self, index):
+        return self.__offset + index * self.__period
+
+
+    # Returns the number of frames received (without duplicates and late frames)
+    def getReceived(self):
+        return self.__received
+
+    # Returns the number of frames released as gaps or within a Resync
+    def getLost(self):
+        return self.__lost
+
+    # Returns the number of Resync entries released
+    def getResyncs(self):
+        return self.__resyncs
+
+    # Returns the number of frames received more than once
+    def getDuplicates(self):
+        return self.__duplicates
+
+    # Returns the number of frames received after their index had been released
+    def getLate(self):
+        return self.__late
+
+    # Returns the number of frames received after a newer one, but in time
+    def getReordered(self):
+        return self.__reordered
+
+
+
+# Unwraps an array of frame counters of consecutive pages (e.g. from a capture) into frame indexes,
+# assuming in-order delivery and dropouts shorter than 256 frames. Returns (indexes, duplicate mask).
+def unwrapFrames(frames):
+
+    frames = numpy.asarray(frames, dtype=numpy.uint8)
+    if len(frames) == 0:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=bool)
+
+    deltas = numpy.diff(frames).astype(numpy.uint8).astype(numpy.int64)
+    indexes = numpy.empty(len(frames), dtype=numpy.int64)
+    indexes[0] = frames[0]
+    numpy.cumsum(deltas, out=indexes[1:])
+    indexes[1:] += frames[0]
+
+    duplicates = numpy.zeros(len(frames), dtype=bool)
+    duplicates[1:] = deltas == 0
+    return indexes, duplicates
+
+
+
+# Simple Testroutine: a 50 Hz page stream with host jitter, lost, duplicated and swapped frames and
+# a dropout longer than the counter range is reconstructed and checked, and a push after a dropout of
+# an hour is timed.
+if __name__ == '__main__':
+
+    import random
+    import timeit
+
+    rng = random.Random(2)
+    frames = 20000
+    sent = []
+    for i in range(frames):
+        if 5000 <= i < 5600:
+            continue                # Dropout of 12 s
+        if rng.random() < 0.01:
+            continue                # Lost
+        t = 100.0 + i * FRAME_PERIOD + 0.004 + abs(rng.gauss(0, 0.003))
+        sent.append((i, t))
+        if rng.random() < 0.005:
+            sent.append((i, t + 0.001))     # Duplicate
+
+    # Some frames are held up behind their successor (delayed in the USB stack)
+    for j in range(1, len(sent) - 1):
+        if rng.random() < 0.005 and sent[j][0] < sent[j + 1][0]:
+            sent[j], sent[j + 1] = sent[j + 1], (sent[j][0], sent[j + 1][1] + 0.0005)
+
+    timeline = Powermeter_Timeline()
+    released = []
+    for i, t in sent:
+        released.extend(timeline.push(i & 0xFF, t, i))
+    released.extend(timeline.flush())
+
+    # Contiguous indexes, the dropout as a single Resync
+    resyncs = [entry for entry in released if isinstance(entry[2], Resync)]
+    assert [(entry[0], entry[2].count) for entry in resyncs] == [(5000, 600)] and timeline.getResyncs() == 1
+    indexes = [entry[0] for entry in released]
+    assert indexes == list(range(indexes[0], 5001)) + list(range(5600, indexes[0] + len(indexes) + 599))
+    received = set(i for i, t in sent)
+    gaps = sum(entry[2] is GAP for entry in released)
+    samples = [entry for entry in released if entry[2] is not GAP and not isinstance(entry[2], Resync)]
+    assert all(entry[2] == entry[0] for entry in samples)
+    assert set(entry[0] for entry in samples) == received
+    assert timeline.getLost() == gaps + 600
+
+    offset, period = timeline.getTimeBase()
+    assert abs(offset - 100.004) < 0.002
+
+    # The vectorized unwrap agrees on in-order streams without long dropouts
+    ordered = sorted(set(i for i, t in sent if i < 5000))
+    indexes, duplicates = unwrapFrames([i & 0xFF for i in ordered])
+    assert list(indexes) == ordered and not duplicates.any()
+
+    print("%d entries, received %d, lost %d, resyncs %d, duplicates %d, late %d, reordered %d, offset %.4f s (true 100.004)" %
+          (len(released), timeline.getReceived(), timeline.getLost(), timeline.getResyncs(), timeline.getDuplicates(),
+           timeline.getLate(), timeline.getReordered(), offset))
+
+    # One hour without pages: the next page releases a few entries, not 180000 gaps
+    hour = 3600.0 / FRAME_PERIOD
+    t = sent[-1][1] + 3600.0
+    frame = (sent[-1][0] + int(round(hour))) & 0xFF
+    def dropout():
+        timeline = Powermeter_Timeline()
+        for i, u in sent[-10:]:
+            timeline.push(i & 0xFF, u, i)
+        return timeline.push(frame, t, None)
+    entries = dropout()
+    assert len(entries) <= TIMELINE_DEPTH + 1 and sum(isinstance(entry[2], Resync) for entry in entries) == 1
+    seconds = timeit.timeit(dropout, number=100) / 100
+    print("push after 1 h dropout: %d entries, %.1f us (incl. 10 pushes before)" % (len(entries), seconds * 1e6))
+
+    def run():
+        timeline = Powermeter_Timeline()
+        for i, t in sent:
+            timeline.push(i & 0xFF, t, i)
+    seconds = timeit.timeit(run, number=3) / 3
+    print("push: %.2f us/page" % (seconds / len(sent) * 1e6))
@@ -234,7 +234,8 @@ class Ant():
     # Ant functions
 
     def unassign_channel(self, channel):
-        pass
+        message = Message(Message.ID.UNASSIGN_CHANNEL, [channel])
+        self.write_message(message)
 
     def assign_channel(self, channel, channelType, networkNumber):
         message = Message(Message.ID.ASSIGN_CHANNEL, [channel, channelType, networkNumber])
@@ -244,6 +245,10 @@ class Ant():
         message = Message(Message.ID.OPEN_CHANNEL, [channel])
         self.write_message(message)
 
+    def close_channel(self, channel):
+        message = Message(Message.ID.CLOSE_CHANNEL, [channel])
+        self.write_message(message)
+
     def set_channel_id(self, channel, deviceNum, deviceType, transmissionType):
         data = array.array('B', struct.pack("<BHBB", channel, deviceNum, deviceType, transmissionType))
         message = Message(Message.ID.SET_CHANNEL_ID, data)
@@ -22,4 +22,4 @@
 
 from __future__ import absolute_import, print_function
 
-__all__ = ['node', 'channel']
\ No newline at end of file
+__all__ = ['node', 'channel', 'allocator', 'bus', 'events', 'pipeline']
\ No newline at end of file
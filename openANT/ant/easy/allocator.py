@@ -0,0 +1,193 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function, division
+
+import logging
+import math
+import threading
+
+from openANT.ant.base.message import Message
+from openANT.ant.easy.channel import Channel
+from openANT.ant.easy.exception import AntException
+
+_logger = logging.getLogger("ant.easy.allocator")
+
+
+class Capabilities(object):
+    """
+    Parsed RESPONSE_CAPABILITIES (0x54) message. Older sticks only send the
+    first four bytes, the remaining options default to zero then.
+    """
+
+    DEFAULT_MAX_CHANNELS = 8
+    DEFAULT_MAX_NETWORKS = 3
+
+    def __init__(self, max_channels, max_networks, standard_options=0,
+                 advanced_options=0, advanced_options_2=0,
+                 max_sensrcore_channels=0, advanced_options_3=0,
+                 advanced_options_4=0):
+        self._max_channels = max_channels
+        self._max_networks = max_networks
+        self._standard_options = standard_options
+        self._advanced_options = advanced_options
+        self._advanced_options_2 = advanced_options_2
+        self._max_sensrcore_channels = max_sensrcore_channels
+        self._advanced_options_3 = advanced_options_3
+        self._advanced_options_4 = advanced_options_4
+
+    def get_max_channels(self):
+        return self._max_channels
+
+    def get_max_networks(self):
+        return self._max_networks
+
+    def get_standard_options(self):
+        return self._standard_options
+
+    def get_advanced_options(self):
+        return (self._advanced_options, self._advanced_options_2,
+                self._advanced_options_3, self._advanced_options_4)
+
+    def get_max_sensrcore_channels(self):
+        return self._max_sensrcore_channels
+
+    def __repr__(self):
+        return str.format("<Capabilities channels={0} networks={1}>",
+                          self._max_channels, self._max_networks)
+
+    @staticmethod
+    def default():
+        return Capabilities(Capabilities.DEFAULT_MAX_CHANNELS,
+                            Capabilities.DEFAULT_MAX_NETWORKS)
+
+    @staticmethod
+    def parse(data):
+        values = list(data[:8]) + [0] * (8 - min(len(data), 8))
+        return Capabilities(*values)
+
+
+class ChannelAllocator(object):
+    """
+    Hands out channel numbers of a node. The capabilities of the stick are
+    requested once, on first use, and cached.
+
+    The allocator also keeps the open channels within an airtime budget,
+    given as the number of messages per second the stick should handle in
+    total (a channel with period P receives 32768 / P messages per second).
+    """
+
+    # Conservative aggregate message rate for the supported USB sticks
+    DEFAULT_MESSAGE_RATE_BUDGET = 200.0
+
+    # Channel types on which the stick is the master and sets the period
+    MASTER_TYPES = (Channel.Type.BIDIRECTIONAL_TRANSMIT,
+                    Channel.Type.SHARED_BIDIRECTIONAL_TRANSMIT,
+                    Channel.Type.UNIDIRECTIONAL_TRANSMIT_ONLY)
+
+    def __init__(self, node, message_rate_budget=DEFAULT_MESSAGE_RATE_BUDGET):
+        self._node = node
+        self._lock = threading.Lock()
+        self._capabilities = None
+        self._used = set()
+        self.message_rate_budget = message_rate_budget
+
+    def get_capabilities(self):
+        with self._lock:
+            if self._capabilities is None:
+                try:
+                    _, _, data = self._node.request_message(Message.ID.RESPONSE_CAPABILITIES)
+                    self._capabilities = Capabilities.parse(data)
+                except AntException as e:
+                    _logger.warning("Could not read capabilities (%s), assuming %d channels",
+                                    e, Capabilities.DEFAULT_MAX_CHANNELS)
+                    self._capabilities = Capabilities.default()
+                _logger.debug("Capabilities %r", self._capabilities)
+            return self._capabilities
+
+    def get_free(self):
+        max_channels = self.get_capabilities().get_max_channels()
+        with self._lock:
+            return [number for number in range(max_channels) if number not in self._used]
+
+    def allocate(self):
+        max_channels = self.get_capabilities().get_max_channels()
+        with self._lock:
+            for number in range(max_channels):
+                if number not in self._used:
+                    self._used.add(number)
+                    return number
+        raise AntException("No free channel, all %d channels are in use" % max_channels)
+
+    def release(self, number):
+        with self._lock:
+            self._used.discard(number)
+
+    def get_message_rate(self):
+        """
+        Messages per second currently requested by the open channels.
+        """
+        return sum(32768 / channel.get_requested_period()
+                   for channel in self._open_channels())
+
+    def rebalance(self, pinned=()):
+        """
+        Fit the open channels into the message rate budget. Channels with an
+        id in *pinned* keep their requested period, the remaining budget is
+        shared by the other channels proportionally to their requested rate.
+        The period of a receive channel has to match the master it tracks,
+        so it is only ever stretched to an integer multiple of the requested
+        period (listening to every n-th message). Returns a dict with the
+        period applied to each open channel.
+        """
+        channels = self._open_channels()
+        pinned_rate = sum(32768 / channel.get_requested_period()
+                          for channel in channels if channel.id in pinned)
+        free_rate = sum(32768 / channel.get_requested_period()
+                        for channel in channels if channel.id not in pinned)
+
+        available = self.message_rate_budget - pinned_rate
+        if free_rate <= available:
+            scale = 1.0
+        elif available > 0:
+            scale = free_rate / available
+        else:
+            raise AntException("Pinned channels alone exceed the message rate budget")
+
+        periods = {}
+        for channel in channels:
+            period = channel.get_requested_period()
+            if channel.id not in pinned:
+                if channel.get_type() in self.MASTER_TYPES:
+                    period = min(0xffff, int(round(period * scale)))
+                else:
+                    period *= max(1, min(int(math.ceil(scale - 1e-9)), 0xffff // period))
+            if period != channel.get_period():
+                _logger.debug("rebalance channel %d, period %d -> %d",
+                              channel.id, channel.get_period(), period)
+                channel._set_period(period)
+            periods[channel.id] = period
+        return periods
+
+    def _open_channels(self):
+        return [channel for channel in list(self._node.channels.values())
+                if channel.is_open()]
@@ -0,0 +1,148 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+import itertools
+import logging
+import operator
+import threading
+
+_logger = logging.getLogger("ant.easy.bus")
+
+
+class Subscription(object):
+    """
+    A consumer registered on a :class:`PageBus`.
+
+    *pages* is a page number or an iterable of page numbers (the first byte
+    of the data), None subscribes to every page. *match* maps further byte
+    positions to a value or an iterable of accepted values, e.g.
+    ``{2: 0x03}``. *where* is an optional predicate called with the data
+    for pages that passed the other filters.
+    """
+
+    def __init__(self, callback, pages=None, match=None, where=None):
+        self.callback = callback
+        self.pages = _values(pages) if pages is not None else tuple(range(256))
+        self.match = dict((position, _values(value))
+                          for position, value in (match or {}).items())
+        self.where = where
+
+    def __repr__(self):
+        return str.format("<Subscription {0!r} pages={1} match={2}>",
+                          self.callback, len(self.pages), self.match)
+
+
+class _Keyed(object):
+    """
+    Dispatches to the subscriptions of one page that match on the same
+    byte positions, using a single dict lookup.
+    """
+
+    __slots__ = ("_key", "_callbacks")
+
+    def __init__(self, positions):
+        self._key = operator.itemgetter(*positions)
+        self._callbacks = {}
+
+    def add(self, key, callback):
+        self._callbacks[key] = self._callbacks.get(key, ()) + (callback,)
+
+    def __call__(self, data, *args):
+        for callback in self._callbacks.get(self._key(data), ()):
+            callback(data, *args)
+
+
+def _values(value):
+    if isinstance(value, int):
+        return (value,)
+    return tuple(value)
+
+
+def _guard(where, callback):
+    def guarded(data, *args):
+        if where(data):
+            callback(data, *args)
+    return guarded
+
+
+class PageBus(object):
+    """
+    Publish/subscribe dispatch of data pages.
+
+    Subscriptions are compiled into a table indexed by page number, so
+    publishing a page only calls the consumers that asked for it. The
+    table is rebuilt on (un)subscribe and swapped atomically, publishing
+    takes no lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []
+        self._table = [()] * 256
+
+    def subscribe(self, callback, pages=None, match=None, where=None):
+        subscription = Subscription(callback, pages, match, where)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            self._compile()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.remove(subscription)
+            self._compile()
+
+    def publish(self, data, *args):
+        for handler in self._table[data[0]]:
+            handler(data, *args)
+
+    def _compile(self):
+        table = [[] for _ in range(256)]
+        keyed = {}
+
+        for subscription in self._subscriptions:
+            callback = subscription.callback
+            if subscription.where is not None:
+                callback = _guard(subscription.where, callback)
+
+            if not subscription.match:
+                for page in subscription.pages:
+                    table[page].append(callback)
+                continue
+
+            positions = tuple(sorted(subscription.match))
+            keys = list(itertools.product(*[subscription.match[p] for p in positions]))
+            if len(positions) == 1:
+                keys = [key[0] for key in keys]
+
+            for page in subscription.pages:
+                handler = keyed.get((page, positions))
+                if handler is None:
+                    handler = keyed[(page, positions)] = _Keyed(positions)
+                    table[page].append(handler)
+                for key in keys:
+                    handler.add(key, callback)
+
+        self._table = [tuple(handlers) for handlers in table]
+        _logger.debug("compiled %d subscriptions", len(self._subscriptions))
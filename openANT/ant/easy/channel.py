@@ -25,8 +25,9 @@ from __future__ import absolute_import, print_function
 import logging
 
 from openANT.ant.base.message import Message
+from openANT.ant.easy.bus import PageBus
 from openANT.ant.easy.exception import TransferFailedException
-from openANT.ant.easy.filter import wait_for_event, wait_for_response, wait_for_special
+from openANT.ant.easy.filter import wait_for_response, wait_for_special
 
 _logger = logging.getLogger("ant.easy.channel")
 
@@ -42,38 +43,91 @@ class Channel():
         UNIDIRECTIONAL_RECEIVE_ONLY = 0x40
         UNIDIRECTIONAL_TRANSMIT_ONLY = 0x50
 
+    # Channel period after assignment, 8192 of 32768 -> 4 Hz
+    DEFAULT_PERIOD = 8192
+
     def __init__(self, id, node, ant):
         self.id = id
         self._node = node
         self._ant = ant
 
+        self._open = False
+        self._type = None
+        self._period = self.DEFAULT_PERIOD
+        self._requested_period = self.DEFAULT_PERIOD
+
+        # Data is dispatched to subscribers unless the handlers are replaced
+        self._bus = PageBus()
+        self.on_broadcast_data = self._bus.publish
+        self.on_burst_data = self._bus.publish
+
+    def subscribe(self, callback, pages=None, match=None, where=None):
+        """
+        Call *callback* with the data of each received page that matches,
+        see :class:`Subscription`. Returns the subscription.
+        """
+        return self._bus.subscribe(callback, pages, match, where)
+
+    def unsubscribe(self, subscription):
+        self._bus.unsubscribe(subscription)
+
     def wait_for_event(self, ok_codes):
-        return wait_for_event(ok_codes, self._node._events, self._node._event_cond)
+        return self._node._events.wait_for_event(ok_codes, self.id)
 
     def wait_for_response(self, event_id):
-        return wait_for_response(event_id, self._node._responses, self._node._responses_cond)
+        return wait_for_response(event_id, self._node._responses, self._node._responses_cond, self.id)
 
     def wait_for_special(self, event_id):
-        return wait_for_special(event_id, self._node._responses, self._node._responses_cond)
+        return wait_for_special(event_id, self._node._responses, self._node._responses_cond, self.id)
 
     def _assign(self, channelType, networkNumber):
         self._ant.assign_channel(self.id, channelType, networkNumber)
-        return self.wait_for_response(Message.ID.ASSIGN_CHANNEL)
+        result = self.wait_for_response(Message.ID.ASSIGN_CHANNEL)
+        self._type = channelType
+        return result
+
+    def get_type(self):
+        return self._type
 
     def _unassign(self):
-        pass
+        self._ant.unassign_channel(self.id)
+        return self.wait_for_response(Message.ID.UNASSIGN_CHANNEL)
 
     def open(self):
         self._ant.open_channel(self.id)
-        return self.wait_for_response(Message.ID.OPEN_CHANNEL)
+        result = self.wait_for_response(Message.ID.OPEN_CHANNEL)
+        self._open = True
+        return result
+
+    def close(self):
+        self._ant.close_channel(self.id)
+        result = self.wait_for_response(Message.ID.CLOSE_CHANNEL)
+        self.wait_for_event([Message.Code.EVENT_CHANNEL_CLOSED])
+        self._open = False
+        return result
+
+    def is_open(self):
+        return self._open
 
     def set_id(self, deviceNum, deviceType, transmissionType):
         self._ant.set_channel_id(self.id, deviceNum, deviceType, transmissionType)
         return self.wait_for_response(Message.ID.SET_CHANNEL_ID)
 
     def set_period(self, messagePeriod):
+        self._requested_period = messagePeriod
+        return self._set_period(messagePeriod)
+
+    def _set_period(self, messagePeriod):
         self._ant.set_channel_period(self.id, messagePeriod)
-        return self.wait_for_response(Message.ID.SET_CHANNEL_PERIOD)
+        result = self.wait_for_response(Message.ID.SET_CHANNEL_PERIOD)
+        self._period = messagePeriod
+        return result
+
+    def get_period(self):
+        return self._period
+
+    def get_requested_period(self):
+        return self._requested_period
 
     def set_search_timeout(self, timeout):
         self._ant.set_channel_search_timeout(self.id, timeout)
@@ -93,15 +147,19 @@ class Channel():
         _logger.debug("done requesting message %#02x", messageId)
         return self.wait_for_special(messageId)
 
-    def send_acknowledged_data(self, data):
-        try:
-            _logger.debug("send acknowledged data %s", self.id)
-            self._ant.send_acknowledged_data(self.id, data)
-            self.wait_for_event([Message.Code.EVENT_TRANSFER_TX_COMPLETED])
-            _logger.debug("done sending acknowledged data %s", self.id)
-        except TransferFailedException:
-            _logger.warning("failed to send acknowledged data %s, retrying", self.id)
-            self.send_acknowledged_data(data)
+    def send_acknowledged_data_async(self, data, max_retries=None):
+        """
+        Queue acknowledged data on this channel and return a future, see
+        :meth:`SendPipeline.submit`. Only one message per channel is in
+        flight at a time, other channels are not blocked.
+        """
+        return self._node.send_pipeline.submit(self.id, data, max_retries)
+
+    def send_acknowledged_data(self, data, max_retries=None):
+        transfer = self.send_acknowledged_data_async(data, max_retries).result()
+        _logger.debug("done sending acknowledged data %s (%d attempts)",
+                      self.id, transfer.attempts)
+        return transfer
 
     def send_burst_transfer_packet(self, channelSeq, data, first):
         _logger.debug("send burst transfer packet %s", data)
@@ -0,0 +1,157 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function, division
+
+import collections
+import logging
+import threading
+import time
+
+from openANT.ant.base.message import Message
+from openANT.ant.easy.exception import AntException, TransferFailedException
+
+_logger = logging.getLogger("ant.easy.events")
+
+
+class EventStore(object):
+    """
+    Channel events waiting to be picked up by :meth:`wait_for_event`,
+    indexed by event code and channel.
+
+    Every (code, channel) pair keeps at most *max_per_key* events and events
+    older than *ttl* seconds are discarded, so memory use and lookup cost do
+    not depend on how long the node has been running. Discarded events are
+    counted, see :meth:`get_statistics`.
+    """
+
+    # Codes that make a waiting transfer fail, see filter.wait_for_message
+    FAILURE_CODES = (Message.Code.EVENT_TRANSFER_TX_FAILED,
+                     Message.Code.EVENT_RX_FAIL_GO_TO_SEARCH)
+
+    def __init__(self, max_per_key=32, ttl=30.0):
+        self.max_per_key = max_per_key
+        self.ttl = ttl
+
+        self._cond = threading.Condition()
+        self._index = {}
+        self._sequence = 0
+        self._next_sweep = time.time() + ttl
+
+        self._statistics = collections.Counter()
+
+    @staticmethod
+    def get_code(event, data):
+        # RF events (0x01) carry the event code in the first data byte
+        if event == 1:
+            return data[0]
+        return event
+
+    def put(self, channel, event, data):
+        code = self.get_code(event, data)
+        now = time.time()
+
+        with self._cond:
+            entries = self._index.setdefault(code, {}).get(channel)
+            if entries is None:
+                entries = self._index[code][channel] = collections.deque()
+
+            self._expire(entries, now)
+            if len(entries) >= self.max_per_key:
+                entries.popleft()
+                self._statistics["evicted_size"] += 1
+
+            self._sequence += 1
+            entries.append((self._sequence, now, (channel, event, data)))
+            self._statistics["stored"] += 1
+
+            if now >= self._next_sweep:
+                self._sweep(now)
+
+            self._cond.notify_all()
+
+    def wait_for_event(self, ok_codes, channel=None, timeout=10.0):
+        """
+        Wait for the oldest event with a code in *ok_codes* (on *channel*, or
+        on any channel if None) and remove it from the store. Raises
+        TransferFailedException if a failure event is older than any
+        matching event and AntException on timeout.
+        """
+        deadline = time.time() + timeout
+        codes = tuple(ok_codes) + tuple(c for c in self.FAILURE_CODES if c not in ok_codes)
+
+        with self._cond:
+            while True:
+                now = time.time()
+                oldest = None
+                for code in codes:
+                    for entries in self._candidates(code, channel):
+                        self._expire(entries, now)
+                        if entries and (oldest is None or entries[0][0] < oldest[0][0]):
+                            oldest = entries
+
+                if oldest is not None:
+                    _, _, params = oldest.popleft()
+                    if self.get_code(params[1], params[2]) in ok_codes:
+                        self._statistics["matched"] += 1
+                        return params
+                    self._statistics["failed"] += 1
+                    _logger.warning("Transfer send failed: %r", params)
+                    raise TransferFailedException()
+
+                if now >= deadline:
+                    raise AntException("Timed out while waiting for message")
+                self._cond.wait(deadline - now)
+
+    def get_statistics(self):
+        """
+        Counters of stored, matched, failed and discarded (evicted_size,
+        evicted_ttl) events.
+        """
+        with self._cond:
+            return dict(self._statistics)
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(entries) for channels in self._index.values()
+                       for entries in channels.values())
+
+    def _candidates(self, code, channel):
+        channels = self._index.get(code)
+        if not channels:
+            return ()
+        if channel is None:
+            return list(channels.values())
+        entries = channels.get(channel)
+        return (entries,) if entries is not None else ()
+
+    def _expire(self, entries, now):
+        limit = now - self.ttl
+        while entries and entries[0][1] < limit:
+            entries.popleft()
+            self._statistics["evicted_ttl"] += 1
+
+    def _sweep(self, now):
+        for channels in self._index.values():
+            for entries in channels.values():
+                self._expire(entries, now)
+        self._next_sweep = now + self.ttl
@@ -72,15 +72,17 @@ def wait_for_event(ok_codes, queue, condition):
     return wait_for_message(match, process, queue, condition)
 
 
-def wait_for_response(event_id, queue, condition):
+def wait_for_response(event_id, queue, condition, channel_id=None):
     """
     Waits for a response to a specific message sent by the channel response
-    message, 0x40. It's expected to return RESPONSE_NO_ERROR, 0x00.
+    message, 0x40. It's expected to return RESPONSE_NO_ERROR, 0x00. With
+    *channel_id* only responses on that channel match, so that channels
+    configured from different threads do not take each other's responses.
     """
 
     def match(params):
         channel, event, data = params
-        return event == event_id
+        return event == event_id and (channel_id is None or channel == channel_id)
 
     def process(params):
         channel, event, data = params
@@ -93,7 +95,7 @@ def wait_for_response(event_id, queue, condition):
     return wait_for_message(match, process, queue, condition)
 
 
-def wait_for_special(event_id, queue, condition):
+def wait_for_special(event_id, queue, condition, channel_id=None):
     """
     Waits for special responses to messages such as Channel ID, ANT
     Version, etc. This does not throw any exceptions, besides timeouts.
@@ -101,7 +103,7 @@ def wait_for_special(event_id, queue, condition):
 
     def match(params):
         channel, event, data = params
-        return event == event_id
+        return event == event_id and (channel_id is None or channel == channel_id)
 
     def process(params):
         return params
@@ -35,8 +35,12 @@ except ImportError:
 
 from openANT.ant.base.ant import Ant
 from openANT.ant.base.message import Message
+from openANT.ant.easy.allocator import ChannelAllocator
+from openANT.ant.easy.bus import PageBus
 from openANT.ant.easy.channel import Channel
-from openANT.ant.easy.filter import wait_for_event, wait_for_response, wait_for_special
+from openANT.ant.easy.events import EventStore
+from openANT.ant.easy.filter import wait_for_response, wait_for_special
+from openANT.ant.easy.pipeline import SendPipeline
 
 _logger = logging.getLogger("ant.easy.node")
 
@@ -46,27 +50,59 @@ class Node():
 
         self._responses_cond = threading.Condition()
         self._responses = collections.deque()
-        self._event_cond = threading.Condition()
-        self._events = collections.deque()
+        self._events = EventStore()
 
         self._datas = queue.Queue()
 
         self.channels = {}
+        self._bus = PageBus()
 
         self.ant = Ant()
 
+        self.send_pipeline = SendPipeline(self.ant)
+        self.allocator = ChannelAllocator(self)
+
         self._running = True
 
         self._worker_thread = threading.Thread(target=self._worker, name="ant.easy")
         self._worker_thread.start()
 
     def new_channel(self, ctype, network_number=0x00):
-        size = len(self.channels)
-        channel = Channel(size, self, self.ant)
-        self.channels[size] = channel
-        channel._assign(ctype, network_number)
+        number = self.allocator.allocate()
+        channel = Channel(number, self, self.ant)
+        self.channels[number] = channel
+        try:
+            channel._assign(ctype, network_number)
+        except Exception:
+            del self.channels[number]
+            self.allocator.release(number)
+            raise
         return channel
 
+    def release_channel(self, channel):
+        """
+        Close (if open) and unassign *channel* so that its number can be
+        handed out again by :meth:`new_channel`.
+        """
+        if channel.is_open():
+            channel.close()
+        channel._unassign()
+        del self.channels[channel.id]
+        self.allocator.release(channel.id)
+
+    def subscribe(self, callback, pages=None, match=None, where=None):
+        """
+        Like :meth:`Channel.subscribe` but for pages received on any
+        channel, *callback* is called with the data and the channel number.
+        """
+        return self._bus.subscribe(callback, pages, match, where)
+
+    def unsubscribe(self, subscription):
+        self._bus.unsubscribe(subscription)
+
+    def get_capabilities(self):
+        return self.allocator.get_capabilities()
+
     def request_message(self, messageId):
         _logger.debug("requesting message %#02x", messageId)
         self.ant.request_message(0, messageId)
@@ -79,7 +115,10 @@ class Node():
 
 
     def wait_for_event(self, ok_codes):
-        return wait_for_event(ok_codes, self._events, self._event_cond)
+        return self._events.wait_for_event(ok_codes)
+
+    def get_event_statistics(self):
+        return self._events.get_statistics()
 
     def wait_for_response(self, event_id):
         return wait_for_response(event_id, self._responses, self._responses_cond)
@@ -98,17 +137,16 @@ class Node():
             self._datas.put(('burst', channel, data))
         elif event == Message.Code.EVENT_RX_BROADCAST:
             self._datas.put(('broadcast', channel, data))
+        elif event == 1 and self.send_pipeline.on_event(channel, data[0]):
+            # Completion of an acknowledged message tracked by the pipeline
+            pass
         else:
-            self._event_cond.acquire()
-            self._events.append((channel, event, data))
-            self._event_cond.notify()
-            self._event_cond.release()
+            self._events.put(channel, event, data)
 
     def _worker(self):
         self.ant.response_function = self._worker_response
         self.ant.channel_event_function = self._worker_event
 
-        # TODO: check capabilities
         self.ant.start()
 
     def _main(self):
@@ -123,6 +161,9 @@ class Node():
                     self.channels[channel].on_burst_data(data)
                 else:
                     _logger.warning("Unknown data type '%s': %r", data_type, data)
+                    continue
+
+                self._bus.publish(data, channel)
             except: # Changed by Morten, was: except queue.Empty as e:
                 pass
 
@@ -133,6 +174,7 @@ class Node():
         if self._running:
             _logger.debug("Stoping ant.easy")
             self._running = False
+            self.send_pipeline.stop()
             self.ant.stop()
             self._worker_thread.join()
 
@@ -0,0 +1,297 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function, division
+
+import collections
+import logging
+import threading
+import time
+
+from concurrent.futures import Future
+
+from openANT.ant.base.message import Message
+from openANT.ant.easy.exception import AntException, TransferFailedException
+
+_logger = logging.getLogger("ant.easy.pipeline")
+
+
+class SendStatistics(object):
+    """
+    Round-trip and retry counters for the acknowledged messages sent on
+    one channel. Round-trip times are measured from the first attempt to
+    the EVENT_TRANSFER_TX_COMPLETED of the attempt that got through.
+    """
+
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.attempts = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.round_trip_min = None
+        self.round_trip_max = None
+        self.round_trip_last = None
+        self._round_trip_sum = 0.0
+
+    def get_round_trip_mean(self):
+        if self.completed == 0:
+            return None
+        return self._round_trip_sum / self.completed
+
+    def _add_round_trip(self, round_trip):
+        self._round_trip_sum += round_trip
+        self.round_trip_last = round_trip
+        if self.round_trip_min is None or round_trip < self.round_trip_min:
+            self.round_trip_min = round_trip
+        if self.round_trip_max is None or round_trip > self.round_trip_max:
+            self.round_trip_max = round_trip
+
+    def __repr__(self):
+        mean = self.get_round_trip_mean()
+        return str.format(
+            "<SendStatistics submitted={0} completed={1} failed={2} "
+            "retries={3} timeouts={4} rtt(mean)={5}>",
+            self.submitted, self.completed, self.failed, self.retries,
+            self.timeouts, "-" if mean is None else "%.3fs" % mean)
+
+
+class AcknowledgedTransfer(object):
+    """
+    One acknowledged message tracked by the pipeline. This is also the
+    result of the future returned by :meth:`SendPipeline.submit`.
+    """
+
+    def __init__(self, channel, data, max_retries):
+        self.channel = channel
+        self.data = data
+        self.max_retries = max_retries
+        self.attempts = 0
+        self.round_trip = None
+        self.future = Future()
+
+        self._first_sent = None
+        self._deadline = None
+        self._retry_at = None
+
+    def get_retries(self):
+        return max(0, self.attempts - 1)
+
+
+class SendPipeline(object):
+    """
+    Sends acknowledged data with at most one message in flight per channel.
+
+    Messages for different channels overlap freely, messages for the same
+    channel are queued and sent in order. An attempt fails on
+    EVENT_TRANSFER_TX_FAILED or when no answer arrives within *timeout*
+    seconds, and is retried up to *max_retries* times with an exponential
+    backoff starting at *backoff* seconds.
+    """
+
+    def __init__(self, ant, max_retries=5, timeout=2.0, backoff=0.05,
+                 backoff_factor=2.0, max_backoff=1.0):
+        self._ant = ant
+
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._pending = collections.defaultdict(collections.deque)
+        self._in_flight = {}
+        self._statistics = collections.defaultdict(SendStatistics)
+
+        self._running = True
+        self._worker_thread = None
+
+    def configure(self, **kwargs):
+        for key, value in kwargs.items():
+            if key not in ("max_retries", "timeout", "backoff",
+                           "backoff_factor", "max_backoff"):
+                raise TypeError("Unknown pipeline option '%s'" % key)
+            setattr(self, key, value)
+
+    def submit(self, channel, data, max_retries=None):
+        """
+        Queue *data* for acknowledged transmission on *channel* and return a
+        future. The future resolves to the :class:`AcknowledgedTransfer`
+        once the message is acknowledged, or raises
+        TransferFailedException when all attempts failed.
+        """
+        assert len(data) == 8
+        transfer = AcknowledgedTransfer(
+            channel, data, self.max_retries if max_retries is None else max_retries)
+
+        with self._cond:
+            if not self._running:
+                raise AntException("Send pipeline is stopped")
+            self._start_worker()
+            self._statistics[channel].submitted += 1
+            if channel in self._in_flight:
+                self._pending[channel].append(transfer)
+            else:
+                self._in_flight[channel] = transfer
+                self._transmit(transfer)
+            self._cond.notify()
+
+        return transfer.future
+
+    def on_event(self, channel, code):
+        """
+        Feed a channel event to the pipeline. Returns True if the event
+        belonged to an in-flight message and has been consumed.
+        """
+        if code not in (Message.Code.EVENT_TRANSFER_TX_COMPLETED,
+                        Message.Code.EVENT_TRANSFER_TX_FAILED):
+            return False
+
+        resolved = []
+        with self._cond:
+            transfer = self._in_flight.get(channel)
+            if transfer is None:
+                return False
+
+            if code == Message.Code.EVENT_TRANSFER_TX_COMPLETED:
+                transfer.round_trip = time.time() - transfer._first_sent
+                statistics = self._statistics[channel]
+                statistics.completed += 1
+                statistics._add_round_trip(transfer.round_trip)
+                resolved.append((transfer, None))
+                self._next(channel)
+            else:
+                _logger.warning("failed to send acknowledged data %s (attempt %d)",
+                                channel, transfer.attempts)
+                self._fail_attempt(transfer, resolved)
+            self._cond.notify()
+
+        self._resolve(resolved)
+        return True
+
+    def get_statistics(self, channel=None):
+        """
+        Statistics for *channel*, or a dict of statistics per channel.
+        """
+        with self._cond:
+            if channel is not None:
+                return self._statistics[channel]
+            return dict(self._statistics)
+
+    def stop(self):
+        resolved = []
+        with self._cond:
+            self._running = False
+            transfers = list(self._in_flight.values())
+            for queued in self._pending.values():
+                transfers.extend(queued)
+            self._in_flight.clear()
+            self._pending.clear()
+            for transfer in transfers:
+                resolved.append((transfer, AntException("Send pipeline stopped")))
+            self._cond.notify()
+        self._resolve(resolved)
+
+        if self._worker_thread is not None and \
+                self._worker_thread is not threading.current_thread():
+            self._worker_thread.join()
+
+    def _start_worker(self):
+        if self._worker_thread is None:
+            self._worker_thread = threading.Thread(target=self._worker,
+                                                   name="ant.easy.pipeline")
+            self._worker_thread.daemon = True
+            self._worker_thread.start()
+
+    def _transmit(self, transfer):
+        now = time.time()
+        if transfer._first_sent is None:
+            transfer._first_sent = now
+        transfer.attempts += 1
+        transfer._deadline = now + self.timeout
+        transfer._retry_at = None
+        self._statistics[transfer.channel].attempts += 1
+        _logger.debug("send acknowledged data %s (attempt %d)",
+                      transfer.channel, transfer.attempts)
+        self._ant.send_acknowledged_data(transfer.channel, transfer.data)
+
+    def _fail_attempt(self, transfer, resolved):
+        statistics = self._statistics[transfer.channel]
+        if transfer.attempts > transfer.max_retries:
+            statistics.failed += 1
+            resolved.append((transfer, TransferFailedException(
+                "Acknowledged data on channel %d failed after %d attempts"
+                % (transfer.channel, transfer.attempts))))
+            self._next(transfer.channel)
+        else:
+            statistics.retries += 1
+            delay = min(self.max_backoff,
+                        self.backoff * self.backoff_factor ** (transfer.attempts - 1))
+            transfer._deadline = None
+            transfer._retry_at = time.time() + delay
+
+    def _next(self, channel):
+        pending = self._pending.get(channel)
+        if pending:
+            transfer = pending.popleft()
+            self._in_flight[channel] = transfer
+            self._transmit(transfer)
+        else:
+            self._in_flight.pop(channel, None)
+
+    def _resolve(self, resolved):
+        for transfer, exception in resolved:
+            if exception is None:
+                transfer.future.set_result(transfer)
+            else:
+                transfer.future.set_exception(exception)
+
+    def _worker(self):
+        while True:
+            resolved = []
+            with self._cond:
+                if not self._running:
+                    break
+
+                now = time.time()
+                wake = None
+                for transfer in list(self._in_flight.values()):
+                    if transfer._retry_at is not None and now >= transfer._retry_at:
+                        self._transmit(transfer)
+                    elif transfer._deadline is not None and now >= transfer._deadline:
+                        _logger.warning("acknowledged data %s timed out (attempt %d)",
+                                        transfer.channel, transfer.attempts)
+                        self._statistics[transfer.channel].timeouts += 1
+                        self._fail_attempt(transfer, resolved)
+
+                for transfer in self._in_flight.values():
+                    due = transfer._retry_at if transfer._retry_at is not None \
+                        else transfer._deadline
+                    if due is not None and (wake is None or due < wake):
+                        wake = due
+
+                if not resolved:
+                    self._cond.wait(None if wake is None else max(0.0, wake - now))
+
+            self._resolve(resolved)
@@ -0,0 +1,164 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+import array
+import json
+import logging
+import os
+import time
+
+from ant.fs.commons import replace_file
+
+_logger = logging.getLogger("ant.fs.cache")
+
+
+class CachedDownload(object):
+    """
+    A (partially) downloaded file on disk. The data file holds the blocks
+    received so far, a small JSON file next to it the offset and the CRC
+    of the data up to that offset. The data is synced to disk before the
+    metadata is written, so the metadata never points past good data.
+    Both happen every *flush_bytes* bytes or *flush_interval* seconds, on
+    completion and on :meth:`flush`; blocks written after the last flush
+    are downloaded again after a crash.
+    """
+
+    def __init__(self, path, size, flush_bytes=65536, flush_interval=1.0):
+        self._path = path
+        self._meta_path = path + ".json"
+        self._size = size
+        self._offset = 0
+        self._crc = 0x0000
+        self._flush_bytes = flush_bytes
+        self._flush_interval = flush_interval
+        self._pending = 0  # Bytes written since the last flush
+        self._flushed = time.time()
+
+        try:
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            if os.path.getsize(self._path) >= meta["offset"]:
+                self._offset = meta["offset"]
+                self._crc = meta["crc"]
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    def get_path(self):
+        return self._path
+
+    def get_size(self):
+        return self._size
+
+    def get_offset(self):
+        return self._offset
+
+    def get_crc(self):
+        return self._crc
+
+    def is_complete(self):
+        return self._offset >= self._size
+
+    def read(self, offset=0, length=None):
+        """Cached data from *offset*, at most *length* bytes."""
+        if length is None:
+            length = self._offset - offset
+        length = min(length, self._offset - offset)
+        if length <= 0:
+            return array.array('B')
+        with open(self._path, "rb") as f:
+            f.seek(offset)
+            return array.array('B', f.read(length))
+
+    def write(self, offset, block, crc):
+        """
+        Store *block* at *offset*, *crc* being the CRC of the file up to the
+        end of the block.
+        """
+        mode = "r+b" if os.path.exists(self._path) else "wb"
+        with open(self._path, mode) as f:
+            f.seek(offset)
+            f.write(bytearray(block))
+
+        self._offset = offset + len(block)
+        self._crc = crc
+        self._pending += len(block)
+        if (self._pending >= self._flush_bytes or self.is_complete() or
+                time.time() - self._flushed >= self._flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Sync the data written so far and record its offset and CRC."""
+        if self._pending == 0:
+            return
+        with open(self._path, "r+b") as f:
+            os.fsync(f.fileno())
+
+        temporary = self._meta_path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"offset": self._offset, "crc": self._crc, "size": self._size}, f)
+        replace_file(temporary, self._meta_path)
+        self._pending = 0
+        self._flushed = time.time()
+
+    def remove(self):
+        for path in (self._path, self._meta_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._offset = 0
+        self._crc = 0x0000
+        self._pending = 0
+
+
+class DownloadCache(object):
+    """
+    On-disk cache of downloads, keyed by the serial number of the device
+    and the index, size and date of the file. A download that was
+    interrupted resumes from the last good offset, a download that already
+    completed is served from disk.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+
+    def get_directory(self):
+        return self._directory
+
+    def get_path(self, serial, index, size, date):
+        name = str.format("{0:05d}_{1}_{2}", index, size, date.strftime("%Y%m%d%H%M%S"))
+        return os.path.join(self._directory, str(serial), name)
+
+    def open(self, serial, index, size, date):
+        path = self.get_path(serial, index, size, date)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        download = CachedDownload(path, size)
+        _logger.debug("cache %s, offset %d of %d", path, download.get_offset(), size)
+        return download
+
+    def remove(self, serial, index, size, date):
+        """Drop the cached download of the file, if any."""
+        CachedDownload(self.get_path(serial, index, size, date), size).remove()
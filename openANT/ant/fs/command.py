@@ -23,15 +23,61 @@
 from __future__ import absolute_import, print_function
 
 import array
-from collections import OrderedDict
-import copy
 import logging
+import operator
 import struct
 
 _logger = logging.getLogger("ant.fs.command")
 
 
-class Command:
+def _accessor(slot):
+    def get(self):
+        return getattr(self, slot)
+    get.__name__ = "get" + slot
+    return get
+
+
+def _values(slots):
+    if not slots:
+        return lambda instance: ()
+    elif len(slots) == 1:
+        getter = operator.attrgetter(slots[0])
+        return lambda instance: (getter(instance),)
+    return operator.attrgetter(*slots)
+
+
+class _Compiled(type):
+    """
+    Compiles command classes: the argument names in ``_fields`` become
+    ``__slots__`` (prefixed with an underscore) with ``get_<name>()``
+    accessors, and ``_format`` one cached :class:`struct.Struct`.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        fields = namespace.get("_fields", ())
+        inherited = set()
+        for base in bases:
+            for klass in base.__mro__:
+                inherited.update(getattr(klass, "__slots__", ()))
+        namespace["__slots__"] = tuple(namespace.get("__slots__", ())) + tuple(
+            "_" + field for field in fields if "_" + field not in inherited)
+        for field in fields:
+            namespace.setdefault("get_" + field, _accessor("_" + field))
+
+        cls = type.__new__(mcs, name, bases, namespace)
+        if "_fields" in namespace:
+            cls._get_values = staticmethod(_values(["_" + field for field in fields]))
+        if "_format" in namespace:
+            cls._struct = None if cls._format is None else struct.Struct(cls._format)
+            cls._blank = None if cls._struct is None else bytes(bytearray(cls._struct.size))
+        return cls
+
+
+# Python 2 and 3 compatible base class with the metaclass
+_CompiledBase = _Compiled("_CompiledBase", (object,), {})
+
+
+class Command(_CompiledBase):
     class Type:
 
         # Commands
@@ -53,35 +99,30 @@ class Command:
         UPLOAD_DATA_RESPONSE = 0x8C
 
     _format = "<BB"
+    _fields = ()
     _id = None
 
-    def __init__(self):
-        self._arguments = OrderedDict()
-        self._add_argument('x', 0x44)
-        self._add_argument('id', self._id)
-
-    def _add_argument(self, name, value):
-        self._arguments[name] = value
-
     def _get_argument(self, name):
-        return self._arguments[name]
+        if name == "x":
+            return 0x44
+        elif name == "id":
+            return self._id
+        return getattr(self, "_" + name)
 
     def _get_arguments(self):
-        return self._arguments.values()
+        return (0x44, self._id) + self._get_values(self)
 
     def get_id(self):
         return self._id
 
     def get(self):
-        arguments = list(self._get_arguments())
-        data = struct.pack(self._format, *arguments)
-        lst = array.array('B', data)
-        _logger.debug("packing %r in %r,%s", data, lst, type(lst))
-        return lst
+        data = array.array('B', self._blank)
+        self._struct.pack_into(data, 0, 0x44, self._id, *self._get_values(self))
+        return data
 
     @classmethod
     def _parse_args(cls, data):
-        return struct.unpack(cls._format, data)
+        return cls._struct.unpack_from(data)
 
     @classmethod
     def _parse(cls, data):
@@ -91,28 +132,27 @@ class Command:
         return cls(*args[2:])
 
     def _debug(self):
-        max_key_length, max_value_length = 0, 0
-        for key, value in self._arguments.items():
-            max_key_length = max(len(str(key)), max_key_length)
-            max_value_length = max(len(str(value)), max_value_length)
+        values = [str(value) for value in self._get_values(self)]
+        max_key_length = max([len(field) for field in self._fields] + [0])
+        max_value_length = max([len(value) for value in values] + [0])
         max_length = max_key_length + max_value_length + 3
         print("=" * max_length)
         print(self.__class__.__name__)
         print("-" * max_length)
-        for key, value in self._arguments.items():
-            print(str(key) + ":", " " * (max_length - len(key)), str(value))
+        for key, value in zip(self._fields, values):
+            print(key + ":", " " * (max_length - len(key)), value)
         print("=" * max_length)
 
 
 class LinkCommand(Command):
     _id = Command.Type.LINK
     _format = Command._format + "BBI"
+    _fields = ("channel_frequency", "channel_period", "host_serial_number")
 
     def __init__(self, channel_frequency, channel_period, host_serial_number):
-        Command.__init__(self)
-        self._add_argument("channel_frequency", channel_frequency)
-        self._add_argument("channel_period", channel_period)
-        self._add_argument("host_serial_number", host_serial_number)
+        self._channel_frequency = channel_frequency
+        self._channel_period = channel_period
+        self._host_serial_number = host_serial_number
 
 
 class DisconnectCommand(Command):
@@ -122,57 +162,49 @@ class DisconnectCommand(Command):
 
     _id = Command.Type.DISCONNECT
     _format = Command._format + "BBBxxx"
+    _fields = ("command_type", "time_duration", "application_specific_duration")
 
     def __init__(self, command_type, time_duration, application_specific_duration):
-        Command.__init__(self)
-        self._add_argument("command_type", command_type)
-        self._add_argument("time_duration", time_duration)
-        self._add_argument("application_specific_duration", application_specific_duration)
+        self._command_type = command_type
+        self._time_duration = time_duration
+        self._application_specific_duration = application_specific_duration
 
 
 class AuthenticateBase(Command):
-    _format = None
-
-    def __init__(self, x_type, serial_number, data=[]):
-        Command.__init__(self)
-        self._add_argument("type", x_type)
-        self._add_argument("serial_number", serial_number)
-        self._add_argument("data", data)
+    _format = "<BBBBI"
+    _fields = ("type", "serial_number", "data")
 
-    def _pad(self, data):
-        padded_data = copy.copy(data)
-        missing = 8 - len(padded_data) % 8
-        if missing < 8:
-            padded_data.extend([0x00] * missing)
-        return padded_data
+    def __init__(self, x_type, serial_number, data=()):
+        self._type = x_type
+        self._serial_number = serial_number
+        self._data = data
 
     def get_serial(self):
-        return self._get_argument("serial_number")
+        return self._serial_number
 
     def get_data_string(self):
-        if not self._get_argument("data"):
+        if not self._data:
             return None
         else:
-            return "".join(map(chr, self._get_argument("data")))
+            return "".join(map(chr, self._data))
 
     def get_data_array(self):
-        return self._get_argument("data")
+        return self._data
 
     def get(self):
-        arguments = list(self._get_arguments())
-        data = list(self._get_argument("data"))
-        lst = array.array('B', struct.pack("<BBBBI", arguments[0],
-                                           arguments[1], arguments[2],
-                                           len(data), arguments[3]))
-        padded = self._pad(data)
-        lst.extend(array.array('B', padded))
-        return lst
+        data = array.array('B', self._data)
+        length = len(data)
+        packed = array.array('B', self._struct.pack(0x44, self._id, self._type, length,
+                                                    self._serial_number))
+        packed.extend(data)
+        # Pad with zeros to a multiple of 8 bytes
+        packed.extend(array.array('B', bytearray(-length % 8)))
+        return packed
 
     @classmethod
     def _parse_args(cls, data):
-        header = struct.unpack("<BBBxI", data[0:8])
-        data_length = data[3]
-        return header + (data[8:8 + data_length],)
+        x, command_id, x_type, data_length, serial_number = cls._struct.unpack_from(data)
+        return x, command_id, x_type, serial_number, data[8:8 + data_length]
 
 
 class AuthenticateCommand(AuthenticateBase):
@@ -184,7 +216,7 @@ class AuthenticateCommand(AuthenticateBase):
 
     _id = Command.Type.AUTHENTICATE
 
-    def __init__(self, command_type, host_serial_number, data=[]):
+    def __init__(self, command_type, host_serial_number, data=()):
         AuthenticateBase.__init__(self, command_type, host_serial_number, data)
 
 
@@ -196,7 +228,7 @@ class AuthenticateResponse(AuthenticateBase):
 
     _id = Command.Type.AUTHENTICATE_RESPONSE
 
-    def __init__(self, response_type, client_serial_number, data=[]):
+    def __init__(self, response_type, client_serial_number, data=()):
         AuthenticateBase.__init__(self, response_type, client_serial_number, data)
 
 
@@ -207,15 +239,15 @@ class PingCommand(Command):
 class DownloadRequest(Command):
     _id = Command.Type.DOWNLOAD_REQUEST
     _format = Command._format + "HIx?HI"
+    _fields = ("data_index", "data_offset", "initial_request", "crc_seed", "maximum_block_size")
 
     def __init__(self, data_index, data_offset, initial_request, crc_seed,
                  maximum_block_size=0):
-        Command.__init__(self)
-        self._add_argument("data_index", data_index)
-        self._add_argument("data_offset", data_offset)
-        self._add_argument("initial_request", initial_request)
-        self._add_argument("crc_seed", crc_seed)
-        self._add_argument("maximum_block_size", maximum_block_size)
+        self._data_index = data_index
+        self._data_offset = data_offset
+        self._initial_request = initial_request
+        self._crc_seed = crc_seed
+        self._maximum_block_size = maximum_block_size
 
 
 class DownloadResponse(Command):
@@ -228,34 +260,48 @@ class DownloadResponse(Command):
         INCORRECT_CRC = 5
 
     _id = Command.Type.DOWNLOAD_RESPONSE
-    _format = None
+    _format = "<BBBxIII"
+    _fields = ("response", "remaining", "offset", "size", "data", "crc")
+    _footer = struct.Struct("<6xH")
 
     def __init__(self, response, remaining, offset, size, data, crc):
-        Command.__init__(self)
-        self._add_argument("response", response)
-        self._add_argument("remaining", remaining)
-        self._add_argument("offset", offset)
-        self._add_argument("size", size)
-        self._add_argument("data", data)
-        self._add_argument("crc", crc)
+        self._response = response
+        self._remaining = remaining
+        self._offset = offset
+        self._size = size
+        self._data = data
+        self._crc = crc
+
+    def get(self):
+        payload = memoryview(self._data)
+        length = len(payload)
+        end = 16 + length + (-length % 8)
+        data = array.array('B', bytearray(end + 8 if self._response == self.Response.OK else 16))
+        self._struct.pack_into(data, 0, 0x44, self._id, self._response, self._remaining,
+                               self._offset, self._size)
+        if self._response == self.Response.OK:
+            memoryview(data)[16:16 + length] = payload
+            self._footer.pack_into(data, end, self._crc)
+        return data
 
     @classmethod
     def _parse_args(cls, data):
+        header = cls._struct.unpack_from(data)
         if data[2] == DownloadResponse.Response.OK:
-            return struct.unpack("<BBBxIII", data[0:16]) + (data[16:-8],) + struct.unpack("<6xH", data[-8:])
+            return header + (data[16:-8],) + cls._footer.unpack_from(data, len(data) - 8)
         else:
-            return struct.unpack("<BBBxIII", data[0:16]) + (array.array('B', []),) + (0,)
+            return header + (array.array('B', []),) + (0,)
 
 
 class UploadRequest(Command):
     _id = Command.Type.UPLOAD_REQUEST
     _format = Command._format + "HI4xI"
+    _fields = ("data_index", "max_size", "data_offset")
 
     def __init__(self, data_index, max_size, data_offset):
-        Command.__init__(self)
-        self._add_argument("data_index", data_index)
-        self._add_argument("max_size", max_size)
-        self._add_argument("data_offset", data_offset)
+        self._data_index = data_index
+        self._max_size = max_size
+        self._data_offset = data_offset
 
 
 class UploadResponse(Command):
@@ -269,40 +315,45 @@ class UploadResponse(Command):
 
     _id = Command.Type.UPLOAD_RESPONSE
     _format = Command._format + "BxIII6xH"
+    _fields = ("response", "last_data_offset", "maximum_file_size", "maximum_block_size", "crc")
 
     def __init__(self, response, last_data_offset, maximum_file_size,
                  maximum_block_size, crc):
-        Command.__init__(self)
-        self._add_argument("response", response)
-        self._add_argument("last_data_offset", last_data_offset)
-        self._add_argument("maximum_file_size", maximum_file_size)
-        self._add_argument("maximum_block_size", maximum_block_size)
-        self._add_argument("crc", crc)
+        self._response = response
+        self._last_data_offset = last_data_offset
+        self._maximum_file_size = maximum_file_size
+        self._maximum_block_size = maximum_block_size
+        self._crc = crc
 
 
 class UploadDataCommand(Command):
     _id = Command.Type.UPLOAD_DATA
-    _format = None
+    _format = "<BBHI"
+    _fields = ("crc_seed", "data_offset", "data", "crc")
+    _footer = struct.Struct("<6xH")
 
     def __init__(self, crc_seed, data_offset, data, crc):
-        Command.__init__(self)
-        self._add_argument("crc_seed", crc_seed)
-        self._add_argument("data_offset", data_offset)
-        self._add_argument("data", data)
-        self._add_argument("crc", crc)
+        self._crc_seed = crc_seed
+        self._data_offset = data_offset
+        self._data = data
+        self._crc = crc
 
     def get(self):
-        arguments = list(self._get_arguments())
-        header = struct.pack("<BBHI", *arguments[:4])
-        footer = struct.pack("<6xH", self._get_argument("crc"))
-        data = array.array('B', header)
-        data.extend(self._get_argument("data"))
-        data.extend(array.array('B', footer))
+        # Header, data padded with zeros to a multiple of 8 bytes and footer
+        # are packed into one preallocated buffer. The data may be any
+        # buffer, e.g. a memoryview into the file being uploaded.
+        payload = memoryview(self._data)
+        length = len(payload)
+        end = 8 + length + (-length % 8)
+        data = array.array('B', bytearray(end + 8))
+        self._struct.pack_into(data, 0, 0x44, self._id, self._crc_seed, self._data_offset)
+        memoryview(data)[8:8 + length] = payload
+        self._footer.pack_into(data, end, self._crc)
         return data
 
     @classmethod
     def _parse_args(cls, data):
-        return struct.unpack("<BBHI", data[0:8]) + (data[8:-8],) + struct.unpack("<6xH", data[-8:])
+        return cls._struct.unpack_from(data) + (data[8:-8],) + cls._footer.unpack_from(data, len(data) - 8)
 
 
 class UploadDataResponse(Command):
@@ -312,19 +363,19 @@ class UploadDataResponse(Command):
 
     _id = Command.Type.UPLOAD_DATA_RESPONSE
     _format = Command._format + "B5x"
+    _fields = ("response",)
 
     def __init__(self, response):
-        Command.__init__(self)
-        self._add_argument("response", response)
+        self._response = response
 
 
 class EraseRequestCommand(Command):
     _id = Command.Type.ERASE_REQUEST
     _format = Command._format + "I2x"
+    _fields = ("data_file_index",)
 
     def __init__(self, data_file_index):
-        Command.__init__(self)
-        self._add_argument("data_file_index", data_file_index)
+        self._data_file_index = data_file_index
 
 
 class EraseResponse(Command):
@@ -335,10 +386,10 @@ class EraseResponse(Command):
 
     _id = Command.Type.ERASE_RESPONSE
     _format = Command._format + "B5x"
+    _fields = ("response",)
 
     def __init__(self, response):
-        Command.__init__(self)
-        self._add_argument("response", response)
+        self._response = response
 
 
 _classes = {
@@ -362,10 +413,5 @@ _classes = {
 
 
 def parse(data):
-    _logger.debug("parsing data %r", data)
-    mark, command_type = struct.unpack("<BB", data[0:2])
-    assert mark == 0x44
-    command_class = _classes[command_type]
-
-    return command_class._parse(data)
-
+    assert data[0] == 0x44
+    return _classes[data[1]]._parse(data)
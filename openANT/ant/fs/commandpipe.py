@@ -23,16 +23,37 @@
 from __future__ import absolute_import, print_function
 
 import array
-from collections import OrderedDict
 import logging
 import struct
+import threading
 
-from ant.fs.command import Command
+from ant.fs.command import _CompiledBase
+from ant.fs.file import _fit_time
 
 _logger = logging.getLogger("ant.fs.commandpipe")
 
 
-class CommandPipe(object):
+class Sequence(object):
+    """
+    Command pipe sequence numbers, thread-safe and wrapping at 256. Every
+    session should use its own, see :meth:`CommandPipe.set_sequence`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def get_next(self):
+        with self._lock:
+            self._value = (self._value + 1) & 0xff
+            return self._value
+
+
+# Numbers commands created outside of a session
+_sequence = Sequence()
+
+
+class CommandPipe(_CompiledBase):
     class Type:
 
         REQUEST = 0x01
@@ -44,73 +65,70 @@ class CommandPipe(object):
         SET_CLIENT_FRIENDLY_NAME = 0x07
         FACTORY_RESET_COMMAND = 0x08
 
+    __slots__ = ("_sequence",)
     _format = "<BxxB"
+    _fields = ()
     _id = None
-    _sequence = 0
 
     def __init__(self):
-        self._arguments = OrderedDict()
-        self._add_argument('command', self._id)
-        CommandPipe._sequence += 1
-        self._add_argument('sequence', CommandPipe._sequence)
+        self._sequence = _sequence.get_next()
 
-    def _add_argument(self, name, value):
-        self._arguments[name] = value
+    def get_command(self):
+        return self._id
+
+    def get_sequence(self):
+        return self._sequence
+
+    def set_sequence(self, sequence):
+        self._sequence = sequence
 
     def _get_argument(self, name):
-        return self._arguments[name]
+        if name == "command":
+            return self._id
+        return getattr(self, "_" + name)
 
     def _get_arguments(self):
-        return self._arguments.values()
-
-    def __getattr__(self, attr):
-        # Get arguments with get_*
-        if attr.startswith("get_"):
-            name = attr[4:]
-            if name in self._arguments:
-                return lambda: self._arguments[name]
-        raise AttributeError("No such attribute")
+        return (self._id, self._sequence) + self._get_values(self)
 
     def get(self):
-        arguments = list(self._get_arguments())
-        data = struct.pack(self._format, *arguments)
-        lst = array.array('B', data)
-        _logger.debug("packing %r in %r,%s", data, lst, type(lst))
-        return lst
+        data = array.array('B', self._blank)
+        self._struct.pack_into(data, 0, self._id, self._sequence, *self._get_values(self))
+        return data
 
     @classmethod
     def _parse_args(cls, data):
-        return struct.unpack(cls._format, data)
+        return cls._struct.unpack_from(data)
 
     @classmethod
     def _parse(cls, data):
         args = cls._parse_args(data)
         assert args[0] == cls._id
         instance = cls(*args[2:])
-        instance._arguments["sequence"] = args[1]
+        instance._sequence = args[1]
         return instance
 
     def _debug(self):
-        max_key_length, max_value_length = 0, 0
-        for key, value in self._arguments.items():
-            max_key_length = max(len(str(key)), max_key_length)
-            max_value_length = max(len(str(value)), max_value_length)
+        fields = ("sequence",) + self._fields
+        values = [str(value) for value in (self._sequence,) + self._get_values(self)]
+        max_key_length = max(len(field) for field in fields)
+        max_value_length = max(len(value) for value in values)
         max_length = max_key_length + max_value_length + 3
         print("=" * max_length)
         print(self.__class__.__name__)
         print("-" * max_length)
-        for key, value in self._arguments.items():
-            print(str(key) + ":", " " * (max_length - len(key)), str(value))
+        for key, value in zip(fields, values):
+            print(key + ":", " " * (max_length - len(key)), value)
         print("=" * max_length)
 
 
 class Request(CommandPipe):
     _id = CommandPipe.Type.REQUEST
     _format = CommandPipe._format + "Bxxx"
+    _fields = ("request_id",)
 
     def __init__(self, request_id):
         CommandPipe.__init__(self)
-        self._add_argument('request_id', request_id)
+        self._request_id = request_id
 
 
 class Response(CommandPipe):
@@ -122,11 +140,12 @@ class Response(CommandPipe):
 
     _id = CommandPipe.Type.RESPONSE
     _format = CommandPipe._format + "BxBx"
+    _fields = ("request_id", "response")
 
     def __init__(self, request_id, response):
         CommandPipe.__init__(self)
-        self._add_argument('request_id', request_id)
-        self._add_argument('response', response)
+        self._request_id = request_id
+        self._response = response
 
 
 class Time(CommandPipe):
@@ -137,12 +156,13 @@ class Time(CommandPipe):
 
     _id = CommandPipe.Type.TIME
     _format = CommandPipe._format + "IIBxxx"
+    _fields = ("current_time", "system_time", "time_format")
 
     def __init__(self, current_time, system_time, time_format):
         CommandPipe.__init__(self)
-        self._add_argument('current_time', current_time)
-        self._add_argument('system_time', system_time)
-        self._add_argument('time_format', time_format)
+        self._current_time = current_time
+        self._system_time = system_time
+        self._time_format = time_format
 
 
 class TimeResponse(Response):
@@ -154,40 +174,90 @@ class TimeResponse(Response):
 
 class CreateFile(Request):
     _id = CommandPipe.Type.CREATE_FILE
-    _format = None
+    _format = CommandPipe._format + "IB"
+    _fields = ("size", "data_type", "identifier", "identifier_mask")
 
     def __init__(self, size, data_type, identifier, identifier_mask):
         CommandPipe.__init__(self)
-        self._add_argument('size', size)
-        self._add_argument('data_type', data_type)
-        self._add_argument('identifier', identifier)
-        self._add_argument('identifier_mask', identifier_mask)
+        self._size = size
+        self._data_type = data_type
+        self._identifier = identifier
+        self._identifier_mask = identifier_mask
 
     def get(self):
-        arguments = list(self._get_arguments())
-        data = array.array('B', struct.pack(CommandPipe._format + "IB", *arguments[:4]))
-        data.extend(self._get_argument("identifier"))
-        data.extend([0])
-        data.extend(self._get_argument("identifier_mask"))
+        data = array.array('B', bytearray(16))
+        self._struct.pack_into(data, 0, self._id, self._sequence, self._size, self._data_type)
+        data[9:12] = array.array('B', self._identifier)
+        data[13:16] = array.array('B', self._identifier_mask)
         return data
 
     @classmethod
     def _parse_args(cls, data):
-        return struct.unpack(Command._format + "IB", data[0:9]) + (data[9:12],) + (data[13:16],)
+        return cls._struct.unpack_from(data) + (data[9:12],) + (data[13:16],)
 
 
 class CreateFileResponse(Response):
-    _format = Response._format + "BBBBHxx"
+    _format = Response._format + "B3sH2x"
+    _fields = ("request_id", "response", "data_type", "identifier", "index")
 
     def __init__(self, request_id, response, data_type, identifier, index):
         Response.__init__(self, request_id, response)
-        self._add_argument('data_type', data_type)
-        self._add_argument('identifier', identifier)
-        self._add_argument('index', index)
+        self._data_type = data_type
+        self._identifier = identifier
+        self._index = index
+
+    def get(self):
+        data = array.array('B', self._blank)
+        self._struct.pack_into(data, 0, self._id, self._sequence, self._request_id, self._response,
+                               self._data_type, bytes(bytearray(self._identifier)), self._index)
+        return data
 
     @classmethod
     def _parse_args(cls, data):
-        return Response._parse_args(data[:8]) + (data[8], data[9:12], struct.unpack("<H", data[12:14])[0])
+        args = cls._struct.unpack_from(data)
+        return args[:5] + (data[9:12], args[6])
+
+
+class DirectoryFilter(CommandPipe):
+    """
+    Restricts the next directory download to the entries of *data_type*
+    whose identifier matches *identifier* in the bits set in
+    *identifier_mask*, modified at or after *since* (seconds since the FIT
+    epoch, 0 for any date).
+    """
+
+    _id = CommandPipe.Type.DIRECTORY_FILTER
+    _format = CommandPipe._format + "B3s3sxI"
+    _fields = ("data_type", "identifier", "identifier_mask", "since")
+
+    def __init__(self, data_type, identifier, identifier_mask, since=0):
+        CommandPipe.__init__(self)
+        self._data_type = data_type
+        self._identifier = array.array('B', identifier)
+        self._identifier_mask = array.array('B', identifier_mask)
+        self._since = since
+
+    def get(self):
+        data = array.array('B', self._blank)
+        self._struct.pack_into(data, 0, self._id, self._sequence, self._data_type,
+                               self._identifier.tobytes(), self._identifier_mask.tobytes(),
+                               self._since)
+        return data
+
+    @classmethod
+    def _parse_args(cls, data):
+        args = cls._struct.unpack_from(data)
+        return args[:3] + (array.array('B', args[3]), array.array('B', args[4]), args[5])
+
+    def matches(self, file):
+        """Whether the directory entry *file* passes the filter."""
+        if file.get_type() != self._data_type:
+            return False
+        for have, want, mask in zip(bytearray(file.get_identifier()), self._identifier,
+                                    self._identifier_mask):
+            if have & mask != want & mask:
+                return False
+        return self._since == 0 or _fit_time(file.get_date()) >= self._since
 
 
 _classes = {
@@ -195,7 +265,7 @@ _classes = {
     CommandPipe.Type.RESPONSE: Response,
     CommandPipe.Type.TIME: Time,
     CommandPipe.Type.CREATE_FILE: CreateFile,
-    CommandPipe.Type.DIRECTORY_FILTER: None,
+    CommandPipe.Type.DIRECTORY_FILTER: DirectoryFilter,
     CommandPipe.Type.SET_AUTHENTICATION_PASSKEY: None,
     CommandPipe.Type.SET_CLIENT_FRIENDLY_NAME: None,
     CommandPipe.Type.FACTORY_RESET_COMMAND: None}
@@ -22,17 +22,159 @@
 
 from __future__ import absolute_import, print_function
 
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# CRC-16/ARC (poly 0x8005 reflected, no final xor), see
 # http://reveng.sourceforge.net/crc-catalogue/16.htm#crc.cat.arc
-def crc(data, seed=0x0000):
-    rem = seed
-    for byte in data:
-        rem ^= byte
+
+
+def _make_table():
+    table = []
+    for byte in range(256):
+        rem = byte
         for _ in range(0, 8):
             if rem & 0x0001:
-                rem = (rem >> 1)
-                rem ^= 0xa001
+                rem = (rem >> 1) ^ 0xa001
             else:
                 rem = rem >> 1
+        table.append(rem)
+    return table
+
+
+_TABLE = _make_table()
+
+# Buffers of at least this size are handed to NumPy, if available
+NUMPY_THRESHOLD = 16384
+
 
+def crc(data, seed=0x0000):
+    if numpy is not None and len(data) >= NUMPY_THRESHOLD:
+        return _crc_numpy(data, seed)
+
+    rem = seed
+    table = _TABLE
+    for byte in data:
+        rem = (rem >> 8) ^ table[(rem ^ byte) & 0xff]
     return rem
 
+
+class Crc16(object):
+    """
+    Incremental CRC, feed it the data chunk by chunk::
+
+        c = Crc16()
+        c.update(block_1)
+        c.update(block_2)
+        c.get_value() == crc(block_1 + block_2)
+    """
+
+    def __init__(self, seed=0x0000, length=0):
+        self._value = seed
+        self._length = length
+
+    def update(self, data):
+        self._value = crc(data, self._value)
+        self._length += len(data)
+        return self
+
+    def get_value(self):
+        return self._value
+
+    def get_length(self):
+        """
+        Number of bytes fed so far.
+        """
+        return self._length
+
+    def copy(self):
+        return Crc16(self._value, self._length)
+
+
+# The CRC is linear: crc(a + b, seed) == crc(b, crc(a, seed)) and
+# crc(b, seed) == crc(b, 0) ^ crc(zeros(len(b)), seed). Large buffers are
+# therefore split into lanes whose CRCs are computed side by side with
+# NumPy and then combined pairwise by "shifting" the left CRC over the
+# length of the right lane. A shift over n zero bytes is a 16x16 matrix
+# over GF(2), stored as the images of the 16 unit vectors.
+
+def _shift_one():
+    return [(1 << i >> 8) ^ _TABLE[(1 << i) & 0xff] for i in range(16)]
+
+
+def _apply(matrix, vector):
+    result = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return result
+
+
+def _multiply(a, b):
+    return [_apply(a, column) for column in b]
+
+
+def _shift(length):
+    result = [1 << i for i in range(16)]
+    square = _shift_one()
+    while length:
+        if length & 1:
+            result = _multiply(square, result)
+        square = _multiply(square, square)
+        length >>= 1
+    return result
+
+
+def _crc_numpy(data, seed=0x0000):
+    if isinstance(data, (list, tuple)):
+        buf = numpy.asarray(data, dtype=numpy.uint8)
+    else:
+        buf = numpy.frombuffer(data, dtype=numpy.uint8)
+
+    table = numpy.asarray(_TABLE, dtype=numpy.uint16)
+
+    lanes = 1 << max(0, min(16, (len(buf) // 64).bit_length() - 1))
+    length = len(buf) // lanes
+    body = lanes * length
+    columns = numpy.ascontiguousarray(buf[:body].reshape(lanes, length).T)
+
+    rem = numpy.zeros(lanes, dtype=numpy.uint16)
+    rem[0] = seed
+    for column in columns:
+        rem = (rem >> 8) ^ table[(rem ^ column) & 0xff]
+
+    # Combine neighbouring lanes until one is left, the lanes double in
+    # length on every round
+    matrix = _shift(length)
+    while len(rem) > 1:
+        left, right = rem[0::2], rem[1::2]
+        shifted = numpy.zeros_like(left)
+        for i in range(16):
+            shifted ^= ((left >> i) & 1) * numpy.uint16(matrix[i])
+        rem = shifted ^ right
+        matrix = _multiply(matrix, matrix)
+
+    rem = int(rem[0])
+    for byte in buf[body:].tolist():
+        rem = (rem >> 8) ^ _TABLE[(rem ^ byte) & 0xff]
+    return rem
+
+
+def replace_file(source, destination):
+    """
+    Rename *source* to *destination*, replacing an existing file in one
+    step. Files written to a temporary name first and then replaced are
+    never seen half written.
+    """
+    try:
+        os.replace(source, destination)
+    except AttributeError:
+        # Python 2, rename overwrites on POSIX
+        os.rename(source, destination)
@@ -22,13 +22,22 @@
 
 from __future__ import absolute_import, print_function
 
+import array
 import datetime
 import logging
 import struct
 import sys
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 _logger = logging.getLogger("ant.fs.file")
 
+# Seconds between the Unix epoch and the FIT/ANT-FS epoch, 1989-12-31 UTC
+_FIT_EPOCH = 631065600
+
 
 class Directory:
     def __init__(self, version, time_format, current_system_time,
@@ -169,11 +178,113 @@ class File:
         # i1, i2, i3 -> three byte integer, not supported by struct
         index, data_type, data_flags, flags, file_size, file_date = struct.unpack("<HB3xBBII", data)
         if sys.version_info >= (3,3):
-           file_date = datetime.datetime.fromtimestamp(file_date + 631065600, datetime.timezone.utc)
+           file_date = datetime.datetime.fromtimestamp(file_date + _FIT_EPOCH, datetime.timezone.utc)
         else:
-           file_date = datetime.datetime.fromtimestamp(file_date + 631065600)
+           file_date = datetime.datetime.fromtimestamp(file_date + _FIT_EPOCH)
         identifier = data[3:6]
 
         return File(index, data_type, identifier, data_flags, flags, file_size, file_date)
 
 
+def _fit_time(date):
+    """Seconds since the FIT epoch of *date*, a datetime (naive ones are taken as UTC)."""
+    if date.tzinfo is not None:
+        date = date.replace(tzinfo=None) - date.utcoffset()
+    return int((date - datetime.datetime(1989, 12, 31)).total_seconds())
+
+
+class DirectoryView:
+    """
+    Columnar view of a directory: a NumPy structured array over the raw
+    16 byte entries, without a :class:`File` object per entry. Fields are
+    decoded when accessed and the filters are vectorized. A parsed view
+    shares the downloaded buffer; a filtered view holds a copy of the
+    selected entries, 16 bytes each.
+    """
+
+    if numpy is not None:
+        ENTRY = numpy.dtype([("index", "<u2"), ("type", "u1"), ("sub_type", "u1"),
+                             ("file_number", "<u2"), ("type_flags", "u1"), ("flags", "u1"),
+                             ("size", "<u4"), ("date", "<u4")])
+
+    def __init__(self, version, time_format, current_system_time,
+                 last_modified, entries):
+        self._version = version
+        self._time_format = time_format
+        self._current_system_time = current_system_time
+        self._last_modified = last_modified
+        self._entries = entries
+
+    def get_version(self):
+        return self._version
+
+    def get_time_format(self):
+        return self._time_format
+
+    def get_current_system_time(self):
+        return self._current_system_time
+
+    def get_last_modified(self):
+        return self._last_modified
+
+    def get_entries(self):
+        return self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_indexes(self):
+        return self._entries["index"]
+
+    def get_sizes(self):
+        return self._entries["size"]
+
+    def get_dates(self):
+        return (self._entries["date"].astype("int64") + _FIT_EPOCH).astype("datetime64[s]")
+
+    def get_file(self, position):
+        entry = self._entries[position]
+        return File.parse(array.array('B', entry.tobytes()))
+
+    def get_files(self):
+        return [self.get_file(position) for position in range(len(self._entries))]
+
+    def __iter__(self):
+        for position in range(len(self._entries)):
+            yield self.get_file(position)
+
+    def where(self, mask):
+        """New view of the entries selected by the boolean *mask* (copied)."""
+        return DirectoryView(self._version, self._time_format, self._current_system_time,
+                             self._last_modified, self._entries[mask])
+
+    def filter(self, identifier=None, since=None, until=None, flags=0, readable=None):
+        """
+        Entries with the FIT sub type *identifier* (a :class:`File.Identifier`
+        or a sequence of them), dated in [*since*, *until*) and with all the
+        bits of *flags* set.
+        """
+        entries = self._entries
+        mask = numpy.ones(len(entries), dtype=bool)
+        if identifier is not None:
+            mask &= numpy.isin(entries["sub_type"], numpy.atleast_1d(identifier))
+        if since is not None:
+            mask &= entries["date"] >= _fit_time(since)
+        if until is not None:
+            mask &= entries["date"] < _fit_time(until)
+        if flags:
+            mask &= (entries["flags"] & flags) == flags
+        if readable is not None:
+            mask &= ((entries["flags"] & 0b10000000) != 0) == readable
+        return self.where(mask)
+
+    @staticmethod
+    def parse(data):
+        if numpy is None:
+            raise ImportError("DirectoryView requires NumPy")
+        version, structure_length, time_format, current_system_time, last_modified = struct.unpack(
+            "<BBB5xII", bytearray(data[:16]))
+        count = (len(data) - 16) // 16
+        entries = numpy.frombuffer(data, dtype=DirectoryView.ENTRY, count=count, offset=16)
+        return DirectoryView(((version & 0xf0) >> 4, version & 0x0f), time_format,
+                             current_system_time, last_modified, entries)
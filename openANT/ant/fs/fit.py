@@ -0,0 +1,391 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from __future__ import absolute_import, print_function
+
+import array
+import logging
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ant.fs.commons import Crc16, crc
+
+_logger = logging.getLogger("ant.fs.fit")
+
+# Messages and fields named in the batches, other fields are called
+# field_<number>. Values are raw, scale and offset of the profile are not
+# applied.
+MESSAGES = {
+    0: "file_id",
+    18: "session",
+    19: "lap",
+    20: "record",
+    21: "event",
+    23: "device_info",
+    34: "activity"}
+
+FIELDS = {
+    0: {0: "type", 1: "manufacturer", 2: "product", 3: "serial_number", 4: "time_created"},
+    20: {0: "position_lat", 1: "position_long", 2: "altitude", 3: "heart_rate",
+         4: "cadence", 5: "distance", 6: "speed", 7: "power", 13: "temperature"}}
+
+TIMESTAMP = 253
+
+# Base type number -> (numpy type, size)
+_BASE_TYPES = {
+    0x00: ("u1", 1),  # enum
+    0x01: ("i1", 1),  # sint8
+    0x02: ("u1", 1),  # uint8
+    0x03: ("i2", 2),  # sint16
+    0x04: ("u2", 2),  # uint16
+    0x05: ("i4", 4),  # sint32
+    0x06: ("u4", 4),  # uint32
+    0x07: ("S", 1),  # string
+    0x08: ("f4", 4),  # float32
+    0x09: ("f8", 8),  # float64
+    0x0a: ("u1", 1),  # uint8z
+    0x0b: ("u2", 2),  # uint16z
+    0x0c: ("u4", 4),  # uint32z
+    0x0d: ("u1", 1),  # byte
+    0x0e: ("i8", 8),  # sint64
+    0x0f: ("u8", 8),  # uint64
+    0x10: ("u8", 8)}  # uint64z
+
+
+class FitException(Exception):
+    pass
+
+
+class RecordBatch(object):
+    """
+    Data messages of one definition: *records* is a NumPy structured array
+    with a column per field, *timestamps* the timestamp of every record
+    (its own, from a compressed header, or the last one seen before it).
+    """
+
+    def __init__(self, global_number, records, timestamps):
+        self._global_number = global_number
+        self._records = records
+        self._timestamps = timestamps
+
+    def get_global_number(self):
+        return self._global_number
+
+    def get_name(self):
+        return MESSAGES.get(self._global_number, "message_%d" % self._global_number)
+
+    def get_records(self):
+        return self._records
+
+    def get_timestamps(self):
+        return self._timestamps
+
+    def get_fields(self):
+        return self._records.dtype.names
+
+    def __getitem__(self, name):
+        return self._records[name]
+
+    def __len__(self):
+        return len(self._records)
+
+
+class _Definition(object):
+    def __init__(self, global_number, big_endian, fields, developer_fields):
+        self.global_number = global_number
+        order = ">" if big_endian else "<"
+        names = FIELDS.get(global_number, {})
+
+        columns = []
+        offset = 0
+        self.timestamp = None
+        for number, size, base_type in fields:
+            name = names.get(number, "field_%d" % number)
+            typ, base_size = _BASE_TYPES.get(base_type & 0x1f, ("u1", 1))
+            if number == TIMESTAMP and size == 4:
+                name = "timestamp"
+                self.timestamp = (struct.Struct(order + "I"), offset)
+            if typ == "S":
+                columns.append((name, "S%d" % size))
+            elif size == base_size:
+                columns.append((name, order + typ))
+            elif size % base_size == 0:
+                columns.append((name, order + typ, (size // base_size,)))
+            else:
+                columns.append((name, "u1", (size,)))
+            offset += size
+        for number, size, index in developer_fields:
+            columns.append(("developer_%d_%d" % (index, number), "u1", (size,)))
+            offset += size
+
+        self.size = offset
+        self.length = 1 + offset
+        self.dtype = numpy.dtype(columns)
+        self.columns = numpy.arange(offset)
+        # Records of the current batch, copied out of the input buffer
+        self.data = bytearray()
+        self.timestamps = array.array('I')
+        # Offsets of the records in the input buffer not yet copied
+        self.offsets = array.array('l')
+
+
+class FitDecoder(object):
+    """
+    Incremental FIT decoder. Feed it the file chunk by chunk (in any
+    sizes), it returns the completed :class:`RecordBatch` es. Only the
+    current definitions, an incomplete record and up to *batch_size*
+    records per definition are held, whatever the size of the file.
+    Chained FIT files are decoded one after the other.
+    """
+
+    def __init__(self, batch_size=4096, check_crc=True):
+        if numpy is None:
+            raise ImportError("FitDecoder requires NumPy")
+        self._batch_size = batch_size
+        self._check_crc = check_crc
+        self._buffer = bytearray()
+        self._definitions = [None] * 16
+        self._state = self._read_header
+        self._remaining = 0
+        self._crc = Crc16()
+        self._crc_from = 0
+        self._timestamp = 0
+        self._records = 0
+        self._files = 0
+
+    def get_records(self):
+        return self._records
+
+    def get_files(self):
+        return self._files
+
+    def feed(self, data):
+        buffer = self._buffer
+        buffer += data
+        batches = []
+        position = 0
+        while True:
+            state = self._state
+            consumed = state(buffer, position, batches)
+            if consumed == position and self._state == state:
+                break
+            position = consumed
+
+        for definition in self._definitions:
+            if definition is not None:
+                self._gather(definition, buffer)
+        self._update_crc(buffer, position)
+        self._crc_from = 0
+        del buffer[:position]
+        return batches
+
+    def _update_crc(self, buffer, position):
+        if self._check_crc:
+            self._crc.update(memoryview(buffer)[self._crc_from:position])
+        self._crc_from = position
+
+    def close(self):
+        """Remaining batches, raises FitException on a truncated file."""
+        batches = []
+        for definition in self._definitions:
+            if definition is not None:
+                self._flush(definition, batches)
+        if self._buffer or self._state != self._read_header:
+            raise FitException("Truncated FIT file, %d bytes left" % len(self._buffer))
+        return batches
+
+    def _read_header(self, buffer, position, batches):
+        if len(buffer) - position < 1 or len(buffer) - position < buffer[position]:
+            return position
+        size = buffer[position]
+        header_size, protocol, profile, data_size, signature = struct.unpack_from(
+            "<BBHI4s", buffer, position)
+        if signature != b".FIT" or size < 12:
+            raise FitException("Not a FIT file")
+        if size >= 14 and self._check_crc:
+            header_crc = struct.unpack_from("<H", buffer, position + 12)[0]
+            if header_crc not in (0, crc(memoryview(buffer)[position:position + 12])):
+                raise FitException("FIT header CRC mismatch")
+
+        _logger.debug("FIT file, protocol %#x, profile %d, %d bytes", protocol, profile, data_size)
+        self._remaining = data_size
+        self._state = self._read_records
+        return position + size
+
+    def _read_records(self, buffer, position, batches):
+        # Hot loop: only the offsets of data messages are recorded, the
+        # bytes are gathered per definition with NumPy, see _gather
+        definitions = self._definitions
+        batch_size = self._batch_size
+        remaining = self._remaining
+        timestamp = self._timestamp
+        end = len(buffer)
+        try:
+            while remaining > 0 and position < end:
+                header = buffer[position]
+                if header & 0x80:
+                    # Compressed timestamp header
+                    definition = definitions[(header >> 5) & 0x03]
+                    if definition is None:
+                        raise FitException("Data message without definition, local type %d"
+                                           % ((header >> 5) & 0x03))
+                    timestamp_offset = header & 0x1f
+                elif header & 0x40:
+                    length = self._define(header, buffer, position, batches)
+                    if length == 0:
+                        break
+                    if length > remaining:
+                        raise FitException("FIT record crosses the end of the data")
+                    remaining -= length
+                    position += length
+                    continue
+                else:
+                    definition = definitions[header & 0x0f]
+                    if definition is None:
+                        raise FitException("Data message without definition, local type %d"
+                                           % (header & 0x0f))
+                    timestamp_offset = None
+
+                length = definition.length
+                if length > remaining:
+                    raise FitException("FIT record crosses the end of the data")
+                if position + length > end:
+                    break
+                if timestamp_offset is not None:
+                    timestamp += (timestamp_offset - timestamp) & 0x1f
+                elif definition.timestamp is not None:
+                    unpack, offset = definition.timestamp
+                    timestamp = unpack.unpack_from(buffer, position + 1 + offset)[0]
+                definition.offsets.append(position + 1)
+                definition.timestamps.append(timestamp)
+                if len(definition.timestamps) >= batch_size:
+                    self._gather(definition, buffer)
+                    self._flush(definition, batches)
+                remaining -= length
+                position += length
+        finally:
+            self._remaining = remaining
+            self._timestamp = timestamp
+
+        if remaining == 0:
+            self._state = self._read_crc
+        return position
+
+    def _read_crc(self, buffer, position, batches):
+        if len(buffer) - position < 2:
+            return position
+        # The CRC over the file including its CRC is 0
+        self._update_crc(buffer, position + 2)
+        if self._check_crc and self._crc.get_value() != 0:
+            raise FitException("FIT file CRC mismatch")
+        self._crc = Crc16()
+
+        for local, definition in enumerate(self._definitions):
+            if definition is not None:
+                self._gather(definition, buffer)
+                self._flush(definition, batches)
+                self._definitions[local] = None
+        self._files += 1
+        self._state = self._read_header
+        return position + 2
+
+    def _define(self, header, buffer, position, batches):
+        """Read a definition message, returns its length or 0 if incomplete."""
+        available = len(buffer) - position
+        if available < 6:
+            return 0
+        count = buffer[position + 5]
+        length = 6 + 3 * count
+        developer = header & 0x20
+        if developer:
+            if available < length + 1:
+                return 0
+            length += 1 + 3 * buffer[position + length]
+        if available < length:
+            return 0
+
+        big_endian = buffer[position + 2] == 1
+        global_number = struct.unpack_from(">H" if big_endian else "<H", buffer, position + 3)[0]
+        start = position + 6
+        fields = [tuple(buffer[start + 3 * i:start + 3 * i + 3]) for i in range(count)]
+        developer_fields = []
+        if developer:
+            start += 3 * count
+            developer_fields = [tuple(buffer[start + 1 + 3 * i:start + 4 + 3 * i])
+                                for i in range(buffer[start])]
+
+        local = header & 0x0f
+        previous = self._definitions[local]
+        if previous is not None:
+            self._gather(previous, buffer)
+            self._flush(previous, batches)
+        self._definitions[local] = _Definition(global_number, big_endian, fields, developer_fields)
+        return length
+
+    def _gather(self, definition, buffer):
+        if not definition.offsets:
+            return
+        offsets = numpy.array(definition.offsets, dtype=numpy.intp)
+        source = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        definition.data += source[offsets[:, None] + definition.columns].tobytes()
+        self._records += len(offsets)
+        definition.offsets = array.array('l')
+
+    def _flush(self, definition, batches):
+        if not definition.timestamps:
+            return
+        records = numpy.frombuffer(bytes(definition.data), dtype=definition.dtype)
+        timestamps = numpy.array(definition.timestamps, dtype=numpy.uint32)
+        batches.append(RecordBatch(definition.global_number, records, timestamps))
+        definition.data = bytearray()
+        definition.timestamps = array.array('I')
+
+
+def decode(source, chunk_size=65536, batch_size=4096, check_crc=True):
+    """
+    Decode a FIT file, yielding :class:`RecordBatch` es. *source* is a
+    file object or a buffer (bytes, array, mmap), read in chunks of
+    *chunk_size*.
+    """
+    decoder = FitDecoder(batch_size, check_crc)
+    try:
+        view = memoryview(source)
+    except TypeError:
+        view = None
+
+    if view is not None:
+        for offset in range(0, len(view), chunk_size):
+            for batch in decoder.feed(view[offset:offset + chunk_size]):
+                yield batch
+    else:
+        chunk = source.read(chunk_size)
+        while chunk:
+            for batch in decoder.feed(chunk):
+                yield batch
+            chunk = source.read(chunk_size)
+    for batch in decoder.close():
+        yield batch
@@ -26,6 +26,7 @@ import array
 import datetime
 import logging
 import threading
+import time
 
 try:
     # Python 3
@@ -43,9 +44,10 @@ from ant.fs.command import (LinkCommand, DownloadRequest, DownloadResponse,
                             AuthenticateCommand, AuthenticateResponse, DisconnectCommand,
                             UploadRequest, UploadResponse, UploadDataCommand, UploadDataResponse,
                             EraseRequestCommand, EraseResponse)
-from ant.fs.commandpipe import CreateFile, Response, Time, TimeResponse
-from ant.fs.file import Directory
-from ant.fs.commons import crc
+from ant.fs.commandpipe import CreateFile, Response, Sequence, Time, TimeResponse
+from ant.fs.file import Directory, DirectoryView
+from ant.fs.commons import crc, Crc16
+from ant.fs.sink import ArraySink
 
 _logger = logging.getLogger("ant.fs.manager")
 
@@ -92,38 +94,111 @@ class AntFSTimeException(AntFSException):
     def __init__(self, error, errno=None):
         AntFSException.__init__(self, error, errno)
 
-class Application:
-    _serial_number = 1337
-    _frequency = 19  # 0 to 124, x - 2400 (in MHz)
+NETWORK_KEY = [0xa8, 0xa4, 0x23, 0xb9, 0xf5, 0x5e, 0x63, 0xc1]
+
+
+class SessionStatistics(object):
+    """Bytes transferred by a session and when it ran."""
 
     def __init__(self):
+        self.downloaded = 0
+        self.uploaded = 0
+        self.started = None
+        self.authenticated = None  # Time the transport layer was reached
+        self.authentication = None  # "serial", "passkey" or "pairing"
+        self.stopped = None
+
+    def get_bytes(self):
+        return self.downloaded + self.uploaded
+
+    def get_duration(self):
+        if self.started is None:
+            return 0.0
+        return (self.stopped if self.stopped is not None else time.time()) - self.started
+
+    def get_time_to_transport(self):
+        """Seconds from the start of the session to the transport layer, None if not reached."""
+        if self.started is None or self.authenticated is None:
+            return None
+        return self.authenticated - self.started
+
+    def get_throughput(self):
+        """Bytes/s over the duration of the session."""
+        duration = self.get_duration()
+        return self.get_bytes() / duration if duration > 0 else 0.0
+
+
+class AdaptiveTimeout(object):
+    """
+    Response timeout derived from the measured round trip times, like the
+    TCP retransmission timeout (RFC 6298): srtt + 4 * rttvar, doubled after
+    every timeout and clamped to [minimum, maximum] seconds.
+    """
+
+    def __init__(self, initial=15.0, minimum=2.0, maximum=30.0):
+        self._minimum = minimum
+        self._maximum = maximum
+        self._timeout = initial
+        self._srtt = None
+        self._rttvar = None
+
+    def get(self):
+        return self._timeout
+
+    def update(self, rtt):
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - rtt)
+            self._srtt = 0.875 * self._srtt + 0.125 * rtt
+        self._timeout = min(self._maximum, max(self._minimum, self._srtt + 4 * self._rttvar))
 
-        self._queue = queue.Queue()
-        self._beacons = queue.Queue()
+    def backoff(self):
+        self._timeout = min(self._maximum, self._timeout * 2)
 
-        self._node = Node()
 
-        try:
-            NETWORK_KEY = [0xa8, 0xa4, 0x23, 0xb9, 0xf5, 0x5e, 0x63, 0xc1]
-            self._node.set_network_key(0x00, NETWORK_KEY)
+class Application:
+    _serial_number = 1337
+    _frequency = 19  # 0 to 124, x - 2400 (in MHz)
+    _crc_retries = 3  # Re-requests of a block that failed the CRC check
+    _download_retries = 5  # Consecutive timeouts before a download is given up
+    _copy_size = 65536  # Chunk size when copying between cache and sink
+    _upload_retries = 3  # Rejected upload blocks before an upload is given up
+    _upload_consecutive = False  # Send upload data without a request per block, see set_consecutive_upload
+    _directory_filter = None  # Device supports DirectoryFilter, None until tried
+
+    def __init__(self, node=None):
+        """
+        Without *node* the application opens its own node (stick). With a
+        shared *node* it only takes a channel from it, the owner of the node
+        sets the network key and runs it, see
+        :class:`ant.fs.session.SessionManager`.
+        """
+        self._init_session()
 
-            print("Request basic information...")
+        self._owns_node = node is None
+        self._node = Node() if node is None else node
+        self._channel = None
 
-            m = self._node.request_message(Message.ID.RESPONSE_CAPABILITIES)
-            print("  Capabilities: ", m[2])
+        try:
+            if self._owns_node:
+                self._node.set_network_key(0x00, NETWORK_KEY)
+
+                print("Request basic information...")
 
-            # m = self._node.request_message(Message.ID.RESPONSE_ANT_VERSION)
-            # print "  ANT version:  ", struct.unpack("<10sx", m[2])[0]
+                m = self._node.request_message(Message.ID.RESPONSE_CAPABILITIES)
+                print("  Capabilities: ", m[2])
 
-            #m = self._node.request_message(Message.ID.RESPONSE_SERIAL_NUMBER)
-            #print "  Serial number:", struct.unpack("<I", m[2])[0]
+                # m = self._node.request_message(Message.ID.RESPONSE_ANT_VERSION)
+                # print "  ANT version:  ", struct.unpack("<10sx", m[2])[0]
 
-            print("Starting system...")
+                #m = self._node.request_message(Message.ID.RESPONSE_SERIAL_NUMBER)
+                #print "  Serial number:", struct.unpack("<I", m[2])[0]
 
-            #NETWORK_KEY= [0xa8, 0xa4, 0x23, 0xb9, 0xf5, 0x5e, 0x63, 0xc1]
-            #self._node.set_network_key(0x00, NETWORK_KEY)
+                print("Starting system...")
 
-            print("Key done...")
+                print("Key done...")
 
             self._channel = self._node.new_channel(Channel.Type.BIDIRECTIONAL_RECEIVE)
             self._channel.on_broadcast_data = self._on_data
@@ -131,16 +206,32 @@ class Application:
 
             self.setup_channel(self._channel)
 
-            self._worker_thread = threading.Thread(target=self._worker, name="ant.fs")
-            self._worker_thread.start()
+            if self._owns_node:
+                self._worker_thread = threading.Thread(target=self._worker, name="ant.fs")
+                self._worker_thread.start()
         except Exception as e:
             self.stop()
             raise e
 
+    def _init_session(self):
+        self._download_cache = None
+        self._passkey_store = None
+        self._client_serial = None
+        self._timeout = AdaptiveTimeout()
+        self._sequence = Sequence()
+        self._statistics = SessionStatistics()
+
+        self._queue = queue.Queue()
+        self._beacons = queue.Queue()
+
     def _worker(self):
         self._node.start()
 
+    def get_statistics(self):
+        return self._statistics
+
     def _main(self):
+        self._statistics.started = time.time()
         try:
             _logger.debug("Link level")
             beacon = self._get_beacon()
@@ -150,13 +241,17 @@ class Application:
                     if beacon.get_client_device_state() == Beacon.ClientDeviceState.AUTHENTICATION:
                         _logger.debug("Auth layer")
                         if self.on_authentication(beacon):
-                            _logger.debug("Authenticated")
+                            self._statistics.authenticated = time.time()
+                            _logger.info("Transport after %.2fs (%s)",
+                                         self._statistics.get_time_to_transport(),
+                                         self._statistics.authentication)
                             beacon = self._get_beacon()
                             self.on_transport(beacon)
                         self.disconnect()
                         break
         finally:
             _logger.debug("Run 5")
+            self._statistics.stopped = time.time()
             self.stop()
 
     def _on_beacon(self, data):
@@ -217,11 +312,16 @@ class Application:
         self._main()
 
     def stop(self):
-        self._node.stop()
+        if self._owns_node:
+            self._node.stop()
+        elif self._channel is not None:
+            self._node.release_channel(self._channel)
+            self._channel = None
 
-    def _send_commandpipe(self, data):
-        # print "send commandpipe", data
-        self.upload(0xfffe, data)
+    def _send_commandpipe(self, command):
+        # print "send commandpipe", command
+        command.set_sequence(self._sequence.get_next())
+        self.upload(0xfffe, command.get())
 
     def _get_commandpipe(self):
         # print "get commandpipe"
@@ -230,7 +330,7 @@ class Application:
     def create(self, typ, data, callback=None):
         # print "create", typ
         request = CreateFile(len(data), 0x80, [typ, 0x00, 0x00], [0x00, 0xff, 0xff])
-        self._send_commandpipe(request.get())
+        self._send_commandpipe(request)
         result = self._get_commandpipe()
         # result._debug()
 
@@ -248,94 +348,240 @@ class Application:
         self.upload(result.get_index(), data, callback)
         return result.get_index()
 
-    def upload(self, index, data, callback=None):
-        # print "upload", index, len(data)
+    def upload(self, index, data, callback=None, progress=None):
+        """
+        Upload *data* to file *index*. Blocks are memoryview slices of
+        *data* of the block size granted by the device, each one preceded
+        by an upload request, or sent back to back with the CRC carried
+        over from block to block if enabled with
+        :meth:`set_consecutive_upload`. If the device rejects a block, the
+        upload is requested again and continues from the last offset the
+        device confirmed.
+        """
+        if not isinstance(data, (bytes, bytearray, array.array, memoryview)):
+            data = array.array('B', data)
+        view = memoryview(data)
+        size = len(view)
 
-        iteration = 0
+        failures = 0
+        request_offset = 0
         while True:
-
-            # Request Upload
+            self._send_command(UploadRequest(index, size, request_offset))
+            upload_response = self._get_command()
+            if upload_response.get_response() != UploadResponse.Response.OK:
+                raise AntFSUploadException("Upload request failed",
+                                           upload_response.get_response())
 
             # Continue using Last Data Offset (special MAX_ULONG value)
-            request_offset = 0 if iteration == 0 else 0xffffffff
-            self._send_command(UploadRequest(index, len(data), request_offset))
+            request_offset = 0xffffffff
+            offset = upload_response.get_last_data_offset()
+            max_block = upload_response.get_maximum_block_size()
+            crc_seed = upload_response.get_crc()
+            if progress is not None and failures == 0 and offset == 0:
+                progress.start(offset, size)
+
+            blocks = 0
+            while True:
+                data_packet = view[offset:offset + max_block]
+                crc_val = crc(data_packet, crc_seed)
+                self._send_command(UploadDataCommand(crc_seed, offset, data_packet, crc_val))
+                try:
+                    response = self._get_command().get_response()
+                except queue.Empty:
+                    # Consecutive data is not defined by ANT-FS, a device may just ignore it
+                    if blocks == 0 or not self._upload_consecutive:
+                        raise
+                    response = None
+                if response != UploadDataResponse.Response.OK:
+                    break
+
+                blocks += 1
+                offset += len(data_packet)
+                self._statistics.uploaded += len(data_packet)
+                crc_seed = crc_val
+                if callback is not None and size != 0:
+                    callback(offset / size)
+                if progress is not None:
+                    progress.update(offset, size)
+                if offset >= size:
+                    return
+                if not self._upload_consecutive:
+                    break
+
+            if response == UploadDataResponse.Response.OK:
+                continue
+            if blocks > 0 and self._upload_consecutive:
+                _logger.info("Upload %d, device does not take consecutive data, request every block", index)
+                self._upload_consecutive = False
+                continue
+            failures += 1
+            _logger.warning("Upload %d, block at offset %d failed (%d)", index, offset, failures)
+            if failures > self._upload_retries:
+                raise AntFSUploadException("Upload data failed", response)
+
+    def set_consecutive_upload(self, consecutive):
+        """
+        Send upload data back to back, without an upload request per block.
+        This is not part of ANT-FS: a device that rejects or ignores a
+        consecutive block makes the upload fall back to one request per
+        block.
+        """
+        self._upload_consecutive = consecutive
 
-            upload_response = self._get_command()
-            # upload_response._debug()
+    def set_download_cache(self, cache):
+        """
+        Store downloads in *cache* (a :class:`ant.fs.cache.DownloadCache`),
+        see :meth:`download`.
+        """
+        self._download_cache = cache
 
-            if upload_response._get_argument("response") != UploadResponse.Response.OK:
-                raise AntFSUploadException("Upload request failed",
-                                           upload_response._get_argument("response"))
-
-            # Upload data
-            offset = upload_response._get_argument("last_data_offset")
-            max_block = upload_response._get_argument("maximum_block_size")
-            # print " uploading", offset, "to", offset + max_block
-            data_packet = data[offset:offset + max_block]
-            crc_seed = upload_response._get_argument("crc")
-            crc_val = crc(data_packet, upload_response._get_argument("crc"))
-
-            # Pad with 0 to even 8 bytes
-            missing_bytes = 8 - (len(data_packet) % 8)
-            if missing_bytes != 8:
-                data_packet.extend(array.array('B', [0] * missing_bytes))
-                # print " adding", str(missing_bytes), "padding"
-
-            # print " packet", len(data_packet)
-            # print " crc   ", crc_val, "from seed", crc_seed
-
-            self._send_command(UploadDataCommand(crc_seed, offset, data_packet, crc_val))
-            upload_data_response = self._get_command()
-            # upload_data_response._debug()
-            if upload_data_response._get_argument("response") != UploadDataResponse.Response.OK:
-                raise AntFSUploadException("Upload data failed",
-                                           upload_data_response._get_argument("response"))
-
-            if callback is not None and len(data) != 0:
-                callback((offset + len(data_packet)) / len(data))
-
-            if offset + len(data_packet) >= len(data):
-                # print " done"
-                break
-
-            # print " one more"
-            iteration += 1
-
-    def download(self, index, callback=None):
-        offset = 0
-        initial = True
-        crc = 0
-        data = array.array('B')
-        while True:
-            _logger.debug("Download %d, o%d, c%d", index, offset, crc)
-            self._send_command(DownloadRequest(index, offset, True, crc))
-            _logger.debug("Wait for response...")
-            try:
-                response = self._get_command()
-                if response._get_argument("response") == DownloadResponse.Response.OK:
-                    remaining = response._get_argument("remaining")
-                    offset = response._get_argument("offset")
-                    total = offset + remaining
-                    data[offset:total] = response._get_argument("data")[:remaining]
-                    # print "rem", remaining, "offset", offset, "total", total, "size", response._get_argument("size")
-                    # TODO: check CRC
-
-                    if callback is not None and response._get_argument("size") != 0:
-                        callback(total / response._get_argument("size"))
-                    if total == response._get_argument("size"):
-                        return data
-                    crc = response._get_argument("crc")
-                    offset = total
-                else:
+    def set_passkey_store(self, store):
+        """
+        Keep the passkeys of paired devices in *store* (a
+        :class:`ant.fs.passkey.PasskeyStore`), see :meth:`authenticate`.
+        """
+        self._passkey_store = store
+
+    def get_client_serial(self):
+        return self._client_serial
+
+    def download(self, index, callback=None, file=None, sink=None, progress=None):
+        """
+        Download file *index*. If a download cache is set and the directory
+        entry *file* is given, every verified block is stored in the cache
+        and an interrupted or repeated download resumes from the last good
+        offset.
+
+        Verified blocks are written at their offset to *sink* (see
+        :mod:`ant.fs.sink`), which is returned. Without a sink the file is
+        collected and returned as an array. *callback* is called with the
+        downloaded fraction, *progress* (:class:`ant.fs.sink.Progress`) is
+        updated with the downloaded bytes.
+        """
+        collect = sink is None
+        if collect:
+            sink = ArraySink()
+
+        cached = None
+        if self._download_cache is not None and file is not None and self._client_serial is not None:
+            cached = self._download_cache.open(self._client_serial, index,
+                                               file.get_size(), file.get_date())
+
+        if cached is not None and cached.get_offset() > 0:
+            offset = cached.get_offset()
+            running = Crc16(cached.get_crc(), offset)
+            _logger.debug("Download %d, resume at %d of %d", index, offset, cached.get_size())
+            sink.open(cached.get_size())
+            for position in range(0, offset, self._copy_size):
+                sink.write(position, cached.read(position, min(self._copy_size, offset - position)))
+        else:
+            offset = 0
+            running = Crc16()
+
+        if progress is not None:
+            progress.start(offset, file.get_size() if file is not None else 0)
+
+        size = None
+        crc_errors = 0
+        timeouts = 0
+        # Blocks cached but not yet recorded are recorded however the download ends
+        try:
+            # A completed cache entry is served without any request
+            while cached is None or not cached.is_complete():
+                _logger.debug("Download %d, o%d, c%d", index, offset, running.get_value())
+                self._send_command(DownloadRequest(index, offset, True, running.get_value()))
+                sent = time.time()
+                _logger.debug("Wait for response...")
+                try:
+                    response = self._get_command(self._timeout.get())
+                except queue.Empty:
+                    timeouts += 1
+                    self._timeout.backoff()
+                    _logger.debug("Download %d timeout (%d), next timeout %.1fs",
+                                  index, timeouts, self._timeout.get())
+                    if timeouts > self._download_retries:
+                        raise AntFSDownloadException("Download timed out")
+                    continue
+
+                self._timeout.update(time.time() - sent)
+                timeouts = 0
+
+                if response.get_response() != DownloadResponse.Response.OK:
                     raise AntFSDownloadException("Download request failed: ",
-                                                 response._get_argument("response"))
-            except queue.Empty:
-                _logger.debug("Download %d timeout", index)
-                # print "recover from download failure"
+                                                 response.get_response())
+
+                remaining = response.get_remaining()
+                offset = response.get_offset()
+                total = offset + remaining
+                block = response.get_data()[:remaining]
+                if size != response.get_size():
+                    size = response.get_size()
+                    sink.open(size)
+
+                # The CRC covers the file from the start to the end of this block
+                if offset != running.get_length():
+                    running = Crc16()
+                    for position in range(0, offset, self._copy_size):
+                        running.update(sink.read(position, min(self._copy_size, offset - position)))
+                block_crc = crc(block, running.get_value())
+                if block_crc != response.get_crc():
+                    crc_errors += 1
+                    _logger.warning("Download %d, CRC mismatch at offset %d (%#06x != %#06x)",
+                                    index, offset, block_crc, response.get_crc())
+                    if crc_errors > self._crc_retries:
+                        raise AntFSDownloadException("Download CRC mismatch",
+                                                     DownloadResponse.Response.INCORRECT_CRC)
+                    continue
+
+                sink.write(offset, block)
+                running.update(block)
+                self._statistics.downloaded += len(block)
+                crc_errors = 0
+                if cached is not None:
+                    cached.write(offset, block, running.get_value())
+
+                if callback is not None and size != 0:
+                    callback(total / size)
+                if progress is not None:
+                    progress.update(total, size)
+                if total == size:
+                    break
+                offset = total
+        finally:
+            if cached is not None:
+                cached.flush()
 
-    def download_directory(self, callback=None):
-        data = self.download(0, callback)
-        return Directory.parse(data)
+        sink.close()
+        return sink.get_data() if collect else sink
+
+    def download_directory(self, callback=None, filter=None):
+        """
+        Download and parse the directory. With a
+        :class:`ant.fs.commandpipe.DirectoryFilter` the device is first asked
+        to leave out the entries that do not match. Devices without filter
+        support send the full directory, which is then filtered here.
+        """
+        if filter is not None and self._directory_filter is not False:
+            try:
+                self._send_commandpipe(filter)
+                response = self._get_commandpipe().get_response()
+            except (AntFSException, queue.Empty) as e:
+                _logger.debug("Directory filter failed, %r", e)
+                response = None
+            self._directory_filter = response == Response.Response.OK
+            if not self._directory_filter:
+                _logger.info("Directory filter not supported (%s), filter locally", response)
+
+        directory = Directory.parse(self.download(0, callback))
+        if filter is not None:
+            directory = Directory(directory.get_version(), directory.get_time_format(),
+                                  directory.get_current_system_time(), directory.get_last_modified(),
+                                  [f for f in directory.get_files() if filter.matches(f)])
+        return directory
+
+    def download_directory_view(self, callback=None):
+        """The directory as a columnar :class:`ant.fs.file.DirectoryView`."""
+        return DirectoryView.parse(self.download(0, callback))
 
     def set_time(self, time=datetime.datetime.utcnow()):
         """
@@ -344,7 +590,7 @@ class Application:
         utc_tai_diff_seconds = 35
         offset = time - datetime.datetime(1989, 12, 31, 0, 0, 0)
         t = Time(int(offset.total_seconds()) + utc_tai_diff_seconds, 0xffffffff, 0)
-        self._send_commandpipe(t.get())
+        self._send_commandpipe(t)
 
         result = self._get_commandpipe()
 
@@ -355,9 +601,9 @@ class Application:
         self._send_command(EraseRequestCommand(index))
         response = self._get_command()
 
-        if response._get_argument("response") != EraseResponse.Response.ERASE_SUCCESSFUL:
+        if response.get_response() != EraseResponse.Response.ERASE_SUCCESSFUL:
             raise AntFSDownloadException("Erase request failed: ",
-                                         response._get_argument("response"))
+                                         response.get_response())
 
     def link(self):
         self._channel.request_message(Message.ID.RESPONSE_CHANNEL_ID)
@@ -373,6 +619,8 @@ class Application:
             AuthenticateCommand.Request.SERIAL,
             self._serial_number))
         response = self._get_command()
+        self._client_serial = response.get_serial()
+        self._statistics.authentication = "serial"
         return (response.get_serial(), response.get_data_string())
 
     def authentication_passkey(self, passkey):
@@ -381,11 +629,13 @@ class Application:
             self._serial_number, passkey))
 
         response = self._get_command()
-        if response._get_argument("type") == AuthenticateResponse.Response.ACCEPT:
+        if response.get_type() == AuthenticateResponse.Response.ACCEPT:
+            self._client_serial = response.get_serial()
+            self._statistics.authentication = "passkey"
             return response.get_data_array()
         else:
             raise AntFSAuthenticationException("Passkey authentication failed",
-                                               response._get_argument("type"))
+                                               response.get_type())
 
     def authentication_pair(self, friendly_name):
         data = array.array('B', map(ord, list(friendly_name)))
@@ -394,11 +644,34 @@ class Application:
             self._serial_number, data))
 
         response = self._get_command(30)
-        if response._get_argument("type") == AuthenticateResponse.Response.ACCEPT:
+        if response.get_type() == AuthenticateResponse.Response.ACCEPT:
+            self._client_serial = response.get_serial()
+            self._statistics.authentication = "pairing"
             return response.get_data_array()
         else:
             raise AntFSAuthenticationException("Pair authentication failed",
-                                               response._get_argument("type"))
+                                               response.get_type())
+
+    def authenticate(self, friendly_name):
+        """
+        Authenticate with the passkey stored for the client, pair only if
+        there is none or the client rejects it. The passkey received when
+        pairing is stored, see :meth:`set_passkey_store`.
+        """
+        serial, _ = self.authentication_serial()
+        store = self._passkey_store
+        passkey = store.get(serial) if store is not None else None
+        if passkey is not None:
+            try:
+                return self.authentication_passkey(passkey)
+            except AntFSAuthenticationException as e:
+                _logger.info("Passkey of %d rejected, pair again, %s", serial, e.get_error())
+                store.remove(serial)
+
+        passkey = self.authentication_pair(friendly_name)
+        if store is not None and len(passkey) > 0:
+            store.set(serial, passkey)
+        return passkey
 
     def disconnect(self):
         d = DisconnectCommand(DisconnectCommand.Type.RETURN_LINK, 0, 0)
@@ -0,0 +1,83 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+import binascii
+import json
+import logging
+import os
+
+from ant.fs.commons import replace_file
+
+_logger = logging.getLogger("ant.fs.passkey")
+
+
+class PasskeyStore(object):
+    """
+    Passkeys handed out by paired devices, stored as JSON: client serial
+    -> passkey (hex). Every change is written out right away, a passkey is
+    only ever received once per pairing.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._passkeys = {}
+        try:
+            with open(self._path) as f:
+                self._passkeys = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def get_path(self):
+        return self._path
+
+    def get_serials(self):
+        return sorted(int(serial) for serial in self._passkeys)
+
+    def get(self, serial):
+        """The passkey of the device *serial* as a bytearray, None if not paired."""
+        passkey = self._passkeys.get(str(serial))
+        if passkey is None:
+            return None
+        return bytearray(binascii.unhexlify(passkey))
+
+    def set(self, serial, passkey):
+        self._passkeys[str(serial)] = binascii.hexlify(bytearray(passkey)).decode("ascii")
+        self._save()
+
+    def remove(self, serial):
+        if self._passkeys.pop(str(serial), None) is not None:
+            self._save()
+
+    def _save(self):
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Passkeys grant access to the device, keep them readable by the owner only
+        temporary = self._path + ".tmp"
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._passkeys, f, sort_keys=True)
+        replace_file(temporary, self._path)
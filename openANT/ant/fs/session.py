@@ -0,0 +1,128 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from __future__ import absolute_import, print_function
+
+import logging
+import threading
+
+from ant.easy.node import Node
+from ant.fs.manager import NETWORK_KEY, SessionStatistics
+
+_logger = logging.getLogger("ant.fs.session")
+
+
+class SessionManager(object):
+    """
+    Runs several ANT-FS sessions at once. Every session is an
+    :class:`ant.fs.manager.Application` on its own channel of a shared
+    node, with its own beacon and command queues. With several *nodes*
+    (sticks) a new session goes to the node with the most free channels.
+    """
+
+    def __init__(self, nodes=None):
+        self._owns_nodes = nodes is None
+        self._nodes = [Node()] if nodes is None else list(nodes)
+        self._sessions = []
+        self._threads = []
+        self._errors = {}
+        self._lock = threading.Lock()
+
+        self._node_threads = []
+        if self._owns_nodes:
+            for node in self._nodes:
+                node.set_network_key(0x00, NETWORK_KEY)
+                thread = threading.Thread(target=node.start, name="ant.fs.node")
+                thread.start()
+                self._node_threads.append(thread)
+
+    def get_nodes(self):
+        return self._nodes
+
+    def get_sessions(self):
+        return self._sessions
+
+    def get_errors(self):
+        """Exceptions that ended sessions, by session."""
+        with self._lock:
+            return dict(self._errors)
+
+    def _select_node(self):
+        return max(self._nodes, key=lambda node: len(node.allocator.get_free()))
+
+    def add(self, factory, *args, **kwargs):
+        """
+        Create a session with ``factory(*args, node=node, **kwargs)``,
+        usually an Application subclass, on the least busy node.
+        """
+        session = factory(*args, node=self._select_node(), **kwargs)
+        self._sessions.append(session)
+        return session
+
+    def _run(self, session):
+        try:
+            session.start()
+        except Exception as e:
+            _logger.exception("Session %r failed", session)
+            with self._lock:
+                self._errors[session] = e
+
+    def start(self):
+        for session in self._sessions[len(self._threads):]:
+            thread = threading.Thread(target=self._run, args=(session,), name="ant.fs.session")
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run(self):
+        """Run all added sessions and wait for them to finish."""
+        self.start()
+        self.join()
+        statistics = self.get_statistics()
+        _logger.info("%d sessions, %d bytes in %.1f s, %.0f bytes/s", len(self._sessions),
+                     statistics.get_bytes(), statistics.get_duration(), statistics.get_throughput())
+        return statistics
+
+    def get_statistics(self):
+        """
+        Aggregate of the session statistics, the duration spans from the
+        first session start to the last session stop.
+        """
+        total = SessionStatistics()
+        for session in self._sessions:
+            statistics = session.get_statistics()
+            total.downloaded += statistics.downloaded
+            total.uploaded += statistics.uploaded
+            if statistics.started is not None:
+                total.started = statistics.started if total.started is None else min(total.started, statistics.started)
+            if statistics.stopped is not None:
+                total.stopped = statistics.stopped if total.stopped is None else max(total.stopped, statistics.stopped)
+        return total
+
+    def stop(self):
+        if self._owns_nodes:
+            for node in self._nodes:
+                node.stop()
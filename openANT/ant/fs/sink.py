@@ -0,0 +1,192 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from __future__ import absolute_import, print_function, division
+
+import array
+import logging
+import mmap
+import time
+
+_logger = logging.getLogger("ant.fs.sink")
+
+
+class ArraySink(object):
+    """
+    Collects a download in memory. The array is allocated once, when the
+    file size is known, instead of growing with every block.
+    """
+
+    def __init__(self):
+        self._data = array.array('B')
+
+    def open(self, size):
+        if len(self._data) != size:
+            self._data = array.array('B', [0]) * size
+
+    def write(self, offset, block):
+        self._data[offset:offset + len(block)] = array.array('B', block)
+
+    def read(self, offset, length):
+        return self._data[offset:offset + length]
+
+    def close(self):
+        pass
+
+    def get_data(self):
+        return self._data
+
+
+class FileSink(object):
+    """
+    Writes a download to a file object (opened in binary mode) or path.
+    Only the block being written is held in memory.
+    """
+
+    def __init__(self, file):
+        self._owned = not hasattr(file, "write")
+        self._file = open(file, "w+b") if self._owned else file
+
+    def open(self, size):
+        self._file.truncate(size)
+
+    def write(self, offset, block):
+        self._file.seek(offset)
+        self._file.write(bytearray(block))
+
+    def read(self, offset, length):
+        self._file.seek(offset)
+        return array.array('B', self._file.read(length))
+
+    def close(self):
+        self._file.flush()
+        if self._owned:
+            self._file.close()
+
+    def get_file(self):
+        return self._file
+
+
+class MmapSink(object):
+    """
+    Writes a download into a memory mapped file at *path*, sized to the
+    file once known. Pages are flushed by the OS, nothing is buffered.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._file = open(path, "w+b")
+        self._map = None
+
+    def open(self, size):
+        if self._map is not None:
+            if len(self._map) == size:
+                return
+            self._map.close()
+            self._map = None
+        self._file.truncate(size)
+        # A zero length file can not be mapped
+        if size > 0:
+            self._map = mmap.mmap(self._file.fileno(), size)
+
+    def write(self, offset, block):
+        self._map[offset:offset + len(block)] = bytes(bytearray(block))
+
+    def read(self, offset, length):
+        return array.array('B', self._map[offset:offset + length])
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def get_path(self):
+        return self._path
+
+
+class Progress(object):
+    """
+    Download progress in bytes and bytes/s. *callback* is called with the
+    progress object after every block.
+    """
+
+    _alpha = 0.25  # Weight of the latest block in the smoothed rate
+
+    def __init__(self, callback=None):
+        self._callback = callback
+        self._start = None
+        self._last = None
+        self._bytes = 0
+        self._total = 0
+        self._received = 0
+        self._rate = 0.0
+
+    def start(self, offset, total):
+        self._start = self._last = time.time()
+        self._bytes = offset
+        self._total = total
+        self._received = 0
+
+    def update(self, offset, total):
+        now = time.time()
+        if self._start is None:
+            self.start(0, total)
+        received = offset - self._bytes
+        elapsed = now - self._last
+        if elapsed > 0 and received > 0:
+            rate = received / elapsed
+            self._rate = rate if self._rate == 0.0 else self._alpha * rate + (1 - self._alpha) * self._rate
+        self._last = now
+        self._bytes = offset
+        self._total = total
+        self._received += max(received, 0)
+        if self._callback is not None:
+            self._callback(self)
+
+    def get_bytes(self):
+        return self._bytes
+
+    def get_total(self):
+        return self._total
+
+    def get_fraction(self):
+        return self._bytes / self._total if self._total else 1.0
+
+    def get_elapsed(self):
+        return 0.0 if self._start is None else self._last - self._start
+
+    def get_rate(self):
+        """Smoothed transfer rate in bytes/s."""
+        return self._rate
+
+    def get_average_rate(self):
+        """Bytes received in this session per second."""
+        elapsed = self.get_elapsed()
+        return self._received / elapsed if elapsed > 0 else 0.0
+
+    def get_eta(self):
+        if self._rate == 0.0:
+            return None
+        return (self._total - self._bytes) / self._rate
@@ -0,0 +1,191 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from __future__ import absolute_import, print_function
+
+import datetime
+import json
+import logging
+import os
+
+from ant.fs.commons import replace_file
+from ant.fs.manager import AntFSException
+
+_logger = logging.getLogger("ant.fs.sync")
+
+
+class Manifest(object):
+    """
+    Local record of the files fetched from one device, stored as JSON:
+    index -> size, date, type and flags of the directory entry at the time
+    it was downloaded.
+    """
+
+    # The device may set the archive flag once a file has been downloaded,
+    # that alone does not change the content
+    _FLAGS_MASK = 0b11101111
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = {}
+        try:
+            with open(self._path) as f:
+                self._entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def get_path(self):
+        return self._path
+
+    def get_indexes(self):
+        return sorted(int(index) for index in self._entries)
+
+    def get(self, index):
+        return self._entries.get(str(index))
+
+    @staticmethod
+    def _describe(file):
+        return {"size": file.get_size(),
+                "date": file.get_date().strftime("%Y%m%d%H%M%S"),
+                "type": file.get_type(),
+                "flags": file._flags & Manifest._FLAGS_MASK}
+
+    def is_current(self, file):
+        return self.get(file.get_index()) == self._describe(file)
+
+    def update(self, file):
+        self._entries[str(file.get_index())] = self._describe(file)
+
+    def remove(self, index):
+        self._entries.pop(str(index), None)
+
+    def save(self):
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary = self._path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self._entries, f, sort_keys=True)
+        replace_file(temporary, self._path)
+
+
+class SyncResult(object):
+    def __init__(self, directory, cache, serial):
+        self._directory = directory
+        self._cache = cache
+        self._serial = serial
+        self._downloaded = []
+        self._unchanged = []
+        self._removed = []
+
+    def get_directory(self):
+        return self._directory
+
+    def get_downloaded(self):
+        return self._downloaded
+
+    def get_unchanged(self):
+        return self._unchanged
+
+    def get_removed(self):
+        return self._removed
+
+    def read(self, file):
+        """Content of *file*, from the local content cache."""
+        return self._cache.open(self._serial, file.get_index(), file.get_size(),
+                                file.get_date()).read()
+
+
+class SyncEngine(object):
+    """
+    Incremental directory sync. The device directory is compared against
+    the manifest of the device, only new or changed files are downloaded,
+    unchanged files are served from the :class:`ant.fs.cache.DownloadCache`.
+    """
+
+    def __init__(self, application, cache):
+        self._application = application
+        self._cache = cache
+
+    def get_manifest(self, serial):
+        return Manifest(os.path.join(self._cache.get_directory(), str(serial), "manifest.json"))
+
+    def sync(self, select=None, callback=None):
+        """
+        Sync the readable files of the connected device. *select* is an
+        optional predicate on :class:`ant.fs.file.File`, *callback* is
+        called with the file and the downloaded fraction.
+        """
+        serial = self._application.get_client_serial()
+        if serial is None:
+            raise AntFSException("Sync requires an authenticated client")
+        self._application.set_download_cache(self._cache)
+
+        directory = self._application.download_directory()
+        manifest = self.get_manifest(serial)
+        result = SyncResult(directory, self._cache, serial)
+
+        present = set()
+        for file in directory.get_files():
+            present.add(file.get_index())
+            if not file.is_readable() or (select is not None and not select(file)):
+                continue
+            cached = self._cache.open(serial, file.get_index(), file.get_size(), file.get_date())
+            if manifest.is_current(file) and cached.is_complete():
+                result._unchanged.append(file)
+                continue
+
+            _logger.debug("Sync %d, %d bytes", file.get_index(), file.get_size())
+            # The cached previous version of a changed file is not needed any more
+            self._discard(serial, manifest, file.get_index(), file)
+            progress = None if callback is None else (lambda fraction, file=file: callback(file, fraction))
+            self._application.download(file.get_index(), progress, file)
+            manifest.update(file)
+            # Saved per file, an interrupted sync keeps what it fetched
+            manifest.save()
+            result._downloaded.append(file)
+
+        for index in manifest.get_indexes():
+            if index not in present:
+                self._discard(serial, manifest, index)
+                manifest.remove(index)
+                result._removed.append(index)
+        manifest.save()
+
+        _logger.info("Sync %s: %d downloaded, %d unchanged, %d removed", serial,
+                     len(result._downloaded), len(result._unchanged), len(result._removed))
+        return result
+
+    def _discard(self, serial, manifest, index, current=None):
+        """
+        Remove the cached download of the version of *index* recorded in
+        the manifest, unless it is the one of the directory entry *current*.
+        """
+        entry = manifest.get(index)
+        if entry is None:
+            return
+        date = datetime.datetime.strptime(entry["date"], "%Y%m%d%H%M%S")
+        if current is not None and self._cache.get_path(serial, index, entry["size"], date) == \
+                self._cache.get_path(serial, index, current.get_size(), current.get_date()):
+            return
+        self._cache.remove(serial, index, entry["size"], date)
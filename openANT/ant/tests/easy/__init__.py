@@ -22,4 +22,4 @@
 
 from __future__ import absolute_import, print_function
 
-__all__ = ['test']
+__all__ = ['test', 'test_allocator', 'test_bus', 'test_events', 'test_pipeline']
@@ -0,0 +1,138 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+import array
+import unittest
+
+from openANT.ant.base.message import Message
+from openANT.ant.easy.allocator import Capabilities, ChannelAllocator
+from openANT.ant.easy.channel import Channel
+from openANT.ant.easy.exception import AntException
+
+
+class FakeChannel(object):
+    def __init__(self, id, period, type=Channel.Type.BIDIRECTIONAL_TRANSMIT):
+        self.id = id
+        self._type = type
+        self._period = period
+        self._requested_period = period
+
+    def is_open(self):
+        return True
+
+    def get_type(self):
+        return self._type
+
+    def get_period(self):
+        return self._period
+
+    def get_requested_period(self):
+        return self._requested_period
+
+    def _set_period(self, period):
+        self._period = period
+
+
+class FakeNode(object):
+    def __init__(self, capabilities):
+        self.channels = {}
+        self.requests = 0
+        self._capabilities = capabilities
+
+    def request_message(self, messageId):
+        assert messageId == Message.ID.RESPONSE_CAPABILITIES
+        self.requests += 1
+        if self._capabilities is None:
+            raise AntException("Timed out while waiting for message")
+        return None, messageId, self._capabilities
+
+
+class CapabilitiesTest(unittest.TestCase):
+    def test_parse(self):
+        capabilities = Capabilities.parse(array.array('B', [8, 3, 0, 0xba, 0x36, 0x00, 0xdf, 0x04]))
+        self.assertEqual(capabilities.get_max_channels(), 8)
+        self.assertEqual(capabilities.get_max_networks(), 3)
+        self.assertEqual(capabilities.get_advanced_options(), (0xba, 0x36, 0xdf, 0x04))
+
+    def test_parse_short(self):
+        capabilities = Capabilities.parse(array.array('B', [4, 1, 0, 0]))
+        self.assertEqual(capabilities.get_max_channels(), 4)
+        self.assertEqual(capabilities.get_max_sensrcore_channels(), 0)
+
+
+class ChannelAllocatorTest(unittest.TestCase):
+    def test_allocate_and_reuse(self):
+        node = FakeNode(array.array('B', [2, 3, 0, 0]))
+        allocator = ChannelAllocator(node)
+
+        self.assertEqual(allocator.allocate(), 0)
+        self.assertEqual(allocator.allocate(), 1)
+        self.assertRaises(AntException, allocator.allocate)
+
+        allocator.release(0)
+        self.assertEqual(allocator.get_free(), [0])
+        self.assertEqual(allocator.allocate(), 0)
+
+        # Capabilities are only requested once
+        self.assertEqual(node.requests, 1)
+
+    def test_capabilities_fallback(self):
+        allocator = ChannelAllocator(FakeNode(None))
+        self.assertEqual(allocator.get_capabilities().get_max_channels(),
+                         Capabilities.DEFAULT_MAX_CHANNELS)
+
+    def test_rebalance(self):
+        node = FakeNode(array.array('B', [8, 3, 0, 0]))
+        node.channels = {0: FakeChannel(0, 655), 1: FakeChannel(1, 8192), 2: FakeChannel(2, 4096)}
+        allocator = ChannelAllocator(node, message_rate_budget=60.0)
+
+        # 50 Hz + 4 Hz + 8 Hz does not fit into 60 messages per second
+        periods = allocator.rebalance(pinned=(0,))
+        self.assertEqual(periods[0], 655)
+        self.assertAlmostEqual(periods[1] / float(periods[2]), 2.0, places=2)
+        self.assertLessEqual(sum(32768.0 / p for p in periods.values()), 60.01)
+
+        # Within budget again, requested periods are restored
+        allocator.message_rate_budget = 200.0
+        periods = allocator.rebalance()
+        self.assertEqual(periods, {0: 655, 1: 8192, 2: 4096})
+
+    def test_rebalance_receive(self):
+        node = FakeNode(array.array('B', [8, 3, 0, 0]))
+        node.channels = {0: FakeChannel(0, 655),
+                         1: FakeChannel(1, 8192, Channel.Type.BIDIRECTIONAL_RECEIVE),
+                         2: FakeChannel(2, 4096)}
+        allocator = ChannelAllocator(node, message_rate_budget=60.0)
+
+        # The receive channel listens to every second message of its master,
+        # the transmit channel takes the rest of the budget
+        periods = allocator.rebalance(pinned=(0,))
+        self.assertEqual(periods[1], 2 * 8192)
+        self.assertGreater(periods[2], 4096)
+        self.assertLessEqual(sum(32768.0 / p for p in periods.values()), 60.01)
+
+        # Never beyond the longest period
+        node.channels = {1: FakeChannel(1, 20000, Channel.Type.SHARED_BIDIRECTIONAL_RECEIVE)}
+        allocator.message_rate_budget = 0.1
+        self.assertEqual(allocator.rebalance(), {1: 60000})
@@ -0,0 +1,77 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+import array
+import unittest
+
+from openANT.ant.easy.bus import PageBus
+
+
+def page(*data):
+    return array.array('B', data)
+
+
+class PageBusTest(unittest.TestCase):
+    def setUp(self):
+        self.bus = PageBus()
+        self.received = []
+
+    def collect(self, name):
+        return lambda data, *args: self.received.append((name, data[0]) + args)
+
+    def test_pages(self):
+        self.bus.subscribe(self.collect("all"))
+        self.bus.subscribe(self.collect("battery"), pages=0x52)
+        self.bus.subscribe(self.collect("fast"), pages=(0xF2, 0xF3))
+
+        self.bus.publish(page(0x52, 0, 0, 0, 0, 0, 0, 0x0E))
+        self.bus.publish(page(0xF3, 1, 3, 0, 0, 15, 0, 0))
+        self.bus.publish(page(0x10, 0, 0, 0, 0, 0, 0, 0))
+
+        self.assertEqual(self.received, [("all", 0x52), ("battery", 0x52),
+                                         ("all", 0xF3), ("fast", 0xF3),
+                                         ("all", 0x10)])
+
+    def test_match(self):
+        self.bus.subscribe(self.collect("angle"), pages=0xF2, match={2: 0x03})
+        self.bus.subscribe(self.collect("torque"), pages=0xF2, match={2: (0x0B, 0x0F)})
+        self.bus.subscribe(self.collect("pair"), pages=0xF2, match={2: 0x03, 5: 0x0F})
+
+        self.bus.publish(page(0xF2, 1, 0x03, 0, 0, 0x0F, 0, 0))
+        self.bus.publish(page(0xF2, 2, 0x0F, 0, 0, 0x03, 0, 0))
+        self.bus.publish(page(0xF3, 3, 0x03, 0, 0, 0x0F, 0, 0))
+
+        self.assertEqual(self.received, [("angle", 0xF2), ("pair", 0xF2),
+                                         ("torque", 0xF2)])
+
+    def test_where_and_unsubscribe(self):
+        subscription = self.bus.subscribe(self.collect("odd"), pages=0xF2,
+                                          where=lambda data: data[1] % 2)
+        self.bus.publish(page(0xF2, 1, 0, 0, 0, 0, 0, 0), 4)
+        self.bus.publish(page(0xF2, 2, 0, 0, 0, 0, 0, 0), 4)
+        self.assertEqual(self.received, [("odd", 0xF2, 4)])
+
+        self.bus.unsubscribe(subscription)
+        self.bus.publish(page(0xF2, 3, 0, 0, 0, 0, 0, 0), 4)
+        self.assertEqual(len(self.received), 1)
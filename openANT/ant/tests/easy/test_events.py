@@ -0,0 +1,76 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+import threading
+import time
+import unittest
+
+from openANT.ant.base.message import Message
+from openANT.ant.easy.events import EventStore
+from openANT.ant.easy.exception import AntException, TransferFailedException
+
+
+class EventStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = EventStore(max_per_key=4, ttl=60.0)
+
+    def test_wait_by_channel(self):
+        self.store.put(0, 1, [Message.Code.EVENT_TX])
+        self.store.put(1, 1, [Message.Code.EVENT_CHANNEL_CLOSED])
+        self.store.put(0, 1, [Message.Code.EVENT_CHANNEL_CLOSED])
+
+        self.assertEqual(self.store.wait_for_event([Message.Code.EVENT_CHANNEL_CLOSED], 0),
+                         (0, 1, [Message.Code.EVENT_CHANNEL_CLOSED]))
+        self.assertEqual(self.store.wait_for_event([Message.Code.EVENT_CHANNEL_CLOSED])[0], 1)
+        self.assertEqual(len(self.store), 1)
+
+    def test_failure_before_match(self):
+        self.store.put(0, 1, [Message.Code.EVENT_TRANSFER_TX_FAILED])
+        self.store.put(0, 1, [Message.Code.EVENT_TRANSFER_TX_COMPLETED])
+        self.assertRaises(TransferFailedException, self.store.wait_for_event,
+                          [Message.Code.EVENT_TRANSFER_TX_COMPLETED], 0)
+        self.assertEqual(self.store.wait_for_event([Message.Code.EVENT_TRANSFER_TX_COMPLETED], 0)[2],
+                         [Message.Code.EVENT_TRANSFER_TX_COMPLETED])
+
+    def test_size_eviction(self):
+        for _ in range(1000):
+            self.store.put(0, 1, [Message.Code.EVENT_RX_FAIL])
+        self.assertEqual(len(self.store), 4)
+        statistics = self.store.get_statistics()
+        self.assertEqual(statistics["stored"], 1000)
+        self.assertEqual(statistics["evicted_size"], 996)
+
+    def test_ttl_eviction(self):
+        self.store.ttl = 0.0
+        self.store.put(0, 1, [Message.Code.EVENT_TX])
+        time.sleep(0.01)
+        self.assertRaises(AntException, self.store.wait_for_event,
+                          [Message.Code.EVENT_TX], 0, 0.01)
+        self.assertEqual(self.store.get_statistics()["evicted_ttl"], 1)
+
+    def test_wait_wakes_up(self):
+        timer = threading.Timer(0.05, self.store.put, (2, 1, [Message.Code.EVENT_TRANSFER_TX_START]))
+        timer.start()
+        self.assertEqual(self.store.wait_for_event([Message.Code.EVENT_TRANSFER_TX_START], 2, 2.0)[0], 2)
+        timer.join()
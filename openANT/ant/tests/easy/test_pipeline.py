@@ -0,0 +1,113 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+import array
+import threading
+import unittest
+
+from openANT.ant.base.message import Message
+from openANT.ant.easy.exception import TransferFailedException
+from openANT.ant.easy.pipeline import SendPipeline
+
+
+class FakeAnt(object):
+    def __init__(self):
+        self.sent = []
+        self.cond = threading.Condition()
+
+    def send_acknowledged_data(self, channel, data):
+        with self.cond:
+            self.sent.append((channel, data))
+            self.cond.notify_all()
+
+    def wait_sent(self, count):
+        with self.cond:
+            while len(self.sent) < count:
+                self.cond.wait(1.0)
+
+
+class SendPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.ant = FakeAnt()
+        self.pipeline = SendPipeline(self.ant, max_retries=2, timeout=5.0,
+                                     backoff=0.0)
+        self.data = array.array('B', [0xF0, 0x03, 0, 0, 60, 50, 5, 0xFF])
+
+    def tearDown(self):
+        self.pipeline.stop()
+
+    def test_one_in_flight_per_channel(self):
+        first = self.pipeline.submit(0, self.data)
+        second = self.pipeline.submit(0, self.data)
+        other = self.pipeline.submit(1, self.data)
+
+        # Channel 1 is not blocked by channel 0, the second message on
+        # channel 0 waits for the first one
+        self.assertEqual([c for c, _ in self.ant.sent], [0, 1])
+
+        self.assertTrue(self.pipeline.on_event(1, Message.Code.EVENT_TRANSFER_TX_COMPLETED))
+        self.assertTrue(other.done())
+        self.assertFalse(first.done())
+
+        self.pipeline.on_event(0, Message.Code.EVENT_TRANSFER_TX_COMPLETED)
+        self.assertEqual(first.result().attempts, 1)
+        self.assertEqual([c for c, _ in self.ant.sent], [0, 1, 0])
+
+        self.pipeline.on_event(0, Message.Code.EVENT_TRANSFER_TX_COMPLETED)
+        self.assertTrue(second.done())
+
+        statistics = self.pipeline.get_statistics(0)
+        self.assertEqual(statistics.submitted, 2)
+        self.assertEqual(statistics.completed, 2)
+        self.assertIsNotNone(statistics.get_round_trip_mean())
+
+    def test_bounded_retry(self):
+        future = self.pipeline.submit(0, self.data)
+        for attempt in range(1, 4):
+            self.ant.wait_sent(attempt)
+            self.pipeline.on_event(0, Message.Code.EVENT_TRANSFER_TX_FAILED)
+
+        self.assertRaises(TransferFailedException, future.result, 1.0)
+        self.assertEqual(len(self.ant.sent), 3)
+        statistics = self.pipeline.get_statistics(0)
+        self.assertEqual(statistics.retries, 2)
+        self.assertEqual(statistics.failed, 1)
+
+    def test_retry_then_complete(self):
+        future = self.pipeline.submit(0, self.data)
+        self.pipeline.on_event(0, Message.Code.EVENT_TRANSFER_TX_FAILED)
+        self.ant.wait_sent(2)
+        self.pipeline.on_event(0, Message.Code.EVENT_TRANSFER_TX_COMPLETED)
+        self.assertEqual(future.result(1.0).get_retries(), 1)
+
+    def test_timeout(self):
+        self.pipeline.configure(timeout=0.01, max_retries=1)
+        future = self.pipeline.submit(0, self.data)
+        self.assertRaises(TransferFailedException, future.result, 2.0)
+        self.assertEqual(self.pipeline.get_statistics(0).timeouts, 2)
+
+    def test_unrelated_events_pass_through(self):
+        self.assertFalse(self.pipeline.on_event(0, Message.Code.EVENT_TRANSFER_TX_COMPLETED))
+        self.pipeline.submit(0, self.data)
+        self.assertFalse(self.pipeline.on_event(0, Message.Code.EVENT_RX_FAIL))
@@ -22,4 +22,4 @@
 
 from __future__ import absolute_import, print_function
 
-__all__ = ['test_beacon', 'test_command', 'test_commandpipe', 'test_file']
+__all__ = ['test_beacon', 'test_command', 'test_commandpipe', 'test_cache', 'test_commons', 'test_file', 'test_fit', 'test_passkey', 'test_session', 'test_sink', 'test_sync', 'test_upload']
@@ -0,0 +1,46 @@
+from __future__ import absolute_import, print_function
+
+# Packs and parses ANT-FS commands and command pipes, run with
+#   python -m ant.tests.fs.bench_command
+
+import array
+import timeit
+
+import ant.fs.command
+import ant.fs.commandpipe
+from ant.fs.command import DownloadRequest, DownloadResponse, UploadRequest, UploadResponse
+from ant.fs.commandpipe import Request, Time, CommandPipe
+
+
+def measure(name, function, number=100000):
+    seconds = timeit.timeit(function, number=number) / number
+    print("  %-32s %7.2f us  %10.0f /s" % (name, seconds * 1e6, 1 / seconds))
+
+
+def main():
+    request = DownloadRequest(7, 1024, True, 0xbeef)
+    response = DownloadResponse(DownloadResponse.Response.OK, 512, 1024, 4096,
+                                array.array('B', range(256)) * 2, 0xbeef)
+    upload = UploadResponse(UploadResponse.Response.OK, 0, 4096, 512, 0)
+    time = Time(1000, 2000, Time.Format.COUNTER)
+
+    request_data = request.get()
+    upload_data = upload.get()
+    time_data = time.get()
+
+    print("Commands")
+    measure("DownloadRequest()", lambda: DownloadRequest(7, 1024, True, 0xbeef))
+    measure("DownloadRequest.get()", request.get)
+    measure("UploadRequest().get()", lambda: UploadRequest(7, 4096, 0).get())
+    measure("parse(DownloadRequest)", lambda: ant.fs.command.parse(request_data))
+    measure("parse(UploadResponse)", lambda: ant.fs.command.parse(upload_data))
+    measure("DownloadResponse.get_crc()", response.get_crc)
+    print("Command pipes")
+    measure("Request().get()", lambda: Request(CommandPipe.Type.TIME).get())
+    measure("Time.get()", time.get)
+    measure("parse(Time)", lambda: ant.fs.commandpipe.parse(time_data))
+    measure("Time.get_system_time()", time.get_system_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+from __future__ import absolute_import, print_function
+
+# Compares the CRC-16 implementations on MB-sized files, run with
+#   python -m ant.tests.fs.bench_crc
+
+import array
+import os
+import timeit
+
+from ant.fs import commons
+from ant.fs.commons import crc, Crc16
+
+
+def bitwise_crc(data, seed=0x0000):
+    rem = seed
+    for byte in data:
+        rem ^= byte
+        for _ in range(0, 8):
+            if rem & 0x0001:
+                rem = (rem >> 1) ^ 0xa001
+            else:
+                rem = rem >> 1
+    return rem
+
+
+def table_crc(data, seed=0x0000):
+    threshold = commons.NUMPY_THRESHOLD
+    commons.NUMPY_THRESHOLD = float("inf")
+    try:
+        return crc(data, seed)
+    finally:
+        commons.NUMPY_THRESHOLD = threshold
+
+
+def streaming_crc(data, block=512):
+    running = Crc16()
+    for offset in range(0, len(data), block):
+        running.update(data[offset:offset + block])
+    return running.get_value()
+
+
+def measure(name, function, data, number):
+    seconds = timeit.timeit(lambda: function(data), number=number) / number
+    print("  %-22s %9.2f ms  %8.2f MB/s" % (name, seconds * 1000,
+                                            len(data) / seconds / 1e6))
+
+
+def main():
+    for size in (1 << 20, 4 << 20):
+        data = array.array('B', os.urandom(size))
+        print("%d MB" % (size >> 20))
+        if size <= 1 << 20:
+            measure("bitwise", bitwise_crc, data, 1)
+        measure("table", table_crc, data, 3)
+        measure("streaming (512 B)", streaming_crc, data, 3)
+        if commons.numpy is not None:
+            measure("numpy", commons._crc_numpy, data, 10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+from __future__ import absolute_import, print_function
+
+# Parses and filters large directories with File objects and with the
+# columnar view, and compares the bytes transferred for a directory
+# filtered on the device and one filtered locally, run with
+#   python -m ant.tests.fs.bench_directory
+
+import array
+import datetime
+import random
+import struct
+import timeit
+
+from ant.fs.commandpipe import DirectoryFilter
+from ant.fs.file import Directory, DirectoryView, File, _fit_time
+from ant.tests.fs.simulator import SimulatedApplication
+
+
+def make_directory(count):
+    data = array.array('B', struct.pack("<BBB5xII", 0x10, 16, 0, 0, 0))
+    for index in range(1, count + 1):
+        sub_type = random.choice([File.Identifier.ACTIVITY, File.Identifier.MONITORING_B,
+                                  File.Identifier.SETTING])
+        data.extend(array.array('B', struct.pack("<HBBHBBII", index, File.Type.FIT, sub_type, index,
+                                                 0, random.choice([0xb0, 0xa0, 0x80]),
+                                                 random.randint(100, 100000),
+                                                 random.randint(700000000, 1000000000))))
+    return data
+
+
+def objects(data, since):
+    directory = Directory.parse(data)
+    return [f.get_index() for f in directory.get_files()
+            if f.get_fit_sub_type() == File.Identifier.ACTIVITY and
+            f.get_date().replace(tzinfo=None) >= since and not f.is_archived()]
+
+
+def columns(data, since):
+    view = DirectoryView.parse(data).filter(identifier=File.Identifier.ACTIVITY, since=since)
+    return view.where((view.get_entries()["flags"] & 0b00010000) == 0).get_indexes()
+
+
+def measure(name, function, data, since, number):
+    seconds = timeit.timeit(lambda: function(data, since), number=number) / number
+    print("  %-14s %9.3f ms  %10.0f entries/s" % (name, seconds * 1000, (len(data) - 16) / 16 / seconds))
+
+
+def transfer(data, since):
+    directory_filter = DirectoryFilter(File.Type.FIT, [File.Identifier.ACTIVITY, 0, 0], [0xff, 0, 0],
+                                       _fit_time(since))
+    for device in (False, True):
+        application = SimulatedApplication({0: data}, directory_filter=device)
+        count = len(application.download_directory(filter=directory_filter).get_files())
+        print("  %-14s %9d bytes  %10d entries" % ("device filter" if device else "local filter",
+                                                     application.get_statistics().downloaded, count))
+
+
+def main():
+    since = datetime.datetime(2015, 1, 1)
+    for count in (500, 5000, 50000):
+        data = make_directory(count)
+        assert list(columns(data, since)) == objects(data, since)
+        print("%d entries" % count)
+        measure("File objects", objects, data, since, 3)
+        measure("DirectoryView", columns, data, since, 50)
+        transfer(data, since)
+
+
+if __name__ == "__main__":
+    main()
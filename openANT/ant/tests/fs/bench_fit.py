@@ -0,0 +1,61 @@
+from __future__ import absolute_import, print_function
+
+# Decodes generated FIT activity files, run with
+#   python -m ant.tests.fs.bench_fit
+
+import mmap
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from ant.fs import fit
+from ant.tests.fs.simulator import make_fit
+
+
+def consume(source):
+    records = 0
+    for batch in fit.decode(source):
+        records += len(batch)
+    return records
+
+
+def measure(name, source, records):
+    start = time.time()
+    assert consume(source) == records + 1
+    seconds = time.time() - start
+    print("  %-8s %8.1f ms  %10.0f records/s" % (name, seconds * 1000, records / seconds))
+
+
+def peak(source):
+    tracemalloc.start()
+    consume(source)
+    size = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size
+
+
+def main():
+    for records in (100000, 1000000):
+        data = make_fit([(random.randint(60, 200), random.randint(0, 1500)) for _ in range(records)],
+                        compressed=True)
+        path = os.path.join(tempfile.mkdtemp(), "activity.fit")
+        with open(path, "wb") as f:
+            f.write(data)
+
+        print("%d records, %.1f MB" % (records, len(data) / 1e6))
+        measure("bytes", bytes(data), records)
+        with open(path, "rb") as f:
+            measure("file", f, records)
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            measure("mmap", mapped, records)
+            print("  peak decoder memory %.0f kB" % (peak(mapped) / 1e3))
+            mapped.close()
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
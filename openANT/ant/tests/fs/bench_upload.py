@@ -0,0 +1,80 @@
+from __future__ import absolute_import, print_function, division
+
+# Upload throughput against the simulated ANT-FS client, run with
+#   python -m ant.tests.fs.bench_upload
+
+import array
+import os
+import struct
+import time
+
+from ant.fs.command import UploadRequest, UploadDataCommand
+from ant.fs.commons import crc
+from ant.tests.fs.simulator import SimulatedApplication
+
+# Assumed time per command on a real link, for the estimated throughput
+ROUND_TRIP = 0.02
+
+
+class CopyingUploadDataCommand(UploadDataCommand):
+    def get(self):
+        arguments = list(self._get_arguments())
+        header = struct.pack("<BBHI", *arguments[:4])
+        footer = struct.pack("<6xH", self.get_crc())
+        data = array.array('B', header)
+        data.extend(self.get_data())
+        data.extend(array.array('B', footer))
+        return data
+
+
+def copying_upload(application, index, data):
+    # The previous implementation: one request, one sliced and padded copy
+    # and a CRC from the granted seed per block
+    iteration = 0
+    while True:
+        request_offset = 0 if iteration == 0 else 0xffffffff
+        application._send_command(UploadRequest(index, len(data), request_offset))
+        upload_response = application._get_command()
+        offset = upload_response.get_last_data_offset()
+        max_block = upload_response.get_maximum_block_size()
+        data_packet = data[offset:offset + max_block]
+        crc_seed = upload_response.get_crc()
+        crc_val = crc(data_packet, crc_seed)
+        missing_bytes = 8 - (len(data_packet) % 8)
+        if missing_bytes != 8:
+            data_packet.extend(array.array('B', [0] * missing_bytes))
+        application._send_command(CopyingUploadDataCommand(crc_seed, offset, data_packet, crc_val))
+        application._get_command()
+        if offset + len(data_packet) >= len(data):
+            break
+        iteration += 1
+
+
+def consecutive_upload(application, data):
+    application.set_consecutive_upload(True)
+    application.upload(1, data)
+
+
+def measure(name, function, data, block_size):
+    application = SimulatedApplication(upload_block_size=block_size)
+    start = time.time()
+    function(application, data)
+    seconds = time.time() - start
+    assert application.files[1] == data
+    commands = len(application.requests)
+    print("  %-30s %8.1f ms  %6.2f MB/s  %5d commands  %6.1f kB/s on air" % (
+        name, seconds * 1000, len(data) / seconds / 1e6, commands,
+        len(data) / (seconds + commands * ROUND_TRIP) / 1e3))
+
+
+def main():
+    for size, block_size in ((1 << 20, 512), (1 << 20, 4096), (4 << 20, 16384)):
+        data = array.array('B', os.urandom(size - 3))
+        print("%d MB, %d B blocks" % (size >> 20, block_size))
+        measure("request + copy per block", lambda a, d: copying_upload(a, 1, d), data, block_size)
+        measure("memoryview, request per block", lambda a, d: a.upload(1, d), data, block_size)
+        measure("memoryview, consecutive", consecutive_upload, data, block_size)
+
+
+if __name__ == "__main__":
+    main()
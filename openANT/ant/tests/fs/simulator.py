@@ -0,0 +1,245 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from __future__ import absolute_import, print_function
+
+import array
+import struct
+import time
+
+import ant.fs.command
+import ant.fs.commandpipe
+from ant.fs.beacon import Beacon
+from ant.fs.command import (AuthenticateCommand, AuthenticateResponse, DownloadRequest,
+                            DownloadResponse, UploadRequest, UploadResponse, UploadDataCommand,
+                            UploadDataResponse)
+from ant.fs.commandpipe import DirectoryFilter, Response
+from ant.fs.commons import crc
+from ant.fs.file import File
+from ant.easy.channel import Channel
+from ant.fs.manager import Application
+
+
+class SimulatedApplication(Application):
+    """
+    Application talking to an in-memory ANT-FS client instead of a node.
+    Commands go through their wire format, the client answers download
+    and upload requests from *files* (index -> array). Command pipe
+    uploads to 0xfffe are answered in place, a :class:`DirectoryFilter`
+    applies to the next directory download when *directory_filter* is
+    set. The client goes from link to authentication on :meth:`link` and
+    to transport when a passkey or pairing is accepted, pairing takes
+    *pair_delay* seconds (the user confirming on the device). Faults are
+    injected by setting the counters below.
+    """
+
+    def __init__(self, files=None, serial=0x12345678, block_size=512,
+                 upload_block_size=512, consecutive=True, node=None,
+                 directory_filter=False, passkey=None, pair_delay=0.0):
+        self._init_session()
+        self._client_serial = serial
+        self._owns_node = False
+        self._node = node
+        self._channel = None if node is None else node.new_channel(Channel.Type.BIDIRECTIONAL_RECEIVE)
+
+        self.files = files if files is not None else {}
+        self.block_size = block_size
+        self.upload_block_size = upload_block_size
+        self.consecutive = consecutive
+        self.directory_filter = directory_filter
+        self.passkey = passkey  # Passkey of the paired host, None if not paired
+        self.pair_delay = pair_delay
+        self.state = Beacon.ClientDeviceState.LINK
+
+        self.drop = 0  # Requests left unanswered
+        self.corrupt = 0  # Download responses with a wrong CRC
+        self.reject = 0  # Upload data answered with FAILED
+        self.ignore_consecutive = False  # Unrequested upload data left unanswered instead of FAILED
+        self.silent_commandpipe = False  # Command pipe uploads left unanswered
+        self.fail_at = None  # Offset from which requests raise IOError
+
+        self.requests = []  # (command id, index, offset)
+        self.response_timeout = 15.0  # Longest wait for a response, short for tests with unanswered requests
+        self.authentications = []  # Authentication request types
+        self._upload = None  # [index, size, offset, crc, requested]
+        self._filter = None  # Filter for the next directory download
+        self._directory = None  # Filtered directory being downloaded
+
+    def _send_command(self, command):
+        command = ant.fs.command.parse(command.get())
+        if isinstance(command, DownloadRequest):
+            self._on_download(command)
+        elif isinstance(command, UploadRequest):
+            self._on_upload(command)
+        elif isinstance(command, UploadDataCommand):
+            self._on_upload_data(command)
+        elif isinstance(command, AuthenticateCommand):
+            self._on_authenticate(command)
+
+    def _get_command(self, timeout=15.0):
+        return Application._get_command(self, min(timeout, self.response_timeout))
+
+    def _get_beacon(self):
+        return Beacon(0x08, self.state, 0x03, bytearray(struct.pack("<I", self._client_serial)))
+
+    def link(self):
+        self.state = Beacon.ClientDeviceState.AUTHENTICATION
+
+    def disconnect(self):
+        self.state = Beacon.ClientDeviceState.LINK
+
+    def _on_authenticate(self, command):
+        request = command.get_type()
+        self.authentications.append(request)
+        serial = self._client_serial
+        if request == AuthenticateCommand.Request.SERIAL:
+            response = AuthenticateResponse(AuthenticateResponse.Response.NOT_AVAILABLE, serial,
+                                            array.array('B', b"simulator"))
+        elif (request == AuthenticateCommand.Request.PASSKEY_EXCHANGE and self.passkey is not None and
+              bytearray(command.get_data_array()) == bytearray(self.passkey)):
+            response = AuthenticateResponse(AuthenticateResponse.Response.ACCEPT, serial)
+        elif request == AuthenticateCommand.Request.PAIRING:
+            time.sleep(self.pair_delay)
+            self.passkey = array.array('B', struct.pack("<Q", 0x5555aaaa00000000 | serial))
+            response = AuthenticateResponse(AuthenticateResponse.Response.ACCEPT, serial, self.passkey)
+        else:
+            response = AuthenticateResponse(AuthenticateResponse.Response.REJECT, serial)
+        if response.get_type() == AuthenticateResponse.Response.ACCEPT:
+            self.state = Beacon.ClientDeviceState.TRANSPORT
+        self._queue.put(response)
+
+    def _on_download(self, command):
+        index = command.get_data_index()
+        offset = command.get_data_offset()
+        self.requests.append((command.get_id(), index, offset))
+        if self.fail_at is not None and offset >= self.fail_at:
+            raise IOError("Link lost")
+        if self.drop > 0:
+            self.drop -= 1
+            return
+
+        data = self.files[index]
+        if index == 0 and self._filter is not None:
+            if offset == 0:
+                self._directory = filter_directory(data, self._filter)
+            data = self._directory
+        block = data[offset:offset + self.block_size]
+        if index == 0 and offset + len(block) == len(data):
+            self._filter = None
+        block_crc = crc(block, command.get_crc_seed())
+        if self.corrupt > 0:
+            self.corrupt -= 1
+            block_crc ^= 0x0001
+        self._queue.put(DownloadResponse(DownloadResponse.Response.OK, len(block), offset,
+                                         len(data), block, block_crc))
+
+    def _on_upload(self, command):
+        index = command.get_data_index()
+        size = command.get_max_size()
+        self.requests.append((command.get_id(), index, command.get_data_offset()))
+        if index == 0xfffe and self.silent_commandpipe:
+            return
+        if command.get_data_offset() != 0xffffffff or self._upload is None:
+            self.files[index] = array.array('B')
+            self._upload = [index, size, 0, 0x0000, True]
+        self._upload[4] = True
+        self._queue.put(UploadResponse(UploadResponse.Response.OK, self._upload[2], size,
+                                       self.upload_block_size, self._upload[3]))
+
+    def _on_upload_data(self, command):
+        index, size, offset, seed, requested = self._upload
+        self.requests.append((command.get_id(), index, command.get_data_offset()))
+        length = min(self.upload_block_size, size - offset)
+        block = command.get_data()[:length]
+        if not requested and not self.consecutive and self.ignore_consecutive:
+            return
+        if (self.reject > 0 or (not requested and not self.consecutive) or
+                command.get_data_offset() != offset or
+                command.get_crc_seed() != seed or
+                crc(block, seed) != command.get_crc()):
+            self.reject = max(self.reject - 1, 0)
+            self._queue.put(UploadDataResponse(UploadDataResponse.Response.FAILED))
+            return
+
+        self.files[index].extend(block)
+        self._upload = [index, size, offset + length, command.get_crc(), False]
+        if index == 0xfffe and offset + length == size:
+            self._on_commandpipe()
+        self._queue.put(UploadDataResponse(UploadDataResponse.Response.OK))
+
+    def _on_commandpipe(self):
+        command = ant.fs.commandpipe.parse(self.files[0xfffe])
+        if isinstance(command, DirectoryFilter) and self.directory_filter:
+            self._filter = command
+            result = Response.Response.OK
+        else:
+            result = Response.Response.NOT_SUPPORTED
+        response = Response(command.get_command(), result)
+        response.set_sequence(command.get_sequence())
+        self.files[0xfffe] = response.get()
+
+
+def make_directory(entries):
+    """A raw directory of (index, sub_type, size, date) FIT entries, date in FIT seconds."""
+    data = array.array('B', struct.pack("<BBB5xII", 0x01, 16, 0, 0, 0))
+    for index, sub_type, size, date in entries:
+        data.extend(array.array('B', struct.pack("<HBBHBBII", index, File.Type.FIT, sub_type,
+                                                 index, 0, 0b10100000, size, date)))
+    return data
+
+
+def filter_directory(data, directory_filter):
+    """The raw directory *data* without the entries *directory_filter* rejects."""
+    result = array.array('B', data[:16])
+    for offset in range(16, len(data), 16):
+        if directory_filter.matches(File.parse(data[offset:offset + 16])):
+            result.extend(data[offset:offset + 16])
+    return result
+
+
+def make_fit(records, start=1000000000, compressed=False, header_crc=True):
+    """
+    A FIT activity file with a file_id message and *records* record
+    messages of (heart_rate, power), one per second from *start*. With
+    *compressed* every other record uses a compressed timestamp header.
+    """
+    data = bytearray()
+    # file_id: type (enum), manufacturer (uint16), serial_number (uint32z)
+    data += struct.pack("<BBBHB", 0x40, 0, 0, 0, 3) + bytearray([0, 1, 0x00, 1, 2, 0x84, 3, 4, 0x8c])
+    data += struct.pack("<BBHI", 0x00, 4, 1, 0x12345678)
+    # record on local type 1: timestamp, heart_rate, power; local type 2
+    # without timestamp for the compressed headers
+    data += struct.pack("<BBBHB", 0x41, 0, 0, 20, 3) + bytearray([253, 4, 0x86, 3, 1, 0x02, 7, 2, 0x84])
+    data += struct.pack("<BBBHB", 0x42, 0, 0, 20, 2) + bytearray([3, 1, 0x02, 7, 2, 0x84])
+    for i, (heart_rate, power) in enumerate(records):
+        timestamp = start + i
+        if compressed and i % 2:
+            data += struct.pack("<BBH", 0x80 | (2 << 5) | (timestamp & 0x1f), heart_rate, power)
+        else:
+            data += struct.pack("<BIBH", 0x01, timestamp, heart_rate, power)
+
+    header = bytearray(struct.pack("<BBHI4s", 14, 0x20, 2132, len(data), b".FIT"))
+    header += struct.pack("<H", crc(header) if header_crc else 0)
+    fit = header + data
+    fit += struct.pack("<H", crc(fit))
+    return fit
@@ -0,0 +1,148 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from __future__ import absolute_import, print_function
+
+import array
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from ant.fs.cache import CachedDownload, DownloadCache
+from ant.fs.manager import AdaptiveTimeout, AntFSDownloadException
+from ant.tests.fs.simulator import SimulatedApplication
+
+
+class Entry(object):
+    def __init__(self, size, date):
+        self._size = size
+        self._date = date
+
+    def get_size(self):
+        return self._size
+
+    def get_date(self):
+        return self._date
+
+
+def make_application(files, fail_at=None, drop=0):
+    application = SimulatedApplication(files)
+    application._timeout = AdaptiveTimeout(initial=0.01, minimum=0.01, maximum=0.01)
+    application.fail_at = fail_at
+    application.drop = drop
+    return application
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.date = datetime.datetime(2024, 5, 1, 12, 30)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_path(self):
+        cache = DownloadCache(self.directory)
+        self.assertEqual(cache.get_path(42, 7, 1000, self.date),
+                         os.path.join(self.directory, "42", "00007_1000_20240501123000"))
+
+    def test_persist(self):
+        cache = DownloadCache(self.directory)
+        download = cache.open(42, 7, 1000, self.date)
+        self.assertEqual(download.get_offset(), 0)
+        download.write(0, array.array('B', range(100)), 0x1234)
+        download.flush()
+
+        download = cache.open(42, 7, 1000, self.date)
+        self.assertEqual(download.get_offset(), 100)
+        self.assertEqual(download.get_crc(), 0x1234)
+        self.assertEqual(download.read(), array.array('B', range(100)))
+        self.assertFalse(download.is_complete())
+
+    def test_batched(self):
+        path = os.path.join(self.directory, "file")
+        download = CachedDownload(path, 1000, flush_bytes=400, flush_interval=60.0)
+        download.write(0, array.array('B', range(200)), 0x1111)
+        self.assertEqual(CachedDownload(path, 1000).get_offset(), 0)
+        download.write(200, array.array('B', range(200)), 0x2222)
+        self.assertEqual(CachedDownload(path, 1000).get_offset(), 400)
+
+        # Completion is always recorded
+        download.write(400, array.array('B', range(200)), 0x3333)
+        download.write(600, array.array('B', range(200)) * 2, 0x4444)
+        self.assertTrue(CachedDownload(path, 1000).is_complete())
+        self.assertEqual(CachedDownload(path, 1000).get_crc(), 0x4444)
+
+    def test_truncated_data(self):
+        path = os.path.join(self.directory, "file")
+        download = CachedDownload(path, 1000)
+        download.write(0, array.array('B', range(100)), 0x1234)
+        with open(path, "r+b") as f:
+            f.truncate(50)
+        self.assertEqual(CachedDownload(path, 1000).get_offset(), 0)
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.entry = Entry(5000, datetime.datetime(2024, 5, 1, 12, 30))
+        self.data = array.array('B', os.urandom(5000))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume(self):
+        application = make_application({3: self.data}, fail_at=2048)
+        application.set_download_cache(DownloadCache(self.directory))
+        self.assertRaises(IOError, application.download, 3, None, self.entry)
+
+        application = make_application({3: self.data})
+        application.set_download_cache(DownloadCache(self.directory))
+        self.assertEqual(application.download(3, None, self.entry), self.data)
+        self.assertEqual(application.requests[0][2], 2048)
+
+        application.requests = []
+        self.assertEqual(application.download(3, None, self.entry), self.data)
+        self.assertEqual(application.requests, [])
+
+    def test_timeout(self):
+        application = make_application({3: self.data}, drop=3)
+        self.assertEqual(application.download(3), self.data)
+
+        application = make_application({3: self.data}, drop=100)
+        self.assertRaises(AntFSDownloadException, application.download, 3)
+
+
+class AdaptiveTimeoutTest(unittest.TestCase):
+    def test_converge(self):
+        timeout = AdaptiveTimeout(initial=15.0, minimum=0.5, maximum=30.0)
+        for _ in range(50):
+            timeout.update(0.2)
+        self.assertAlmostEqual(timeout.get(), 0.5, places=2)
+        timeout.backoff()
+        self.assertAlmostEqual(timeout.get(), 1.0, places=2)
+        for _ in range(10):
+            timeout.backoff()
+        self.assertEqual(timeout.get(), 30.0)
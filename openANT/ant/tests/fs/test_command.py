@@ -25,7 +25,9 @@ from __future__ import absolute_import, print_function
 import array
 import unittest
 
-from ant.fs.command import parse, DownloadRequest, DownloadResponse, AuthenticateCommand
+from ant.fs.command import (parse, AuthenticateCommand, AuthenticateResponse, DisconnectCommand,
+                            DownloadRequest, DownloadResponse, EraseRequestCommand, EraseResponse,
+                            LinkCommand, UploadDataResponse, UploadRequest, UploadResponse)
 
 
 class AuthenticateCommandTest(unittest.TestCase):
@@ -83,3 +85,43 @@ class DownloadResponseTest(unittest.TestCase):
         self.assertEqual(response._get_argument("data"), array.array('B', []))
         self.assertEqual(response._get_argument("crc"), 0)
 
+
+class RoundTripTest(unittest.TestCase):
+    def test_fixed(self):
+        commands = [LinkCommand(19, 4, 1337),
+                    DisconnectCommand(DisconnectCommand.Type.RETURN_LINK, 0, 0),
+                    DownloadRequest(7, 1024, True, 0xbeef, 512),
+                    UploadRequest(7, 4096, 0xffffffff),
+                    UploadResponse(UploadResponse.Response.OK, 512, 4096, 512, 0x1234),
+                    UploadDataResponse(UploadDataResponse.Response.FAILED),
+                    EraseRequestCommand(9),
+                    EraseResponse(EraseResponse.Response.ERASE_FAILED)]
+        for command in commands:
+            data = command.get()
+            self.assertEqual(len(data) % 8, 0)
+            parsed = parse(data)
+            self.assertIsInstance(parsed, type(command))
+            self.assertEqual(parsed.get(), data)
+
+        request = parse(commands[2].get())
+        self.assertEqual(request.get_data_index(), 7)
+        self.assertEqual(request.get_data_offset(), 1024)
+        self.assertEqual(request.get_crc_seed(), 0xbeef)
+        self.assertEqual(request.get_maximum_block_size(), 512)
+
+    def test_variable(self):
+        response = DownloadResponse(DownloadResponse.Response.OK, 3, 8, 11,
+                                    array.array('B', [1, 2, 3]), 0x4321)
+        parsed = parse(response.get())
+        self.assertEqual(parsed.get_data()[:parsed.get_remaining()], array.array('B', [1, 2, 3]))
+        self.assertEqual(parsed.get_crc(), 0x4321)
+
+        authenticate = AuthenticateResponse(AuthenticateResponse.Response.ACCEPT, 42,
+                                            array.array('B', [1, 2, 3, 4, 5, 6, 7, 8]))
+        parsed = parse(authenticate.get())
+        self.assertEqual(parsed.get_serial(), 42)
+        self.assertEqual(parsed.get_data_array(), array.array('B', range(1, 9)))
+
+    def test_slots(self):
+        request = DownloadRequest(7, 1024, True, 0xbeef)
+        self.assertRaises(AttributeError, setattr, request, "unknown", 1)
@@ -23,10 +23,14 @@
 from __future__ import absolute_import, print_function
 
 import array
+import threading
 import unittest
 import datetime
 
-from ant.fs.commandpipe import parse, CreateFile, Request, CommandPipe, Time, TimeResponse
+from ant.fs.commandpipe import (parse, CreateFile, CreateFileResponse, DirectoryFilter, Request,
+                                CommandPipe, Response, Sequence, Time, TimeResponse)
+from ant.fs.file import File
+from ant.tests.fs.simulator import SimulatedApplication, make_directory
 
 
 class CreateFileTest(unittest.TestCase):
@@ -43,13 +47,21 @@ class CreateFileTest(unittest.TestCase):
         self.assertEqual(response.get_data_type(), 0x80)  # FIT
         self.assertEqual(response.get_identifier(), array.array('B', [4, 123, 0]))
         self.assertEqual(response.get_index(), 103)
+        self.assertEqual(response.get(), response_data)
+
+        # Test create file round trip
+        parsed = parse(request.get())
+        self.assertIsInstance(parsed, CreateFile)
+        self.assertEqual(parsed.get_size(), len(data))
+        self.assertEqual(parsed.get_identifier(), array.array('B', [0x04, 0x00, 0x00]))
+        self.assertEqual(parsed.get_identifier_mask(), array.array('B', [0x00, 0xff, 0xff]))
 
 
 class TimeTest(unittest.TestCase):
     def runTest(self):
         # Test time request
         request = Request(CommandPipe.Type.TIME)
-        self.assertEqual(request.get(), array.array('B', [0x01, 0x00, 0x00, CommandPipe._sequence, 0x03, 0x00, 0x00, 0x00]))
+        self.assertEqual(request.get(), array.array('B', [0x01, 0x00, 0x00, request.get_sequence(), 0x03, 0x00, 0x00, 0x00]))
 
         # Test time parse
         response_data = array.array('B', [0x03, 0x00, 0x00, 0x0f, 0x78, 0xb5, 0xca, 0x25,
@@ -69,7 +81,7 @@ class TimeTest(unittest.TestCase):
         system_time = (datetime.datetime(2012, 4, 20, 23, 10, 0) - datetime.datetime(1989, 12, 31, 0, 0, 0)).total_seconds()
 
         time = Time(int(current_time), int(system_time), Time.Format.COUNTER)
-        self.assertEqual(time.get(), array.array('B', [0x03, 0x00, 0x00, CommandPipe._sequence, 0x52, 0x63, 0x0c, 0x2f,
+        self.assertEqual(time.get(), array.array('B', [0x03, 0x00, 0x00, time.get_sequence(), 0x52, 0x63, 0x0c, 0x2f,
                                                        0xc8, 0xa0, 0xf4, 0x29, 0x02, 0x00, 0x00, 0x00]))
 
         # Test time request response
@@ -78,3 +90,89 @@ class TimeTest(unittest.TestCase):
         response = parse(response_data)
         self.assertIsInstance(response, TimeResponse)
 
+
+
+class SequenceTest(unittest.TestCase):
+    def test_wrap(self):
+        sequence = Sequence()
+        numbers = [sequence.get_next() for _ in range(300)]
+        self.assertEqual(numbers[:3], [1, 2, 3])
+        self.assertEqual(numbers[254:257], [255, 0, 1])
+
+        request = Request(CommandPipe.Type.TIME)
+        request.set_sequence(numbers[-1])
+        self.assertEqual(request.get()[3], numbers[-1])
+
+    def test_threads(self):
+        sequence = Sequence()
+        numbers = []
+
+        def draw():
+            numbers.extend(sequence.get_next() for _ in range(1000))
+
+        threads = [threading.Thread(target=draw) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(numbers), sorted([n & 0xff for n in range(1, 4001)]))
+
+    def test_slots(self):
+        request = Request(CommandPipe.Type.TIME)
+        self.assertRaises(AttributeError, setattr, request, "unknown", 1)
+
+
+class DirectoryFilterTest(unittest.TestCase):
+    def setUp(self):
+        # 40 entries, every fourth an activity, one per day
+        self.entries = [(index, File.Identifier.ACTIVITY if index % 4 == 0 else File.Identifier.MONITORING_B,
+                         1000, 800000000 + index * 86400) for index in range(1, 41)]
+        self.activity = DirectoryFilter(File.Type.FIT, [File.Identifier.ACTIVITY, 0, 0], [0xff, 0, 0],
+                                        800000000 + 20 * 86400)
+
+    def test_round_trip(self):
+        data = self.activity.get()
+        self.assertEqual(len(data), 16)
+        self.assertEqual(data[:2].tolist(), [CommandPipe.Type.DIRECTORY_FILTER, 0])
+        parsed = parse(data)
+        self.assertIsInstance(parsed, DirectoryFilter)
+        self.assertEqual(parsed.get_data_type(), File.Type.FIT)
+        self.assertEqual(parsed.get_identifier(), array.array('B', [File.Identifier.ACTIVITY, 0, 0]))
+        self.assertEqual(parsed.get_identifier_mask(), array.array('B', [0xff, 0, 0]))
+        self.assertEqual(parsed.get_since(), 800000000 + 20 * 86400)
+        self.assertEqual(parsed.get(), data)
+
+    def download(self, directory_filter):
+        application = SimulatedApplication({0: make_directory(self.entries)},
+                                           directory_filter=directory_filter)
+        directory = application.download_directory(filter=self.activity)
+        return application, [f.get_index() for f in directory.get_files()]
+
+    def test_device(self):
+        application, indexes = self.download(True)
+        self.assertEqual(indexes, [20, 24, 28, 32, 36, 40])
+        self.assertTrue(application._directory_filter)
+        # Command pipe response, header and six entries instead of forty
+        self.assertEqual(application.get_statistics().downloaded, 8 + 16 + 6 * 16)
+
+    def test_fallback(self):
+        application, indexes = self.download(False)
+        self.assertEqual(indexes, [20, 24, 28, 32, 36, 40])
+        self.assertFalse(application._directory_filter)
+        response = parse(application.files[0xfffe])
+        self.assertEqual(response.get_response(), Response.Response.NOT_SUPPORTED)
+        self.assertEqual(application.get_statistics().downloaded, 8 + 16 + 40 * 16)
+
+        # The filter is not sent again to a device that rejected it
+        requests = len(application.requests)
+        application.download_directory(filter=self.activity)
+        self.assertEqual(set(r[1] for r in application.requests[requests:]), {0})
+
+    def test_silent(self):
+        # A device that does not answer the command pipe at all
+        application = SimulatedApplication({0: make_directory(self.entries)})
+        application.silent_commandpipe = True
+        application.response_timeout = 0.01
+        directory = application.download_directory(filter=self.activity)
+        self.assertEqual([f.get_index() for f in directory.get_files()], [20, 24, 28, 32, 36, 40])
+        self.assertFalse(application._directory_filter)
@@ -0,0 +1,70 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+import array
+import os
+import unittest
+
+from ant.fs import commons
+from ant.fs.commons import crc, Crc16
+
+
+def bitwise_crc(data, seed=0x0000):
+    rem = seed
+    for byte in data:
+        rem ^= byte
+        for _ in range(0, 8):
+            if rem & 0x0001:
+                rem = (rem >> 1) ^ 0xa001
+            else:
+                rem = rem >> 1
+    return rem
+
+
+class CrcTest(unittest.TestCase):
+    def test_check_value(self):
+        self.assertEqual(crc(array.array('B', b"123456789")), 0xbb3d)
+        self.assertEqual(crc([2, 0, 0, 1, 3, 0, 3, 0]), 44476)
+        self.assertEqual(crc([]), 0)
+
+    def test_seed(self):
+        data = array.array('B', os.urandom(300))
+        self.assertEqual(crc(data[100:], crc(data[:100], 0x1234)),
+                         bitwise_crc(data, 0x1234))
+
+    def test_stream(self):
+        data = array.array('B', os.urandom(5000))
+        running = Crc16()
+        for offset in range(0, len(data), 512):
+            running.update(data[offset:offset + 512])
+        self.assertEqual(running.get_value(), bitwise_crc(data))
+        self.assertEqual(running.get_length(), len(data))
+
+    @unittest.skipIf(commons.numpy is None, "NumPy not available")
+    def test_numpy(self):
+        for size in (commons.NUMPY_THRESHOLD - 1, commons.NUMPY_THRESHOLD,
+                     100003, 1 << 18):
+            data = bytearray(os.urandom(size))
+            self.assertEqual(commons._crc_numpy(data, 0xbeef),
+                             bitwise_crc(data, 0xbeef))
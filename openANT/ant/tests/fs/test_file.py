@@ -27,44 +27,48 @@ import unittest
 import datetime
 import sys
 
-from ant.fs.file import Directory
+from ant.fs import file as fs_file
+from ant.fs.file import Directory, DirectoryView
 from ant.fs.file import File
 
 
+DIRECTORY = array.array('B', [1, 16, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                              0, 0, 0, 1, 0, 1, 12, 0, 0, 0, 80, 0, 224, 25, 0, 0, 0, 0, 0, 2,
+                              0, 1, 13, 0, 0, 0, 48, 0, 0, 4, 0, 0, 0, 0, 0, 3, 0, 128, 1, 255,
+                              255, 0, 144, 92, 2, 0, 0, 0, 0, 0, 0, 4, 0, 128, 2, 255, 255,
+                              0, 208, 29, 2, 0, 0, 0, 0, 0, 0, 5, 0, 128, 3, 3, 0, 0, 208,
+                              172, 4, 0, 0, 0, 0, 0, 0, 6, 0, 128, 3, 1, 0, 0, 208, 172, 4,
+                              0, 0, 0, 0, 0, 0, 7, 0, 128, 4, 33, 0, 0, 176, 32, 9, 0, 0, 128,
+                              250, 213, 41, 8, 0, 128, 4, 34, 0, 0, 176, 160, 49, 0, 0, 130,
+                              250, 213, 41, 9, 0, 128, 4, 35, 0, 0, 176, 184, 23, 0, 0, 130,
+                              250, 213, 41, 10, 0, 128, 4, 36, 0, 0, 176, 233, 2, 0, 0, 130,
+                              250, 213, 41, 11, 0, 128, 4, 37, 0, 0, 176, 139, 3, 0, 0, 132,
+                              250, 213, 41, 12, 0, 128, 4, 38, 0, 0, 176, 233, 2, 0, 0, 132,
+                              250, 213, 41, 13, 0, 128, 4, 39, 0, 0, 176, 45, 4, 0, 0, 134, 250,
+                              213, 41, 14, 0, 128, 4, 40, 0, 0, 176, 49, 29, 0, 0, 134, 250, 213,
+                              41, 15, 0, 128, 4, 41, 0, 0, 176, 89, 26, 0, 0, 134, 250, 213, 41,
+                              16, 0, 128, 4, 42, 0, 0, 176, 173, 61, 0, 0, 136, 250, 213, 41, 17,
+                              0, 128, 4, 43, 0, 0, 176, 80, 67, 0, 0, 138, 250, 213, 41, 18, 0,
+                              128, 4, 44, 0, 0, 176, 107, 46, 0, 0, 138, 250, 213, 41, 19, 0,
+                              128, 4, 45, 0, 0, 176, 40, 26, 0, 0, 140, 250, 213, 41, 20, 0, 128,
+                              4, 46, 0, 0, 176, 217, 23, 0, 0, 140, 250, 213, 41, 21, 0, 128, 4,
+                              47, 0, 0, 176, 108, 3, 0, 0, 144, 250, 213, 41, 22, 0, 128, 4, 48,
+                              0, 0, 176, 166, 80, 0, 0, 144, 250, 213, 41, 23, 0, 128, 4, 49, 0,
+                              0, 176, 159, 62, 0, 0, 146, 250, 213, 41, 24, 0, 128, 4, 50, 0, 0,
+                              176, 253, 15, 0, 0, 148, 250, 213, 41, 25, 0, 128, 4, 51, 0, 0,
+                              176, 163, 24, 0, 0, 150, 250, 213, 41, 26, 0, 128, 4, 52, 0, 0,
+                              176, 56, 25, 0, 0, 150, 250, 213, 41, 27, 0, 128, 4, 53, 0, 0,
+                              176, 158, 22, 0, 0, 152, 250, 213, 41, 28, 0, 128, 4, 54, 0, 0,
+                              176, 114, 19, 0, 0, 154, 250, 213, 41, 29, 0, 128, 4, 55, 0, 0,
+                              176, 239, 23, 0, 0, 154, 250, 213, 41, 30, 0, 128, 4, 56, 0, 0,
+                              176, 155, 35, 0, 0, 156, 250, 213, 41, 31, 0, 128, 4, 57, 0, 0,
+                              176, 156, 19, 0, 0, 158, 250, 213, 41])
+
+
 class DirectoryParse(unittest.TestCase):
 
     def test_parse(self):
-        self.dir = array.array('B', [1, 16, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-                                     0, 0, 0, 1, 0, 1, 12, 0, 0, 0, 80, 0, 224, 25, 0, 0, 0, 0, 0, 2,
-                                     0, 1, 13, 0, 0, 0, 48, 0, 0, 4, 0, 0, 0, 0, 0, 3, 0, 128, 1, 255,
-                                     255, 0, 144, 92, 2, 0, 0, 0, 0, 0, 0, 4, 0, 128, 2, 255, 255,
-                                     0, 208, 29, 2, 0, 0, 0, 0, 0, 0, 5, 0, 128, 3, 3, 0, 0, 208,
-                                     172, 4, 0, 0, 0, 0, 0, 0, 6, 0, 128, 3, 1, 0, 0, 208, 172, 4,
-                                     0, 0, 0, 0, 0, 0, 7, 0, 128, 4, 33, 0, 0, 176, 32, 9, 0, 0, 128,
-                                     250, 213, 41, 8, 0, 128, 4, 34, 0, 0, 176, 160, 49, 0, 0, 130,
-                                     250, 213, 41, 9, 0, 128, 4, 35, 0, 0, 176, 184, 23, 0, 0, 130,
-                                     250, 213, 41, 10, 0, 128, 4, 36, 0, 0, 176, 233, 2, 0, 0, 130,
-                                     250, 213, 41, 11, 0, 128, 4, 37, 0, 0, 176, 139, 3, 0, 0, 132,
-                                     250, 213, 41, 12, 0, 128, 4, 38, 0, 0, 176, 233, 2, 0, 0, 132,
-                                     250, 213, 41, 13, 0, 128, 4, 39, 0, 0, 176, 45, 4, 0, 0, 134, 250,
-                                     213, 41, 14, 0, 128, 4, 40, 0, 0, 176, 49, 29, 0, 0, 134, 250, 213,
-                                     41, 15, 0, 128, 4, 41, 0, 0, 176, 89, 26, 0, 0, 134, 250, 213, 41,
-                                     16, 0, 128, 4, 42, 0, 0, 176, 173, 61, 0, 0, 136, 250, 213, 41, 17,
-                                     0, 128, 4, 43, 0, 0, 176, 80, 67, 0, 0, 138, 250, 213, 41, 18, 0,
-                                     128, 4, 44, 0, 0, 176, 107, 46, 0, 0, 138, 250, 213, 41, 19, 0,
-                                     128, 4, 45, 0, 0, 176, 40, 26, 0, 0, 140, 250, 213, 41, 20, 0, 128,
-                                     4, 46, 0, 0, 176, 217, 23, 0, 0, 140, 250, 213, 41, 21, 0, 128, 4,
-                                     47, 0, 0, 176, 108, 3, 0, 0, 144, 250, 213, 41, 22, 0, 128, 4, 48,
-                                     0, 0, 176, 166, 80, 0, 0, 144, 250, 213, 41, 23, 0, 128, 4, 49, 0,
-                                     0, 176, 159, 62, 0, 0, 146, 250, 213, 41, 24, 0, 128, 4, 50, 0, 0,
-                                     176, 253, 15, 0, 0, 148, 250, 213, 41, 25, 0, 128, 4, 51, 0, 0,
-                                     176, 163, 24, 0, 0, 150, 250, 213, 41, 26, 0, 128, 4, 52, 0, 0,
-                                     176, 56, 25, 0, 0, 150, 250, 213, 41, 27, 0, 128, 4, 53, 0, 0,
-                                     176, 158, 22, 0, 0, 152, 250, 213, 41, 28, 0, 128, 4, 54, 0, 0,
-                                     176, 114, 19, 0, 0, 154, 250, 213, 41, 29, 0, 128, 4, 55, 0, 0,
-                                     176, 239, 23, 0, 0, 154, 250, 213, 41, 30, 0, 128, 4, 56, 0, 0,
-                                     176, 155, 35, 0, 0, 156, 250, 213, 41, 31, 0, 128, 4, 57, 0, 0,
-                                     176, 156, 19, 0, 0, 158, 250, 213, 41])
+        self.dir = DIRECTORY
 
         directory = Directory.parse(self.dir)
         self.assertEqual(directory.get_version(), (0, 1))
@@ -96,3 +100,43 @@ class FileParse(unittest.TestCase):
         self.assertFalse(file_object.is_append_only())
         self.assertFalse(file_object.is_encrypted())
         self.assertEqual(file_object.get_flags_string(), "r-eA--")
+
+
+@unittest.skipIf(fs_file.numpy is None, "NumPy not available")
+class DirectoryViewTest(unittest.TestCase):
+    def setUp(self):
+        self.view = DirectoryView.parse(DIRECTORY)
+        self.directory = Directory.parse(DIRECTORY)
+
+    def test_parse(self):
+        self.assertEqual(self.view.get_version(), (0, 1))
+        self.assertEqual(len(self.view), 31)
+        for lazy, eager in zip(self.view, self.directory.get_files()):
+            self.assertEqual(lazy.get_index(), eager.get_index())
+            self.assertEqual(lazy.get_identifier(), eager.get_identifier())
+            self.assertEqual(lazy.get_size(), eager.get_size())
+            self.assertEqual(lazy.get_date(), eager.get_date())
+            self.assertEqual(lazy.get_flags_string(), eager.get_flags_string())
+
+    def test_filter(self):
+        files = self.directory.get_files()
+        activities = self.view.filter(identifier=File.Identifier.ACTIVITY)
+        self.assertEqual(list(activities.get_indexes()),
+                         [f.get_index() for f in files if f.get_fit_sub_type() == File.Identifier.ACTIVITY])
+
+        since = datetime.datetime(2012, 3, 28, 17, 12, 32)
+        recent = self.view.filter(since=since, flags=0b10100000)
+        self.assertEqual(list(recent.get_indexes()),
+                         [f.get_index() for f in files
+                          if f.get_date().replace(tzinfo=None) >= since and f.is_readable() and f.is_erasable()])
+
+        both = self.view.filter(identifier=[File.Identifier.SETTING, File.Identifier.SPORT])
+        self.assertEqual(set(both.get_entries()["sub_type"]), set([2, 3]))
+        undated = self.view.filter(until=datetime.datetime(1990, 1, 1))
+        self.assertEqual(list(undated.get_indexes()), [1, 2, 3, 4, 5, 6])
+
+    def test_buffer(self):
+        numpy = fs_file.numpy
+        self.assertTrue(numpy.shares_memory(self.view.get_entries(), numpy.frombuffer(DIRECTORY, dtype="u1")))
+        undated = self.view.filter(until=datetime.datetime(1990, 1, 1))
+        self.assertFalse(numpy.shares_memory(undated.get_entries(), self.view.get_entries()))
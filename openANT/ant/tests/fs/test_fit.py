@@ -0,0 +1,76 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from __future__ import absolute_import, print_function
+
+import io
+import random
+import unittest
+
+from ant.fs import fit
+from ant.tests.fs.simulator import make_fit
+
+
+@unittest.skipIf(fit.numpy is None, "NumPy not available")
+class FitDecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.samples = [(random.randint(60, 200), random.randint(0, 1500)) for _ in range(1000)]
+
+    def collect(self, batches):
+        records = {}
+        for batch in batches:
+            records.setdefault(batch.get_name(), []).append(batch)
+        return records
+
+    def test_chunks(self):
+        data = bytes(make_fit(self.samples))
+        for chunk_size in (1, 7, 64, len(data)):
+            records = self.collect(fit.decode(data, chunk_size=chunk_size, batch_size=300))
+            self.assertEqual(len(records["file_id"]), 1)
+            self.assertEqual(records["file_id"][0]["serial_number"][0], 0x12345678)
+            self.assertEqual([len(batch) for batch in records["record"]], [300, 300, 300, 100])
+            heart_rate = [int(v) for batch in records["record"] for v in batch["heart_rate"]]
+            power = [int(v) for batch in records["record"] for v in batch["power"]]
+            self.assertEqual(list(zip(heart_rate, power)), self.samples)
+
+    def test_compressed_timestamps(self):
+        data = make_fit(self.samples[:100], start=1000000000, compressed=True)
+        timestamps = sorted(int(t) for batch in fit.decode(io.BytesIO(data), chunk_size=50)
+                            if batch.get_name() == "record" for t in batch.get_timestamps())
+        self.assertEqual(timestamps, list(range(1000000000, 1000000100)))
+
+    def test_chained(self):
+        data = make_fit(self.samples[:10]) + make_fit(self.samples[10:30])
+        decoder = fit.FitDecoder()
+        batches = decoder.feed(data) + decoder.close()
+        self.assertEqual(decoder.get_files(), 2)
+        self.assertEqual(sum(len(b) for b in batches if b.get_name() == "record"), 30)
+
+    def test_errors(self):
+        data = make_fit(self.samples[:10])
+        corrupt = bytearray(data)
+        corrupt[40] ^= 0xff
+        self.assertRaises(fit.FitException, list, fit.decode(bytes(corrupt)))
+        self.assertEqual(len(list(fit.decode(bytes(corrupt), check_crc=False))), 2)
+        self.assertRaises(fit.FitException, list, fit.decode(bytes(data[:-5])))
+        self.assertRaises(fit.FitException, list, fit.decode(b"\x0c" + bytes(11)))
@@ -0,0 +1,115 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ant.fs.command import AuthenticateCommand
+from ant.fs.passkey import PasskeyStore
+from ant.tests.fs.simulator import SimulatedApplication
+
+
+class PasskeyStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "devices", "passkeys.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_persist(self):
+        store = PasskeyStore(self.path)
+        self.assertIsNone(store.get(42))
+        store.set(42, [234, 85, 223, 166, 87, 48, 71, 153])
+        store.set(7, bytearray(b"\x00\x01"))
+
+        store = PasskeyStore(self.path)
+        self.assertEqual(store.get_serials(), [7, 42])
+        self.assertEqual(store.get(42), bytearray([234, 85, 223, 166, 87, 48, 71, 153]))
+        store.remove(42)
+        self.assertEqual(PasskeyStore(self.path).get_serials(), [7])
+
+    @unittest.skipIf(os.name != "posix", "POSIX permissions")
+    def test_private(self):
+        PasskeyStore(self.path).set(42, [1, 2, 3, 4])
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_corrupt(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as f:
+            f.write("{")
+        self.assertEqual(PasskeyStore(self.path).get_serials(), [])
+
+
+class Session(SimulatedApplication):
+    def on_link(self, beacon):
+        self.link()
+        return True
+
+    def on_authentication(self, beacon):
+        self.authenticate("host")
+        return True
+
+    def on_transport(self, beacon):
+        self.transport = True
+
+
+class AuthenticateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = PasskeyStore(os.path.join(self.directory, "passkeys.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_session(self, passkey=None):
+        session = Session(passkey=passkey, pair_delay=0.2)
+        session.set_passkey_store(self.store)
+        session.start()
+        self.assertTrue(session.transport)
+        return session
+
+    def test_pair_then_passkey(self):
+        first = self.run_session()
+        self.assertEqual(first.authentications, [AuthenticateCommand.Request.SERIAL,
+                                                 AuthenticateCommand.Request.PAIRING])
+        self.assertEqual(first.get_statistics().authentication, "pairing")
+        self.assertEqual(self.store.get(first.get_client_serial()), bytearray(first.passkey))
+
+        second = self.run_session(first.passkey)
+        self.assertEqual(second.authentications, [AuthenticateCommand.Request.SERIAL,
+                                                  AuthenticateCommand.Request.PASSKEY_EXCHANGE])
+        self.assertEqual(second.get_statistics().authentication, "passkey")
+        self.assertGreaterEqual(first.get_statistics().get_time_to_transport(), 0.2)
+        self.assertLess(second.get_statistics().get_time_to_transport(), 0.2)
+
+    def test_rejected_passkey(self):
+        self.store.set(0x12345678, [1, 2, 3, 4, 5, 6, 7, 8])
+        session = self.run_session([8, 7, 6, 5, 4, 3, 2, 1])
+        self.assertEqual(session.authentications, [AuthenticateCommand.Request.SERIAL,
+                                                   AuthenticateCommand.Request.PASSKEY_EXCHANGE,
+                                                   AuthenticateCommand.Request.PAIRING])
+        self.assertEqual(self.store.get(0x12345678), bytearray(session.passkey))
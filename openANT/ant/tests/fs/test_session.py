@@ -0,0 +1,100 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from __future__ import absolute_import, print_function
+
+import array
+import os
+import time
+import unittest
+
+from ant.fs.session import SessionManager
+from ant.tests.fs.simulator import SimulatedApplication
+
+
+class FakeAllocator(object):
+    def __init__(self, channels):
+        self.free = list(range(channels))
+
+    def get_free(self):
+        return self.free
+
+
+class FakeChannel(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeNode(object):
+    def __init__(self, channels):
+        self.allocator = FakeAllocator(channels)
+
+    def new_channel(self, ctype, network_number=0x00):
+        return FakeChannel(self.allocator.free.pop(0))
+
+    def release_channel(self, channel):
+        self.allocator.free.append(channel.id)
+
+
+class DownloadSession(SimulatedApplication):
+    """Downloads every file of its simulated device when started."""
+
+    def start(self):
+        self._statistics.started = time.time()
+        try:
+            self.result = dict((index, self.download(index)) for index in self.files)
+        finally:
+            self._statistics.stopped = time.time()
+            self.stop()
+
+
+class BrokenSession(SimulatedApplication):
+    def start(self):
+        self.download(99)
+
+
+class SessionManagerTest(unittest.TestCase):
+    def test_run(self):
+        nodes = [FakeNode(8), FakeNode(4)]
+        manager = SessionManager(nodes)
+        files = [{1: array.array('B', os.urandom(3000 + n)), 2: array.array('B', os.urandom(n))}
+                 for n in range(6)]
+        sessions = [manager.add(DownloadSession, device) for device in files]
+
+        # Least busy node first, 8 free channels against 4
+        self.assertEqual([session._node for session in sessions],
+                         [nodes[0]] * 4 + [nodes[0], nodes[1]])
+
+        statistics = manager.run()
+        for session, device in zip(sessions, files):
+            self.assertEqual(session.result, device)
+        self.assertEqual(statistics.downloaded, sum(3000 + 2 * n for n in range(6)))
+        self.assertGreater(statistics.get_throughput(), 0)
+        self.assertEqual([len(node.allocator.get_free()) for node in nodes], [8, 4])
+        self.assertEqual(manager.get_errors(), {})
+
+    def test_error(self):
+        manager = SessionManager([FakeNode(8)])
+        session = manager.add(BrokenSession, {})
+        manager.run()
+        self.assertIsInstance(manager.get_errors()[session], KeyError)
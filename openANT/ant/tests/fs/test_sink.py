@@ -0,0 +1,69 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from __future__ import absolute_import, print_function
+
+import array
+import os
+import shutil
+import tempfile
+import unittest
+
+from ant.fs.sink import ArraySink, FileSink, MmapSink, Progress
+from ant.tests.fs.simulator import SimulatedApplication
+
+
+class SinkTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data = array.array('B', os.urandom(5000))
+        self.application = SimulatedApplication({5: self.data})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_array(self):
+        self.assertEqual(self.application.download(5), self.data)
+        sink = self.application.download(5, sink=ArraySink())
+        self.assertEqual(sink.get_data(), self.data)
+
+    def test_file(self):
+        path = os.path.join(self.directory, "file")
+        self.application.download(5, sink=FileSink(path))
+        with open(path, "rb") as f:
+            self.assertEqual(array.array('B', f.read()), self.data)
+
+    def test_mmap(self):
+        path = os.path.join(self.directory, "mmap")
+        self.application.download(5, sink=MmapSink(path))
+        with open(path, "rb") as f:
+            self.assertEqual(array.array('B', f.read()), self.data)
+
+    def test_progress(self):
+        updates = []
+        progress = Progress(lambda p: updates.append(p.get_bytes()))
+        self.application.download(5, progress=progress)
+        self.assertEqual(updates, [512, 1024, 1536, 2048, 2560, 3072, 3584, 4096, 4608, 5000])
+        self.assertEqual(progress.get_fraction(), 1.0)
+        self.assertEqual(progress.get_total(), 5000)
+        self.assertGreaterEqual(progress.get_rate(), 0.0)
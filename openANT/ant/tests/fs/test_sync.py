@@ -0,0 +1,102 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from __future__ import absolute_import, print_function
+
+import array
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from ant.fs.cache import DownloadCache
+from ant.fs.file import Directory, File
+from ant.fs.sync import Manifest, SyncEngine
+from ant.tests.fs.simulator import SimulatedApplication
+
+
+class SyncApplication(SimulatedApplication):
+    """Serves a fixed directory, records the downloaded indexes."""
+
+    def __init__(self, files):
+        SimulatedApplication.__init__(self, dict((index, data) for index, (_, data) in files.items()))
+        self._entries = [entry for entry, _ in files.values()]
+
+    def download_directory(self, callback=None):
+        return Directory((1, 0), 0, 0, 0, self._entries)
+
+    def get_downloads(self):
+        return sorted(index for _, index, offset in self.requests if offset == 0)
+
+
+def make_file(index, size, day, flags=0b10100000):
+    entry = File(index, File.Type.FIT, b"\x04\x00\x00", 0, flags, size,
+                 datetime.datetime(2024, 5, day, 8, 0))
+    return index, (entry, array.array('B', os.urandom(size)))
+
+
+class SyncTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = DownloadCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_incremental(self):
+        files = dict([make_file(1, 1000, 1), make_file(2, 3000, 2), make_file(3, 0, 3)])
+        application = SyncApplication(files)
+        result = SyncEngine(application, self.cache).sync()
+        # The empty file needs no request
+        self.assertEqual(application.get_downloads(), [1, 2])
+        self.assertEqual(len(result.get_downloaded()), 3)
+        self.assertEqual(result.read(files[2][0]), files[2][1])
+
+        # Changed, new, removed and archived files
+        files.update([make_file(2, 3500, 2), make_file(4, 700, 4)])
+        del files[3]
+        files[1][0]._flags |= 0b00010000
+        application = SyncApplication(files)
+        result = SyncEngine(application, self.cache).sync()
+        self.assertEqual(application.get_downloads(), [2, 4])
+        self.assertEqual([f.get_index() for f in result.get_unchanged()], [1])
+        self.assertEqual(result.get_removed(), [3])
+        self.assertEqual(result.read(files[1][0]), files[1][1])
+        self.assertEqual(result.read(files[2][0]), files[2][1])
+
+        manifest = Manifest(os.path.join(self.directory, str(0x12345678), "manifest.json"))
+        self.assertEqual(manifest.get_indexes(), [1, 2, 4])
+
+        # The removed file and the old version of the changed one left the cache
+        cached = sorted(os.listdir(os.path.join(self.directory, str(0x12345678))))
+        self.assertEqual(cached, ["00001_1000_20240501080000", "00001_1000_20240501080000.json",
+                                  "00002_3500_20240502080000", "00002_3500_20240502080000.json",
+                                  "00004_700_20240504080000", "00004_700_20240504080000.json",
+                                  "manifest.json"])
+
+    def test_select(self):
+        files = dict([make_file(1, 1000, 1), make_file(2, 3000, 2), make_file(3, 10, 3, flags=0)])
+        application = SyncApplication(files)
+        SyncEngine(application, self.cache).sync(select=lambda f: f.get_size() < 2000)
+        self.assertEqual(application.get_downloads(), [1])
@@ -0,0 +1,106 @@
+# Ant
+#
+# Copyright (c) 2012, Gustav Tiger <gustav@tiger.name>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+from __future__ import absolute_import, print_function
+
+import array
+import os
+import unittest
+
+from ant.fs.command import Command, UploadDataCommand
+from ant.fs.manager import AntFSUploadException
+from ant.tests.fs.simulator import SimulatedApplication
+
+
+class UploadDataCommandTest(unittest.TestCase):
+    def test_padding(self):
+        data = array.array('B', range(1, 12))
+        packed = UploadDataCommand(0x1234, 16, memoryview(data), 0xabcd).get()
+        self.assertEqual(len(packed), 8 + 16 + 8)
+        self.assertEqual(packed[:8].tolist(), [0x44, Command.Type.UPLOAD_DATA, 0x34, 0x12, 16, 0, 0, 0])
+        self.assertEqual(packed[8:19], data)
+        self.assertEqual(packed[19:30].tolist(), [0] * 11)
+        self.assertEqual(packed[30:].tolist(), [0xcd, 0xab])
+
+    def test_aligned(self):
+        packed = UploadDataCommand(0, 0, bytearray(16), 0).get()
+        self.assertEqual(len(packed), 32)
+
+
+class UploadTest(unittest.TestCase):
+    def setUp(self):
+        self.data = array.array('B', os.urandom(5000))
+
+    def get_requests(self, application):
+        return [r for r in application.requests if r[0] == Command.Type.UPLOAD_REQUEST]
+
+    def test_request_per_block(self):
+        application = SimulatedApplication()
+        fractions = []
+        application.upload(2, self.data, fractions.append)
+        self.assertEqual(application.files[2], self.data)
+        self.assertEqual(len(self.get_requests(application)), 10)
+        self.assertEqual(fractions[-1], 1.0)
+
+    def test_consecutive(self):
+        application = SimulatedApplication()
+        application.set_consecutive_upload(True)
+        fractions = []
+        application.upload(2, self.data, fractions.append)
+        self.assertEqual(application.files[2], self.data)
+        self.assertEqual(len(self.get_requests(application)), 1)
+        self.assertEqual(fractions[-1], 1.0)
+
+    def test_fallback(self):
+        application = SimulatedApplication(consecutive=False)
+        application.set_consecutive_upload(True)
+        application.upload(2, bytearray(self.data))
+        self.assertEqual(application.files[2], self.data)
+        self.assertEqual(len(self.get_requests(application)), 10)
+        self.assertFalse(application._upload_consecutive)
+
+    def test_fallback_ignored(self):
+        # The device does not answer consecutive data at all
+        application = SimulatedApplication(consecutive=False)
+        application.ignore_consecutive = True
+        application.response_timeout = 0.01
+        application.set_consecutive_upload(True)
+        application.upload(2, self.data)
+        self.assertEqual(application.files[2], self.data)
+        self.assertEqual(len(self.get_requests(application)), 10)
+        self.assertFalse(application._upload_consecutive)
+
+    def test_retry(self):
+        application = SimulatedApplication()
+        application.reject = 2
+        application.upload(2, self.data)
+        self.assertEqual(application.files[2], self.data)
+
+        application = SimulatedApplication()
+        application.reject = 100
+        self.assertRaises(AntFSUploadException, application.upload, 2, self.data)
+
+    def test_empty(self):
+        application = SimulatedApplication()
+        application.upload(2, [])
+        self.assertEqual(application.files[2], array.array('B'))